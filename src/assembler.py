@@ -0,0 +1,229 @@
+# Assembler for the simulator's assembly language.
+#
+# Source format: one instruction per line, the opcode followed by its operands separated by commas
+# and/or whitespace, e.g. "SUB, 1, 4, 12". A "#" or ";" starts a comment. A line may start with one
+# or more labels ("loop:" or "loop: ADD, 1, 2, 3"), and a label can be used in place of any operand
+# (usually a branch target), where it stands for the address of the instruction it labels.
+#
+# Binary format: a 32 byte header (magic, instruction count, mtime and size of the source file it
+# was assembled from) followed by one 16 byte word per instruction: the opcode number and three
+# signed 32 bit operands (unused operands are 0). Binary programs are memory-mapped and unpacked
+# without any text parsing; a truncated program or a word that isn't a valid instruction raises
+# AssemblyError with its byte offset. Assembled text files are cached in binary form in a __pycache__ folder
+# next to the source and reused as long as the source file is unchanged.
+
+import mmap
+import os
+import struct
+import sys
+
+from isa import OPCODES as ISA
+
+# opcode -> number of operands, in binary opcode number order
+OPCODES = {name: opcode.arity for name, opcode in ISA.items()}
+OPCODE_NAMES = list(OPCODES)
+OPCODE_NUMBERS = {op: i for i, op in enumerate(OPCODE_NAMES)}
+# per opcode number: name, number of operands, the zero unused operands, register and jump target positions
+LAYOUT = [(name, opcode.arity, (0,) * (3 - opcode.arity),
+           tuple(i for i, kind in enumerate(opcode.operands, 1) if kind in 'rwa'), opcode.target)
+          for name, opcode in ISA.items()]
+
+MAGIC = b'CPUSIMB1'
+HEADER = struct.Struct('<8sQqQ')
+WORD = struct.Struct('<I3i')
+
+
+class AssemblyError(ValueError):
+    def __init__(self, message, line=None, source='<program>', offset=None):
+        if line is not None:
+            message = source + ':' + str(line) + ': ' + message
+        elif offset is not None:
+            message = source + ': byte ' + str(offset) + ': ' + message
+        super().__init__(message)
+        self.line = line
+        self.offset = offset
+
+# -----------------------------------------------------------------------------------
+# ----TEXT----
+
+def tokenize(line):
+    if '#' in line:
+        line = line.split('#', 1)[0]
+    if ';' in line:
+        line = line.split(';', 1)[0]
+    labels = []
+    while ':' in line:
+        label, line = line.split(':', 1)
+        labels.append(label.strip())
+        line = line.strip()
+    tokens = line.replace(',', ' ').split()
+    return labels, tokens
+
+def parse_operand(token):
+    try:
+        return int(token)
+    except ValueError:
+        return token
+
+def assemble(text, source='<program>'):
+    lines = []
+    labels = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line_labels, tokens = tokenize(line)
+        for label in line_labels:
+            if not label.isidentifier():
+                raise AssemblyError('invalid label ' + repr(label), number, source)
+            if label in labels:
+                raise AssemblyError('label ' + repr(label) + ' defined twice', number, source)
+            labels[label] = len(lines)
+        if tokens:
+            lines.append((number, tokens))
+
+    program = []
+    for number, tokens in lines:
+        op = tokens[0].upper()
+        if op not in OPCODES:
+            raise AssemblyError('unknown opcode ' + repr(tokens[0]), number, source)
+        try:
+            operands = [int(token) for token in tokens[1:]]
+        except ValueError:
+            operands = []
+            for token in tokens[1:]:
+                operand = parse_operand(token)
+                if isinstance(operand, str):
+                    if operand not in labels:
+                        raise AssemblyError('undefined label ' + repr(operand), number, source)
+                    operand = labels[operand]
+                operands.append(operand)
+        if len(operands) != OPCODES[op]:
+            raise AssemblyError(op + ' takes ' + str(OPCODES[op]) + ' operands, got ' + str(len(operands)), number, source)
+        program.append((op, *operands))
+    return program
+
+# program as source text in the format of the programs in benchmarks/, one "OP, a, b" line per instruction
+def disassemble(program):
+    return ''.join(', '.join(str(item) for item in instr) + '\n' for instr in program)
+
+def write_text(path, program):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        for start in range(0, len(program), 65536):
+            f.write(disassemble(program[start:start + 65536]))
+    os.replace(tmp, path)
+
+# -----------------------------------------------------------------------------------
+# ----BINARY----
+
+def encode(program, mtime_ns=0, source_size=0):
+    data = bytearray(HEADER.pack(MAGIC, len(program), mtime_ns, source_size))
+    for pc, instr in enumerate(program):
+        op = instr[0]
+        if op not in OPCODE_NUMBERS or len(instr) - 1 != OPCODES[op]:
+            raise AssemblyError('cannot encode ' + repr(instr) + ' at address ' + str(pc))
+        operands = list(instr[1:]) + [0] * (3 - len(instr[1:]))
+        try:
+            data += WORD.pack(OPCODE_NUMBERS[op], *operands)
+        except struct.error:
+            raise AssemblyError('operands of ' + repr(instr) + ' at address ' + str(pc) + ' are not 32 bit integers')
+    return bytes(data)
+
+# registers can't be negative and jump targets have to be in the program (or right after its end)
+def decode_words(buffer, count, source='<program>'):
+    end = HEADER.size + count * WORD.size
+    if len(buffer) < end:
+        raise AssemblyError('truncated binary program, ' + str(count) + ' instructions need ' + str(end) + ' bytes',
+                            source=source, offset=len(buffer))
+    program = []
+    for pc, word in enumerate(WORD.iter_unpack(buffer[HEADER.size:end])):
+        number = word[0]
+        if number >= len(LAYOUT):
+            raise AssemblyError('unknown opcode number ' + str(number), source=source,
+                                offset=HEADER.size + pc * WORD.size)
+        name, arity, unused, registers, target = LAYOUT[number]
+        instr = (name,) + word[1:arity + 1]
+        if word[arity + 1:] != unused:
+            raise AssemblyError(name + ' takes ' + str(arity) + ' operands, got ' + repr(word[1:]), source=source,
+                                offset=HEADER.size + pc * WORD.size)
+        for i in registers:
+            if instr[i] < 0:
+                raise AssemblyError('negative register ' + str(instr[i]) + ' in ' + repr(instr), source=source,
+                                    offset=HEADER.size + pc * WORD.size + 4 * i)
+        if target is not None and not 0 <= instr[target] <= count:
+            raise AssemblyError('jump target ' + str(instr[target]) + ' outside the program in ' + repr(instr),
+                                source=source, offset=HEADER.size + pc * WORD.size + 4 * target)
+        program.append(instr)
+    return program
+
+def read_header(buffer):
+    if len(buffer) < HEADER.size:
+        return None
+    magic, count, mtime_ns, source_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        return None
+    return count, mtime_ns, source_size
+
+def write_binary(path, program, mtime_ns=0, source_size=0):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(encode(program, mtime_ns, source_size))
+    os.replace(tmp, path)
+
+# returns (program, mtime_ns, source_size) or None if path isn't a binary program, raises AssemblyError
+# if it is a damaged one
+def read_binary(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header = read_header(mapped)
+            if header is None:
+                return None
+            count, mtime_ns, source_size = header
+            with memoryview(mapped) as view:
+                return decode_words(view, count, path), mtime_ns, source_size
+
+# -----------------------------------------------------------------------------------
+# ----FILES----
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, '__pycache__', name + '.cpusim')
+
+# loads a binary or text program; text programs go through the binary cache unless cache=False
+def load_file(path, cache=True):
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        binary = read_binary(path)
+        if binary is None:
+            raise AssemblyError('truncated binary program header', source=path, offset=os.path.getsize(path))
+        return binary[0]
+
+    st = os.stat(path)
+    cached = cache_path(path)
+    if cache and os.path.exists(cached):
+        try:
+            binary = read_binary(cached)
+        except AssemblyError:
+            # a damaged cache is assembled again
+            binary = None
+        if binary is not None and binary[1] == st.st_mtime_ns and binary[2] == st.st_size:
+            return binary[0]
+
+    with open(path, 'r') as f:
+        program = assemble(f.read(), path)
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            write_binary(cached, program, st.st_mtime_ns, st.st_size)
+        except OSError:
+            # a read-only checkout just doesn't get a cache
+            pass
+    return program
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('The correct command format is: python3 assembler.py program.txt program.bin')
+    else:
+        write_binary(sys.argv[2], load_file(sys.argv[1], cache=False))
@@ -0,0 +1,135 @@
+# Batched version of CPUSimple: runs one program over many independent machine states at once.
+# The register files and data memories of all lanes are rows of two 2-D numpy arrays. At every
+# step the lanes that haven't stopped are grouped by pc and each group executes its instruction as
+# one vectorized numpy operation, so lanes that branched differently simply end up in different
+# groups. Instructions live in a separate store (like NumpyState), so programs can't rewrite
+# themselves here. Timing follows CPUSimple: fetch, decode and execute take a cycle each.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BatchSimple:
+    def __init__(self, lanes, mem_size=1024, reg_size=32, dtype='int64'):
+        if np is None:
+            raise ImportError('BatchSimple needs numpy, install it with "pip install numpy"')
+        self.lanes = lanes
+        self.mem_size = mem_size
+        self.reg_size = reg_size
+        self.mem = np.zeros((lanes, mem_size), dtype=dtype)
+        self.rf = np.zeros((lanes, reg_size), dtype=dtype)
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.finished = np.zeros(lanes, dtype=bool)
+        self.program = []
+# ----METRICS----
+        self.cycle_cntr = np.zeros(lanes, dtype=np.int64)
+        self.instr_cntr = np.zeros(lanes, dtype=np.int64)
+
+#-----------------------------------------------------------------------------------
+# ----PROCESSOR FUNCTIONS----
+
+    def load_program(self, program):
+        self.program = list(program)
+        n = self.mem_size
+        self.mem[:, 900] = n-1
+        self.mem[:, 901] = n
+        self.pc[:] = 0
+
+# execute the instruction at pc for the lanes in idx (an array of lane numbers)
+    def execute(self, pc, idx):
+        instr = self.program[pc]
+        op = instr[0]
+        rf = self.rf
+        mem = self.mem
+        next_pc = pc + 1
+        if op == 'LOAD':
+            rf[idx, instr[2]] = mem[idx, rf[idx, instr[1]]]
+        elif op == 'VLOAD':
+            rf[idx, instr[2]] = mem[idx, instr[1]]
+        elif op == 'STORE':
+            mem[idx, rf[idx, instr[1]]] = rf[idx, instr[2]]
+        elif op == 'VSTORE':
+            mem[idx, instr[1]] = rf[idx, instr[2]]
+        elif op == 'ADD':
+            rf[idx, instr[3]] = rf[idx, instr[1]] + rf[idx, instr[2]]
+        elif op == 'SUB':
+            rf[idx, instr[3]] = rf[idx, instr[1]] - rf[idx, instr[2]]
+        elif op == 'MUL':
+            rf[idx, instr[3]] = rf[idx, instr[1]] * rf[idx, instr[2]]
+        elif op == 'AND':
+            # same result as Python's "a and b"
+            a = rf[idx, instr[1]]
+            rf[idx, instr[3]] = np.where(a != 0, rf[idx, instr[2]], a)
+        elif op == 'OR':
+            a = rf[idx, instr[1]]
+            rf[idx, instr[3]] = np.where(a != 0, a, rf[idx, instr[2]])
+        elif op == 'JUMP':
+            next_pc = instr[1]
+        elif op == 'BRANCH_LT':
+            next_pc = np.where(rf[idx, instr[1]] < rf[idx, instr[2]], instr[3], pc + 1)
+        elif op == 'BRANCH_ZERO':
+            next_pc = np.where(rf[idx, instr[1]] == 0, instr[2], pc + 1)
+        elif op == 'STOP':
+            self.finished[idx] = True
+        elif op == 'MOV':
+            rf[idx, instr[1]] = rf[idx, instr[2]]
+        elif op == 'CMP_LT':
+            rf[idx, instr[3]] = rf[idx, instr[1]] < rf[idx, instr[2]]
+        elif op == 'CMP_EQ':
+            rf[idx, instr[3]] = rf[idx, instr[1]] == rf[idx, instr[2]]
+        elif op == 'AMOADD':
+            # every lane has its own memory, so the atomics are a plain read-modify-write per lane
+            addr = rf[idx, instr[1]]
+            old = mem[idx, addr]
+            mem[idx, addr] = old + rf[idx, instr[2]]
+            rf[idx, instr[3]] = old
+        elif op == 'AMOSWAP':
+            addr = rf[idx, instr[1]]
+            old = mem[idx, addr]
+            mem[idx, addr] = rf[idx, instr[2]]
+            rf[idx, instr[3]] = old
+        elif op in ('NOP', 'FENCE'):
+            pass
+        else:
+            raise ValueError('unknown instruction at address ' + str(pc) + ': ' + repr(instr))
+        self.pc[idx] = next_pc
+
+# one instruction for every lane that is still running, returns the number of running lanes
+    def step(self):
+        active = np.flatnonzero(~self.finished)
+        if len(active) == 0:
+            return 0
+        pcs = self.pc[active]
+        # small programs let the stable sort run as a radix sort over 16-bit keys
+        if len(self.program) < 2**16 and pcs.min() >= 0:
+            order = np.argsort(pcs.astype(np.uint16), kind='stable')
+        else:
+            order = np.argsort(pcs, kind='stable')
+        lanes = active[order]
+        pcs = pcs[order]
+        bounds = np.flatnonzero(pcs[1:] != pcs[:-1]) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(lanes)]))
+        for start, end in zip(starts, ends):
+            pc = int(pcs[start])
+            if not 0 <= pc < len(self.program):
+                raise IndexError('lanes ' + str(lanes[start:end].tolist()) + ' jumped outside the program to ' + str(pc))
+            self.execute(pc, lanes[start:end])
+        self.instr_cntr[active] += 1
+        self.cycle_cntr[active] += 3
+        return len(active)
+
+#-----------------------------------------------------------------------------------
+
+# returns the per-lane instruction and cycle counts and the final memory of every lane
+    def run(self, max_steps=None):
+        self.pc[:] = 0
+        self.finished[:] = False
+        steps = 0
+        while self.step():
+            steps += 1
+            if max_steps is not None and steps >= max_steps:
+                break
+        return self.instr_cntr.copy(), self.cycle_cntr.copy(), self.mem
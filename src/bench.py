@@ -0,0 +1,279 @@
+# Host performance benchmarks of the CPU models.
+# Runs the programs in benchmarks/ in every mode over scalable inputs and measures how fast the host
+# simulates them: simulated instructions per host second of the best of "repeats" timed runs, after
+# "warmup" untimed ones. Only cpu.run(verbose=False) (or run_jit) is timed, loading the program and
+# writing the input aren't. The results can be saved as a JSON baseline that later runs are checked
+# against: the instruction and cycle counts of every case must be exactly the same as in the baseline,
+# and its speed may not drop by more than "tolerance". The fast and jit modes must also count exactly
+# what the simple mode counts. Speeds are only comparable on the same host, the baseline records it, and
+# cases that run for less than MIN_SECONDS are too short to time reliably, only their counts are checked.
+# benchmarks/baseline.json holds the counts (and the speeds on the host it was made on) of the default cases.
+# --check also runs the consistency checks: every configuration in CONFIGS run through a shared result
+# cache must get its own counts and statistics back, not the cached ones of another configuration, and a
+# run paused after STEPS cycles and continued with run() must count exactly like an uninterrupted one.
+#
+# usage: python3 bench.py [--programs bubblesort.txt ...] [--modes simple fast ...] [--sizes 10 100]
+#                         [--repeats 5] [--warmup 1] [--save baseline.json]
+#                         [--check ../benchmarks/baseline.json [--tolerance 0.25] [--counts-only]]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from branch import make_branch_unit
+from cache import default_hierarchy
+from hazards import HazardModel
+from result_cache import ResultCache, cached_run
+from simple import CPUSimple
+from pipelined import CPUPipelined
+from superscalar import CPUSuperscalar
+from fast import CPUFast
+from tomasulo import CPUTomasulo
+from sweep import INPUTS, cached_program, memory_size
+
+# mode -> cpu for a memory of mem_size words, "name:predictor" gives the model a branch predictor
+MODES = {
+    'simple': lambda mem_size: CPUSimple(mem_size),
+    'pipelined': lambda mem_size: CPUPipelined(mem_size),
+    'pipelined:gshare': lambda mem_size: CPUPipelined(mem_size, branch_unit=make_branch_unit('gshare')),
+    'superscalar': lambda mem_size: CPUSuperscalar(mem_size),
+    'superscalar:gshare': lambda mem_size: CPUSuperscalar(mem_size, branch_unit=make_branch_unit('gshare')),
+    'fast': lambda mem_size: CPUFast(mem_size),
+    'jit': lambda mem_size: CPUSimple(mem_size),
+    'tomasulo': lambda mem_size: CPUTomasulo(mem_size),
+}
+
+# machines that differ from the modes only in their configuration, for the consistency checks
+CONFIGS = dict(MODES, **{
+    'pipelined:hazards': lambda mem_size: CPUPipelined(mem_size, hazard_model=HazardModel(5, True)),
+    'pipelined:hazards-no-forwarding': lambda mem_size: CPUPipelined(mem_size, hazard_model=HazardModel(5, False)),
+    'pipelined:bimodal': lambda mem_size: CPUPipelined(mem_size, branch_unit=make_branch_unit('bimodal')),
+    'simple:cache': lambda mem_size: CPUSimple(mem_size, hierarchy=default_hierarchy()),
+    'tomasulo:width8': lambda mem_size: CPUTomasulo(mem_size, width=8),
+    'tomasulo:rob8': lambda mem_size: CPUTomasulo(mem_size, rob_size=8),
+})
+
+# modes that have to count exactly like another one
+SAME_COUNTS = {'fast': 'simple', 'jit': 'simple'}
+
+# input sizes per program; raw.txt and indepenent_arithmetic.txt have a fixed input and run once.
+# bubblesort is quadratic, 10000 elements are about 10^9 simulated instructions
+SIZES = {
+    'bubblesort.txt': [10, 100],
+    'fibonacci.txt': [10, 1000],
+}
+FIXED_SIZE = [10]
+
+MIN_SECONDS = 0.01
+
+# cycles after which the step check pauses a run
+STEPS = [1, 5, 37]
+
+# -----------------------------------------------------------------------------------
+# ----MEASUREMENT----
+
+def case_key(program, mode, size):
+    return program + ' ' + mode + ' ' + str(size)
+
+def make_cases(programs, modes, sizes=None):
+    cases = []
+    for program in programs:
+        if program not in INPUTS:
+            raise ValueError('no input generator for program ' + program)
+        if program in SIZES:
+            program_sizes = sizes or SIZES[program]
+        else:
+            program_sizes = FIXED_SIZE
+        for mode in modes:
+            if mode not in MODES:
+                raise ValueError('mode must be one of: ' + ', '.join(MODES))
+            for size in program_sizes:
+                cases.append((program, mode, size))
+    return cases
+
+# one run of a case, returns (instructions, cycles, host seconds of the run)
+def run_case(program, mode, size, seed=0):
+    cpu = MODES[mode](memory_size(program, size))
+    cpu.load_program(cached_program(program))
+    INPUTS[program](cpu, size, seed)
+    start_time = time.perf_counter()
+    if mode == 'jit':
+        instr, cycles, ipc = cpu.run_jit(verbose=False)
+    else:
+        instr, cycles, ipc = cpu.run(verbose=False)
+    seconds = time.perf_counter() - start_time
+    return int(instr), int(cycles), seconds
+
+# the counts must be the same in every run of a case, the time is the best of the timed runs
+def measure(program, mode, size, repeats=5, warmup=1):
+    counts = None
+    times = []
+    for i in range(warmup + repeats):
+        instr, cycles, seconds = run_case(program, mode, size)
+        if counts is None:
+            counts = (instr, cycles)
+        elif counts != (instr, cycles):
+            raise RuntimeError(case_key(program, mode, size) + ' counted ' + str((instr, cycles)) + ' after '
+                               + str(counts) + ', the simulation isn\'t deterministic')
+        if i >= warmup:
+            times.append(seconds)
+    best = min(times)
+    return {
+        'instr': counts[0],
+        'cycles': counts[1],
+        'seconds': best,
+        'median_seconds': sorted(times)[len(times) // 2],
+        'ips': counts[0] / best if best > 0 else float('inf'),
+    }
+
+def host():
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+    }
+
+def run_benchmarks(cases, repeats=5, warmup=1, out=sys.stdout):
+    results = {}
+    for program, mode, size in cases:
+        result = results[case_key(program, mode, size)] = measure(program, mode, size, repeats, warmup)
+        if out is not None:
+            print('%-48s %12d instr %12d cycles %12.0f instr/s' % (
+                case_key(program, mode, size), result['instr'], result['cycles'], result['ips']), file=out)
+    return {'host': host(), 'repeats': repeats, 'warmup': warmup, 'results': results}
+
+# -----------------------------------------------------------------------------------
+# ----REGRESSION CHECKS----
+
+# returns the list of problems of a run: changed counts, modes that disagree and slower cases
+def check(run, baseline=None, tolerance=0.25, counts_only=False):
+    problems = []
+    results = run['results']
+    for key, result in results.items():
+        program, mode, size = key.split(' ')
+        if mode in SAME_COUNTS:
+            reference = results.get(case_key(program, SAME_COUNTS[mode], size))
+            if reference is not None and (result['instr'], result['cycles']) != (reference['instr'], reference['cycles']):
+                problems.append(key + ': counts ' + str((result['instr'], result['cycles'])) + ' differ from '
+                                + SAME_COUNTS[mode] + ' ' + str((reference['instr'], reference['cycles'])))
+    if baseline is None:
+        return problems
+    compare_speed = not counts_only
+    if compare_speed and baseline.get('host') != run['host']:
+        print('baseline was measured on another host, only the counts are checked', file=sys.stderr)
+        compare_speed = False
+    for key, result in results.items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        if (result['instr'], result['cycles']) != (base['instr'], base['cycles']):
+            problems.append(key + ': counts ' + str((result['instr'], result['cycles'])) + ', baseline '
+                            + str((base['instr'], base['cycles'])))
+        elif (compare_speed and min(result['seconds'], base['seconds']) >= MIN_SECONDS
+                and result['ips'] < base['ips'] * (1 - tolerance)):
+            problems.append(key + ': %.0f instr/s, baseline %.0f (%.1f%% slower)' % (
+                result['ips'], base['ips'], 100.0 * (1 - result['ips'] / base['ips'])))
+    return problems
+
+# -----------------------------------------------------------------------------------
+# ----CONSISTENCY CHECKS----
+
+def setup(make, program, size, seed=0):
+    cpu = make(memory_size(program, size))
+    cpu.load_program(cached_program(program))
+    INPUTS[program](cpu, size, seed)
+    return cpu
+
+# what a run leaves behind besides its counts: the final state and the statistics reported after it
+def statistics(cpu):
+    reports = [getattr(cpu, name).report() for name in ('branch_unit', 'hazard_model', 'hierarchy')
+               if getattr(cpu, name, None) is not None]
+    counters = [getattr(cpu, name, None) for name in ('mispredictions', 'squashed', 'rob_full_stalls', 'rs_full_stalls')]
+    return reports, counters, cpu.pc, list(cpu.mem), list(cpu.rf)
+
+# Every configuration goes through one result cache, a key that misses part of the configuration hands
+# one of them the counts of another. The second run of each is a hit and has to leave the cpu as the run did.
+def check_result_cache(programs, sizes=FIXED_SIZE):
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory)
+        for program in programs:
+            for size in sizes:
+                for name, make in CONFIGS.items():
+                    cpu = setup(make, program, size)
+                    expected = cpu.run(verbose=False)
+                    expected_statistics = statistics(cpu)
+                    for _ in range(2):
+                        cpu = setup(make, program, size)
+                        cached = cached_run(cpu, cached_program(program), cache, verbose=False)
+                        if cached != expected:
+                            problems.append(case_key(program, name, size) + ': result cache returned '
+                                            + str(cached[:2]) + ', the run counts ' + str(expected[:2]))
+                        elif statistics(cpu) != expected_statistics:
+                            problems.append(case_key(program, name, size) + ': result cache hit left different statistics')
+    return problems
+
+# step(n) and run() only ever stop between two clocks, so pausing a run must not change its counts
+def check_step_run(programs, sizes=FIXED_SIZE):
+    problems = []
+    for program in programs:
+        for size in sizes:
+            for name, make in CONFIGS.items():
+                expected = setup(make, program, size).run(verbose=False)
+                for n in STEPS:
+                    cpu = setup(make, program, size)
+                    cpu.step(n)
+                    result = cpu.run(verbose=False)
+                    if result != expected:
+                        problems.append(case_key(program, name, size) + ': step(' + str(n) + ') and run() count '
+                                        + str(result[:2]) + ', run() alone ' + str(expected[:2]))
+    return problems
+
+def save(run, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(run, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure and check the host speed of the CPU models.')
+    parser.add_argument('--programs', nargs='+', default=list(INPUTS))
+    parser.add_argument('--modes', nargs='+', default=list(MODES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=None,
+                        help='input sizes of bubblesort and fibonacci (default: ' + str(SIZES) + ')')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--save', default=None, help='write the results as a JSON baseline')
+    parser.add_argument('--check', default=None, help='JSON baseline to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--counts-only', action='store_true', help='only check the instruction and cycle counts')
+    args = parser.parse_args()
+
+    # a baseline to check against defines the cases unless they are given
+    baseline = load(args.check) if args.check else None
+    if baseline is not None and args.sizes is None and args.programs == list(INPUTS) and args.modes == list(MODES):
+        cases = [tuple(key.split(' ')) for key in baseline['results']]
+        cases = [(program, mode, int(size)) for program, mode, size in cases]
+    else:
+        cases = make_cases(args.programs, args.modes, args.sizes)
+
+    run = run_benchmarks(cases, args.repeats, args.warmup)
+    problems = check(run, baseline, args.tolerance, args.counts_only)
+    if args.check:
+        programs = sorted({program for program, _, _ in cases})
+        problems += check_result_cache(programs) + check_step_run(programs)
+    if args.save:
+        save(run, args.save)
+    for problem in problems:
+        print('REGRESSION ' + problem)
+    if problems:
+        sys.exit(1)
@@ -0,0 +1,184 @@
+# Branch prediction for the pipelined and superscalar models.
+# A BranchUnit combines a direction predictor for BRANCH_LT/BRANCH_ZERO with a branch target buffer
+# (BTB). The fetch stage asks it for the pc to fetch after a control instruction, the execute stage
+# reports the real next pc and gets back the number of cycles lost to the flush if the prediction was
+# wrong. Targets are only known at fetch through the BTB, so a branch or JUMP that hasn't been taken
+# before is always fetched past. The predictor tables are plain lists of 2-bit saturating counters.
+#
+# usage:
+#     cpu = CPUPipelined(branch_unit=make_branch_unit('gshare'))
+#     cpu.run()
+#     print(cpu.branch_unit.report())
+
+from isa import CONTROL
+
+
+def is_control(instr):
+    return isinstance(instr, tuple) and instr[0] in CONTROL
+
+# -----------------------------------------------------------------------------------
+# ----DIRECTION PREDICTORS----
+
+class StaticNotTaken:
+    def config(self):
+        return {'kind': 'static'}
+
+    def predict(self, pc):
+        return False
+
+    def update(self, pc, taken):
+        pass
+
+
+# entries has to be a power of two
+class Bimodal:
+    def __init__(self, entries=1024):
+        self.mask = entries - 1
+        # counters start weakly not taken
+        self.counters = [1] * entries
+
+    def config(self):
+        return {'kind': 'bimodal', 'entries': self.mask + 1}
+
+    def predict(self, pc):
+        return self.counters[pc & self.mask] >= 2
+
+    def update(self, pc, taken):
+        i = pc & self.mask
+        if taken:
+            if self.counters[i] < 3:
+                self.counters[i] += 1
+        elif self.counters[i] > 0:
+            self.counters[i] -= 1
+
+
+# the global history is updated when a branch resolves, not speculatively at fetch
+class GShare:
+    def __init__(self, entries=1024, history_bits=8):
+        self.mask = entries - 1
+        self.history_mask = (1 << history_bits) - 1
+        self.history = 0
+        self.counters = [1] * entries
+
+    def config(self):
+        return {'kind': 'gshare', 'entries': self.mask + 1, 'history_bits': self.history_mask.bit_length()}
+
+    def index(self, pc):
+        return (pc ^ self.history) & self.mask
+
+    def predict(self, pc):
+        return self.counters[self.index(pc)] >= 2
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        if taken:
+            if self.counters[i] < 3:
+                self.counters[i] += 1
+        elif self.counters[i] > 0:
+            self.counters[i] -= 1
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+
+PREDICTORS = {
+    'static': StaticNotTaken,
+    'bimodal': Bimodal,
+    'gshare': GShare,
+}
+
+# -----------------------------------------------------------------------------------
+# ----BRANCH TARGET BUFFER----
+
+# direct mapped, tagged with the full pc
+class BTB:
+    def __init__(self, entries=64):
+        self.entries = entries
+        self.tags = [-1] * entries
+        self.targets = [0] * entries
+
+    def lookup(self, pc):
+        if self.entries == 0:
+            return None
+        i = pc % self.entries
+        if self.tags[i] == pc:
+            return self.targets[i]
+        return None
+
+    def update(self, pc, target):
+        if self.entries == 0:
+            return
+        i = pc % self.entries
+        self.tags[i] = pc
+        self.targets[i] = target
+
+# -----------------------------------------------------------------------------------
+# ----BRANCH UNIT----
+
+class BranchUnit:
+    def __init__(self, predictor=None, btb=None, penalty=2):
+        self.predictor = predictor if predictor is not None else StaticNotTaken()
+        self.btb = btb if btb is not None else BTB()
+        # cycles a misprediction costs on top of the squashed slots: the stages in front of execute
+        self.penalty = penalty
+# ----METRICS----
+        self.branches = 0
+        self.jumps = 0
+        self.branch_mispredictions = 0
+        self.jump_mispredictions = 0
+        self.cycles_lost = 0
+        self.squashed = 0
+
+    def config(self):
+        return {'predictor': self.predictor.config(), 'btb': self.btb.entries, 'penalty': self.penalty}
+
+# the pc to fetch after the control instruction instr at pc
+    def predict(self, pc, instr):
+        if instr[0] == 'JUMP':
+            taken = True
+        else:
+            taken = self.predictor.predict(pc)
+        if taken:
+            target = self.btb.lookup(pc)
+            if target is not None:
+                return target
+        return pc + 1
+
+# trains on the outcome and returns the cycles lost, 0 if predicted_pc was right
+    def resolve(self, pc, instr, predicted_pc, actual_pc):
+        taken = actual_pc != pc + 1
+        if instr[0] == 'JUMP':
+            self.jumps += 1
+        else:
+            self.branches += 1
+            self.predictor.update(pc, taken)
+        if taken:
+            self.btb.update(pc, actual_pc)
+        if predicted_pc == actual_pc:
+            return 0
+        if instr[0] == 'JUMP':
+            self.jump_mispredictions += 1
+        else:
+            self.branch_mispredictions += 1
+        self.cycles_lost += self.penalty
+        return self.penalty
+
+    def accuracy(self):
+        total = self.branches + self.jumps
+        if total == 0:
+            return 1.0
+        return 1.0 - (self.branch_mispredictions + self.jump_mispredictions) / total
+
+    def report(self):
+        lines = []
+        lines.append('branches: ' + str(self.branches) + ', mispredicted: ' + str(self.branch_mispredictions))
+        lines.append('jumps: ' + str(self.jumps) + ', mispredicted: ' + str(self.jump_mispredictions))
+        lines.append('prediction accuracy: ' + str(self.accuracy()))
+        lines.append('cycles lost to mispredictions: ' + str(self.cycles_lost))
+        if self.squashed:
+            lines.append('squashed fetch slots: ' + str(self.squashed))
+        return '\n'.join(lines)
+
+
+def make_branch_unit(name='gshare', penalty=2, btb_entries=64, **kwargs):
+    if name not in PREDICTORS:
+        raise ValueError('predictor must be one of: ' + ', '.join(PREDICTORS))
+    return BranchUnit(PREDICTORS[name](**kwargs), BTB(btb_entries), penalty)
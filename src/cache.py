@@ -0,0 +1,153 @@
+# Data cache hierarchy timing for LOAD/STORE/VLOAD/VSTORE.
+# The values still live in cpu.mem, the caches only keep tags, so they decide how long an access takes
+# but never what it returns. Each level is a set-associative cache whose tag store is a few flat lists
+# (tag, dirty bit and a replacement stamp per way, "ways" consecutive entries per set) instead of line
+# objects, so an access is a short scan over one set. Addresses are word addresses and sizes are in words.
+# A miss goes to the next level, the last level goes to main memory. Write-back caches allocate on a
+# write miss and write dirty victims back to the next level; write-through caches pass every write on
+# and don't allocate on write misses. Victim write-backs are assumed to be buffered and cost no time.
+#
+# usage:
+#     cpu = CPUSimple(hierarchy=MemoryHierarchy([Cache('L1', 64, 2, 4, hit_latency=1),
+#                                                  Cache('L2', 512, 4, 8, hit_latency=10)], memory_latency=100))
+#     cpu.run()
+#     print(cpu.hierarchy.report())
+
+import random
+
+POLICIES = ('lru', 'fifo', 'random')
+
+
+class Cache:
+    def __init__(self, name, size, ways, line_size, policy='lru', write_back=True, hit_latency=1, seed=0):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of: ' + ', '.join(POLICIES))
+        lines = size // line_size
+        if lines == 0 or lines % ways != 0:
+            raise ValueError(name + ': size must be a multiple of ways * line_size')
+        self.name = name
+        self.size = size
+        self.ways = ways
+        self.line_size = line_size
+        self.sets = lines // ways
+        self.policy = policy
+        self.write_back = write_back
+        self.hit_latency = hit_latency
+        self.rng = random.Random(seed)
+        self.next_level = None
+        self.memory_latency = 100
+        self.tags = [-1] * lines
+        self.dirty = [False] * lines
+        # last use (lru) or fill time (fifo) of each way
+        self.stamps = [0] * lines
+        self.clock = 0
+# ----METRICS----
+        self.reads = 0
+        self.writes = 0
+        self.read_hits = 0
+        self.write_hits = 0
+        self.writebacks = 0
+
+    def config(self):
+        return {'name': self.name, 'size': self.size, 'ways': self.ways, 'line_size': self.line_size,
+                'policy': self.policy, 'write_back': self.write_back, 'hit_latency': self.hit_latency}
+
+# returns the latency of the access including the levels below on a miss
+    def access(self, addr, write):
+        line = addr // self.line_size
+        base = (line % self.sets) * self.ways
+        tags = self.tags
+        self.clock += 1
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+
+        for way in range(base, base + self.ways):
+            if tags[way] == line:
+                if self.policy == 'lru':
+                    self.stamps[way] = self.clock
+                if write:
+                    self.write_hits += 1
+                    if self.write_back:
+                        self.dirty[way] = True
+                    else:
+                        return self.hit_latency + self.next_access(addr, True)
+                else:
+                    self.read_hits += 1
+                return self.hit_latency
+
+        if write and not self.write_back:
+            return self.hit_latency + self.next_access(addr, True)
+        latency = self.hit_latency + self.next_access(addr, False)
+        way = self.victim(base)
+        if self.dirty[way]:
+            self.writebacks += 1
+            if self.next_level is not None:
+                self.next_level.access(tags[way] * self.line_size, True)
+        tags[way] = line
+        self.dirty[way] = write
+        self.stamps[way] = self.clock
+        return latency
+
+    def victim(self, base):
+        tags = self.tags
+        for way in range(base, base + self.ways):
+            if tags[way] == -1:
+                return way
+        if self.policy == 'random':
+            return base + self.rng.randrange(self.ways)
+        stamps = self.stamps
+        victim = base
+        for way in range(base + 1, base + self.ways):
+            if stamps[way] < stamps[victim]:
+                victim = way
+        return victim
+
+    def next_access(self, addr, write):
+        if self.next_level is None:
+            return self.memory_latency
+        return self.next_level.access(addr, write)
+
+    def hit_rate(self):
+        accesses = self.reads + self.writes
+        if accesses == 0:
+            return 0.0
+        return (self.read_hits + self.write_hits) / accesses
+
+
+class MemoryHierarchy:
+    def __init__(self, levels, memory_latency=100):
+        self.levels = levels
+        self.memory_latency = memory_latency
+        for upper, lower in zip(levels, levels[1:]):
+            upper.next_level = lower
+        levels[-1].memory_latency = memory_latency
+        self.first = levels[0]
+        # the execute stage already counts one cycle for every instruction
+        self.base_latency = 1
+
+    def config(self):
+        return {'levels': [cache.config() for cache in self.levels], 'memory_latency': self.memory_latency}
+
+# stall cycles of one access, addr has to be a valid non-negative word address
+    def access(self, addr, write=False):
+        return self.first.access(addr, write) - self.base_latency
+
+    def report(self):
+        lines = []
+        for cache in self.levels:
+            accesses = cache.reads + cache.writes
+            lines.append('%s: %d words, %d-way, %d word lines, %s, %s' % (
+                cache.name, cache.size, cache.ways, cache.line_size, cache.policy,
+                'write-back' if cache.write_back else 'write-through'))
+            lines.append('  accesses: %d, hits: %d, hit rate: %.4f, write-backs: %d' % (
+                accesses, cache.read_hits + cache.write_hits, cache.hit_rate(), cache.writebacks))
+        return '\n'.join(lines)
+
+
+def default_hierarchy():
+    return MemoryHierarchy([
+        Cache('L1', 64, 2, 4, 'lru', True, 1),
+        Cache('L2', 512, 4, 8, 'lru', True, 10),
+    ], memory_latency=100)
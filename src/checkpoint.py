@@ -0,0 +1,318 @@
+# Checkpoints of the complete machine state and fast-forwarding with the functional core.
+#
+# A checkpoint holds mem, rf, a separate instruction store if the state backend has one, pc, the
+# counters and the pipeline state of the CPU class (pipeline registers, and for the superscalar model
+# the pushed operation, the NOP counter and the control dependency fields, for the Tomasulo model the
+# fetch queue, ROB, reservation stations, executing instructions, store queue and RAT), plus the branch
+# unit, hazard model and cache hierarchy if the CPU has them, so a restored run counts exactly like the
+# uninterrupted one. Decoded operations in the pipeline registers are stored by handler name and bound to
+# the restoring CPU again, the in-flight ROB entries once each by sequence number with the references
+# between them kept. Predecode caches aren't stored, they are filled again on demand.
+#
+# File format: a 40 byte header (magic, compression and the byte lengths of the metadata, mem and rf)
+# followed by the body, which is zlib or lzma compressed or stored as is. The body is the
+# pickled metadata followed by mem and rf as arrays of 64 bit words (or the raw numpy words). Values
+# that aren't plain ints fitting into a word, like the program tuples at the start of mem or booleans
+# written by CMP_LT/CMP_EQ, are kept in the metadata by address. Of a PagedMemory only the touched pages
+# are stored.
+#
+# usage:
+#     save(cpu, 'setup.ckpt')              # after load_program and the input
+#     cpu = CPUSuperscalar(); load(cpu, 'setup.ckpt'); cpu.run()
+#
+#     fast_forward(cpu, until_pc=23)       # functional up to pc 23, then
+#     cpu.run()                            # timed by the detailed model from there
+
+import array
+import collections
+import lzma
+import os
+import pickle
+import struct
+import types
+import zlib
+
+from simple import CPUSimple
+from pipelined import CPUPipelined
+from superscalar import CPUSuperscalar, RingBuffer
+from tomasulo import CPUTomasulo, Entry, FUNCTIONS
+from fast import CPUFast
+from state import np, PagedMemory
+
+MAGIC = b'CPUSIMC1'
+HEADER = struct.Struct('<8sI4xQQQ')
+COMPRESSION = {None: 0, 'zlib': 1, 'lzma': 2}
+
+WORD_MIN = -(1 << 63)
+WORD_MAX = (1 << 63) - 1
+
+COMMON_FIELDS = ['pc', 'finished', 'cycle_cntr', 'instr_cntr', 'pipeline_registers',
+                 'branch_unit', 'hazard_model', 'hierarchy']
+
+FIELDS = [
+    (CPUSuperscalar, COMMON_FIELDS + ['control_dependency', 'control_dependency_index', 'control_index',
+                                      'addr_index', 'diff', 'triplet_index', 'control_pc', 'pushed_op',
+                                      'nop_counter', 'slot_pcs', 'has_dep', 'slot_predictions',
+                                      'exec_slots', 'fetch_ended']),
+    (CPUPipelined, COMMON_FIELDS + ['fetched_pc', 'predicted_pc']),
+    (CPUTomasulo, COMMON_FIELDS + ['mispredictions', 'squashed', 'rob_full_stalls', 'rs_full_stalls',
+                                   'fetch_pc', 'fetch_stopped', 'fetch_queue', 'rob', 'rs', 'executing',
+                                   'stores', 'rat', 'seq']),
+    (CPUSimple, COMMON_FIELDS),
+]
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+def fields(cpu):
+    for cls, names in FIELDS:
+        if isinstance(cpu, cls):
+            return names
+    raise CheckpointError('no checkpoint layout for ' + type(cpu).__name__)
+
+# -----------------------------------------------------------------------------------
+# ----ENCODING----
+
+# the Tomasulo uops carry their function, stored by opcode
+FUNCTION_NAMES = {function: op for op, function in FUNCTIONS.items()}
+
+# decoded operations refer to the cpu through bound methods, they are stored as handler names
+def encode_value(cpu, value):
+    if isinstance(value, types.MethodType) and value.__self__ is cpu:
+        return ('__handler__', value.__name__)
+    if isinstance(value, Entry):
+        return ('__entry__', value.seq)
+    if callable(value) and value in FUNCTION_NAMES:
+        return ('__function__', FUNCTION_NAMES[value])
+    if isinstance(value, collections.deque):
+        return ('__deque__', [encode_value(cpu, item) for item in value])
+    if isinstance(value, RingBuffer):
+        return ('__ring__', len(value.items), [encode_value(cpu, item) for item in value.contents()])
+    if isinstance(value, tuple):
+        return tuple(encode_value(cpu, item) for item in value)
+    if isinstance(value, list):
+        return [encode_value(cpu, item) for item in value]
+    return value
+
+def decode_value(cpu, value, entries=None):
+    if isinstance(value, tuple):
+        if len(value) == 2 and value[0] == '__handler__':
+            return getattr(cpu, value[1])
+        if len(value) == 2 and value[0] == '__entry__':
+            return entries[value[1]]
+        if len(value) == 2 and value[0] == '__function__':
+            return FUNCTIONS[value[1]]
+        if len(value) == 2 and value[0] == '__deque__':
+            return collections.deque(decode_value(cpu, item, entries) for item in value[1])
+        if len(value) == 3 and value[0] == '__ring__':
+            ring = RingBuffer(value[1])
+            for item in value[2]:
+                ring.put(decode_value(cpu, item, entries))
+            return ring
+        return tuple(decode_value(cpu, item, entries) for item in value)
+    if isinstance(value, list):
+        return [decode_value(cpu, item, entries) for item in value]
+    return value
+
+# every ROB entry the Tomasulo pipeline holds, by sequence number: the ones in its queues and their consumers
+def in_flight(cpu):
+    found = {}
+    pending = list(cpu.rob) + cpu.rs + [entry for _, entry in cpu.executing] + list(cpu.stores)
+    pending += [entry for entry in cpu.rat if entry is not None]
+    while pending:
+        entry = pending.pop()
+        if entry.seq not in found:
+            found[entry.seq] = entry
+            pending += [consumer for consumer, _ in entry.consumers]
+    return found
+
+def encode_entries(cpu):
+    return {seq: {name: encode_value(cpu, getattr(entry, name)) for name in Entry.__slots__}
+            for seq, entry in in_flight(cpu).items()}
+
+# the entries are created first and filled in afterwards, they refer to each other
+def decode_entries(cpu, encoded):
+    entries = {seq: Entry.__new__(Entry) for seq in encoded}
+    for seq, fields in encoded.items():
+        for name, value in fields.items():
+            setattr(entries[seq], name, decode_value(cpu, value, entries))
+    return entries
+
+# returns (raw words, dtype name or None, {index: value} of the entries that aren't plain words)
+def encode_words(values):
+    if isinstance(values, PagedMemory):
+        page_words, pages = values.contents()
+        words, _, others = encode_words([value for _, page in pages for value in page])
+        layout = {'page_words': page_words, 'pages': [(n, len(page)) for n, page in pages], 'others': others}
+        return words, 'paged', layout
+    if hasattr(values, 'tobytes'):
+        return values.tobytes(), str(values.dtype), {}
+    words = array.array('q', bytes(8 * len(values)))
+    others = {}
+    for i, value in enumerate(values):
+        if type(value) is int and WORD_MIN <= value <= WORD_MAX:
+            words[i] = value
+        else:
+            others[i] = value
+    return words.tobytes(), None, others
+
+def restore_words(target, data, dtype, others):
+    if (dtype == 'paged') != isinstance(target, PagedMemory):
+        raise CheckpointError('the checkpoint and the cpu differ in whether the memory is paged')
+    if dtype == 'paged':
+        words = []
+        restore_words(words, data, None, others['others'])
+        pages = []
+        start = 0
+        for n, length in others['pages']:
+            pages.append((n, words[start:start + length]))
+            start += length
+        try:
+            target.restore((others['page_words'], pages))
+        except ValueError as e:
+            raise CheckpointError(str(e))
+        return
+    if dtype is not None:
+        if not hasattr(target, 'dtype') or str(target.dtype) != dtype:
+            raise CheckpointError('checkpoint holds ' + dtype + ' words, the cpu uses a different state backend')
+        target[:] = np.frombuffer(data, dtype=target.dtype)
+        return
+    words = array.array('q')
+    words.frombytes(data)
+    values = words.tolist()
+    for i, value in others.items():
+        values[i] = value
+    target[:] = values
+
+# -----------------------------------------------------------------------------------
+# ----SNAPSHOTS----
+
+def snapshot(cpu, compression='zlib'):
+    if compression not in COMPRESSION:
+        raise CheckpointError('compression must be one of: ' + ', '.join(str(c) for c in COMPRESSION))
+    mem, mem_dtype, mem_others = encode_words(cpu.mem)
+    rf, rf_dtype, rf_others = encode_words(cpu.rf)
+    state = {}
+    for name in fields(cpu):
+        if hasattr(cpu, name):
+            state[name] = encode_value(cpu, getattr(cpu, name))
+    meta = {
+        'class': type(cpu).__name__,
+        'mem_size': cpu.mem_size,
+        'reg_size': cpu.reg_size,
+        'program_size': len(cpu.decoded),
+        'imem': None if cpu.imem is cpu.mem else list(cpu.imem),
+        'mem_dtype': mem_dtype,
+        'mem_others': mem_others,
+        'rf_dtype': rf_dtype,
+        'rf_others': rf_others,
+        'state': state,
+        'entries': encode_entries(cpu) if isinstance(cpu, CPUTomasulo) else None,
+    }
+    try:
+        meta = pickle.dumps(meta, protocol=4)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise CheckpointError('cpu state cannot be saved (is a profiler attached?): ' + str(e))
+    body = meta + mem + rf
+    if compression == 'zlib':
+        body = zlib.compress(body, 6)
+    elif compression == 'lzma':
+        body = lzma.compress(body)
+    return HEADER.pack(MAGIC, COMPRESSION[compression], len(meta), len(mem), len(rf)) + body
+
+def restore(cpu, data):
+    if len(data) < HEADER.size:
+        raise CheckpointError('truncated checkpoint')
+    magic, compression, meta_len, mem_len, rf_len = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CheckpointError('not a checkpoint')
+    body = data[HEADER.size:]
+    if compression == 1:
+        body = zlib.decompress(body)
+    elif compression == 2:
+        body = lzma.decompress(body)
+    if len(body) != meta_len + mem_len + rf_len:
+        raise CheckpointError('truncated checkpoint')
+    meta = pickle.loads(body[:meta_len])
+    if meta['class'] != type(cpu).__name__:
+        raise CheckpointError('checkpoint of a ' + meta['class'] + ' cannot be restored into a ' + type(cpu).__name__)
+    if meta['mem_size'] != cpu.mem_size or meta['reg_size'] != cpu.reg_size:
+        raise CheckpointError('checkpoint has a different mem_size or reg_size')
+    if isinstance(cpu, CPUTomasulo) and 'rob' not in meta['state']:
+        raise CheckpointError('checkpoint holds no out-of-order pipeline state')
+
+    if meta['imem'] is not None:
+        if cpu.imem is cpu.mem:
+            raise CheckpointError('checkpoint has a separate instruction store, the cpu uses a different state backend')
+        cpu.imem[:] = meta['imem']
+    restore_words(cpu.mem, body[meta_len:meta_len + mem_len], meta['mem_dtype'], meta['mem_others'])
+    restore_words(cpu.rf, body[meta_len + mem_len:], meta['rf_dtype'], meta['rf_others'])
+    entries = decode_entries(cpu, meta['entries']) if meta['entries'] else {}
+    # the hazard model and the Tomasulo pipeline come from the checkpoint with their in-flight state, so
+    # nothing of the cpu's previous run is left in them and they aren't reset like after fast_forward
+    for name, value in meta['state'].items():
+        setattr(cpu, name, decode_value(cpu, value, entries))
+    clear_predecode(cpu, meta['program_size'])
+    return cpu
+
+# predecoded operations, hazard masks and compiled code are rebuilt lazily from the restored program
+def clear_predecode(cpu, program_size):
+    cpu.decoded = [None] * program_size
+    if isinstance(cpu, CPUSuperscalar):
+        cpu.hazard_bits = {}
+        cpu.masks = [None] * program_size
+
+def save(cpu, path, compression='zlib'):
+    data = snapshot(cpu, compression)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def load(cpu, path):
+    with open(path, 'rb') as f:
+        return restore(cpu, f.read())
+
+# -----------------------------------------------------------------------------------
+# ----FAST-FORWARD----
+
+# a CPUFast compiled against cpu's memory and registers, running its code changes cpu's state
+def functional_core(cpu):
+    fast = CPUFast(1, 1)
+    fast.mem_size = cpu.mem_size
+    fast.imem, fast.mem, fast.rf = cpu.imem, cpu.mem, cpu.rf
+    fast.decoded = [None] * len(cpu.decoded)
+    fast.code = []
+    fast.compile_program()
+    return fast
+
+# Runs cpu's program with the functional core of CPUFast on cpu's own memory and registers until the
+# instruction at until_pc is next or "instructions" have been executed, and leaves cpu.pc there, so
+# cpu.run() goes on in the detailed model. A STOP is left for the detailed model to execute. The
+# fast-forwarded instructions aren't added to cpu's counters, the number of them is returned.
+def fast_forward(cpu, until_pc=None, instructions=None):
+    fast = functional_core(cpu)
+    code = fast.code
+    size = len(code)
+    limit = -1 if instructions is None else instructions
+    pc = cpu.pc
+    n = 0
+    with cpu.arithmetic():
+        while 0 <= pc < size and pc != until_pc and n != limit:
+            pc = code[pc]()
+            n += 1
+    if pc < 0:
+        # the STOP ran, step back so the detailed model executes it
+        pc = fast.pc - 1
+        n -= 1
+    cpu.pc = pc
+    # stores may have rewritten the program
+    clear_predecode(cpu, len(cpu.decoded))
+    if isinstance(cpu, CPUTomasulo):
+        cpu.reset_pipeline()
+    # the skipped instructions never went through the hazard model, its scoreboard is stale
+    if getattr(cpu, 'hazard_model', None) is not None:
+        cpu.hazard_model.reset()
+    return n
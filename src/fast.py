@@ -0,0 +1,219 @@
+from isa import OPCODES, CycleLimitExceeded
+from simple import CPUSimple
+
+# Same machine as CPUSimple, but the program is compiled into one closure per instruction.
+# Each closure has its register indices bound as constants and returns the pc of the next
+# instruction, so the run loop only indexes the code list and calls. Every instruction still
+# accounts for the fetch, decode and execute cycles of the simple CPU.
+
+class CPUFast(CPUSimple):
+    def __init__(self, mem_size=1024, reg_size=32, state=None):
+        super().__init__(mem_size, reg_size, state)
+        self.code = []
+
+# -----------------------------------------------------------------------------------
+# ----COMPILER----
+
+    def compile(self, pc):
+        instr = self.imem[pc]
+        rf = self.rf
+        mem = self.mem
+        code = self.code
+        size = len(code)
+        nxt = pc + 1
+
+        if not isinstance(instr, tuple):
+            def invalid():
+                raise TypeError('no instruction at address ' + str(pc) + ': ' + repr(instr))
+            return invalid
+
+        op = instr[0]
+        if op == 'LOAD':
+            _, s1, r = instr
+            def load():
+                rf[r] = mem[rf[s1]]
+                return nxt
+            return load
+        elif op == 'VLOAD':
+            _, s1, r = instr
+            def load_value():
+                rf[r] = mem[s1]
+                return nxt
+            return load_value
+        elif op == 'STORE':
+            _, s1, r = instr
+            compile = self.compile
+            mem_size = self.mem_size
+            def store():
+                addr = rf[s1]
+                mem[addr] = rf[r]
+                if addr < size:
+                    if addr < 0:
+                        addr += mem_size
+                    if 0 <= addr < size:
+                        code[addr] = compile(addr)
+                return nxt
+            return store
+        elif op == 'VSTORE':
+            _, s1, r = instr
+            compile = self.compile
+            addr = s1 + self.mem_size if s1 < 0 else s1
+            if 0 <= addr < size:
+                def store_value():
+                    mem[s1] = rf[r]
+                    code[addr] = compile(addr)
+                    return nxt
+            else:
+                def store_value():
+                    mem[s1] = rf[r]
+                    return nxt
+            return store_value
+        elif op == 'ADD':
+            _, s1, s2, r = instr
+            def add():
+                rf[r] = rf[s1] + rf[s2]
+                return nxt
+            return add
+        elif op == 'SUB':
+            _, s1, s2, r = instr
+            def sub():
+                rf[r] = rf[s1] - rf[s2]
+                return nxt
+            return sub
+        elif op == 'MUL':
+            _, s1, s2, r = instr
+            def mul():
+                rf[r] = rf[s1] * rf[s2]
+                return nxt
+            return mul
+        elif op == 'AND':
+            _, s1, s2, r = instr
+            def _and():
+                rf[r] = rf[s1] and rf[s2]
+                return nxt
+            return _and
+        elif op == 'OR':
+            _, s1, s2, r = instr
+            def _or():
+                rf[r] = rf[s1] or rf[s2]
+                return nxt
+            return _or
+        elif op == 'JUMP':
+            target_addr = instr[1]
+            def jump():
+                return target_addr
+            return jump
+        elif op == 'BRANCH_LT':
+            _, s1, s2, target_addr = instr
+            def branch_lt():
+                if rf[s1] < rf[s2]:
+                    return target_addr
+                return nxt
+            return branch_lt
+        elif op == 'BRANCH_ZERO':
+            _, s1, target_addr = instr
+            def branch_zero():
+                if rf[s1] == 0:
+                    return target_addr
+                return nxt
+            return branch_zero
+        elif op == 'STOP':
+            # a negative pc ends the run loop, the real one is left in self.pc like in CPUSimple
+            def stop():
+                self.pc = nxt
+                return -1
+            return stop
+        elif op == 'MOV':
+            _, s1, s2 = instr
+            def mov():
+                rf[s1] = rf[s2]
+                return nxt
+            return mov
+        elif op == 'CMP_LT':
+            _, s1, s2, r = instr
+            def cmp_lt():
+                rf[r] = rf[s1] < rf[s2]
+                return nxt
+            return cmp_lt
+        elif op == 'CMP_EQ':
+            _, s1, s2, r = instr
+            def cmp_eq():
+                rf[r] = rf[s1] == rf[s2]
+                return nxt
+            return cmp_eq
+        elif op in OPCODES:
+            # NOP, the atomics and FENCE go through their CPUBase handler
+            opcode = OPCODES[op]
+            handler = getattr(self, opcode.handler)
+            operands = instr[1:opcode.arity + 1]
+            def interpret():
+                handler(*operands)
+                return nxt
+            return interpret
+        else:
+            def unknown():
+                raise ValueError('unknown instruction at address ' + str(pc) + ': ' + repr(instr))
+            return unknown
+
+# a handler that rewrote the program (an atomic) recompiles the address like STORE does
+    def invalidate(self, addr):
+        super().invalidate(addr)
+        if addr < 0:
+            addr += self.mem_size
+        if 0 <= addr < len(self.code):
+            self.code[addr] = self.compile(addr)
+
+    def compile_program(self):
+        self.code[:] = [None] * len(self.decoded)
+        for pc in range(len(self.code)):
+            self.code[pc] = self.compile(pc)
+
+# -----------------------------------------------------------------------------------
+
+# runs at most "limit" instructions (all of them for -1) of the compiled code from self.pc, returns how many ran
+    def run_chunk(self, limit=-1):
+        code = self.code
+        pc = self.pc
+        n = 0
+        with self.arithmetic():
+            while pc >= 0 and n != limit:
+                pc = code[pc]()
+                n += 1
+        if pc < 0:
+            self.finished = True
+        else:
+            self.pc = pc
+        self.instr_cntr += n
+        self.cycle_cntr += 3 * n
+        return n
+
+# runs from self.pc like CPUSimple, so a run paused with step() goes on where it stopped
+    def run(self, verbose=True):
+        if not self.finished:
+            # closures hold on to rf and mem, so compile against the lists the program will run on
+            self.compile_program()
+            self.run_chunk()
+        if verbose:
+            self.print_results()
+        return self.results()
+
+# CPUBase.run_until with the compiled code running in chunks up to the next pause or the cycle limit.
+# A predicate has to be checked after every instruction, so that run goes through the interpreter.
+    def run_until(self, predicate=None, max_cycles=None, interval=10000):
+        if predicate is not None:
+            yield from super().run_until(predicate, max_cycles, interval)
+            return
+        limit = None if max_cycles is None else self.cycle_cntr + max_cycles
+        pause = None if interval is None else self.cycle_cntr + interval
+        if not self.finished:
+            self.compile_program()
+        while not self.finished:
+            stops = [cycle for cycle in (limit, pause) if cycle is not None]
+            # every instruction takes 3 cycles, the chunk ends on the first one at or past the stop
+            self.run_chunk(max((min(stops) - self.cycle_cntr + 2) // 3, 1) if stops else -1)
+            if limit is not None and self.cycle_cntr >= limit and not self.finished:
+                raise CycleLimitExceeded('no STOP within ' + str(max_cycles) + ' cycles, pc ' + str(self.pc))
+            if pause is not None and self.cycle_cntr >= pause:
+                yield self.cycle_cntr
+                pause = self.cycle_cntr + interval
+#-----------------------------------------------------------------------------------
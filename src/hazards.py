@@ -0,0 +1,101 @@
+# Data hazard timing for CPUPipelined.
+# The pipelined model executes every instruction in one go, so the hazard model only works out when
+# each instruction could enter the execute stage of an in-order pipeline with "depth" stages:
+# fetch, decode, execute, then the memory stages and writeback (depth 3 is the fetch/decode/execute
+# pipeline without hazards the model had so far, depth 5 is the classic IF ID EX MEM WB). Registers are
+# read in decode and written in the first half of writeback. With forwarding, ALU results go straight
+# from the end of execute to the next execute (EX->EX) and loaded values from the end of the last memory
+# stage (MEM->EX), so only a use right behind a load has to wait.
+# Both timelines, with and without forwarding, are tracked in the same pass, so one run shows how many
+# stall cycles the bypass network saves; "forwarding" selects the one that is charged to cycle_cntr.
+#
+# usage:
+#     cpu = CPUPipelined(hazard_model=HazardModel(depth=5, forwarding=True))
+#     cpu.run()
+#     print(cpu.hazard_model.report())
+
+from isa import OPCODES
+
+EXECUTE = 2
+
+# opcode -> (read register operand positions, written register operand position or None, is a load)
+OPERANDS = {name: (opcode.reads, opcode.write, opcode.memory in ('read', 'atomic')) for name, opcode in OPCODES.items()}
+
+
+class HazardModel:
+    def __init__(self, depth=5, forwarding=True):
+        if depth < 3:
+            raise ValueError('the pipeline needs at least fetch, decode and execute stages')
+        self.depth = depth
+        self.forwarding = forwarding
+        writeback = depth - 1
+        # cycles from a producer entering execute until a consumer may enter execute
+        self.alu_bypass = 1
+        self.load_bypass = max(EXECUTE, writeback - 1) - EXECUTE + 1
+        self.register_file = writeback - EXECUTE + 1
+        self.reset(32)
+# ----METRICS----
+        self.stalls_forwarding = 0
+        self.stalls_register_file = 0
+
+    def config(self):
+        return {'depth': self.depth, 'forwarding': self.forwarding}
+
+# Empties the scoreboard for a new run (a new program, or one that went on without the model), the
+# stall counts add up over the runs like the cpu's counters. reg_size defaults to the current one.
+    def reset(self, reg_size=None):
+        if reg_size is None:
+            reg_size = len(self.ready_forwarding)
+        # cycle at which each register can be used by an instruction entering execute
+        self.ready_forwarding = [0] * reg_size
+        self.ready_register_file = [0] * reg_size
+        self.last_forwarding = -1
+        self.last_register_file = -1
+
+# returns the stall cycles the instruction costs in the selected configuration
+    def issue(self, instr):
+        if not isinstance(instr, tuple):
+            return 0
+        operands = OPERANDS.get(instr[0])
+        if operands is None:
+            return 0
+        reads, write, load = operands
+
+        t_forwarding = self.last_forwarding + 1
+        t_register_file = self.last_register_file + 1
+        for i in reads:
+            r = instr[i]
+            if self.ready_forwarding[r] > t_forwarding:
+                t_forwarding = self.ready_forwarding[r]
+            if self.ready_register_file[r] > t_register_file:
+                t_register_file = self.ready_register_file[r]
+        stall_forwarding = t_forwarding - self.last_forwarding - 1
+        stall_register_file = t_register_file - self.last_register_file - 1
+        self.last_forwarding = t_forwarding
+        self.last_register_file = t_register_file
+        if write is not None:
+            r = instr[write]
+            self.ready_forwarding[r] = t_forwarding + (self.load_bypass if load else self.alu_bypass)
+            self.ready_register_file[r] = t_register_file + self.register_file
+
+        self.stalls_forwarding += stall_forwarding
+        self.stalls_register_file += stall_register_file
+        if self.forwarding:
+            return stall_forwarding
+        return stall_register_file
+
+    def stalls(self):
+        if self.forwarding:
+            return self.stalls_forwarding
+        return self.stalls_register_file
+
+    def stalls_saved(self):
+        return self.stalls_register_file - self.stalls_forwarding
+
+    def report(self):
+        lines = []
+        lines.append('pipeline depth: ' + str(self.depth) + ', forwarding: ' + ('on' if self.forwarding else 'off'))
+        lines.append('stall cycles without forwarding: ' + str(self.stalls_register_file))
+        lines.append('stall cycles with forwarding: ' + str(self.stalls_forwarding))
+        lines.append('stall cycles saved by forwarding: ' + str(self.stalls_saved()))
+        return '\n'.join(lines)
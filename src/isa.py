@@ -0,0 +1,323 @@
+# The instruction set shared by all CPU models.
+# OPCODES describes every instruction once: the handler that executes it, its operands and what they
+# are, the memory access it makes and the execution unit it needs. The timing models, the hazard model,
+# the out-of-order core, the JIT, the assembler and the tracer all read their per-opcode facts from it,
+# so a new instruction is one row here plus its handler in CPUBase (and its code in CPUFast/BlockJIT).
+# CPUBase holds the machine state and the ISA handlers; the models only add their timing on top.
+#
+# operand kinds: r register read, w register written, a register holding a memory address,
+#                m immediate memory address, t jump target
+# memory access: read, write or atomic (a read-modify-write of one word)
+#
+# AMOADD a, r, w adds rf[r] to the word at address rf[a] and AMOSWAP a, r, w stores rf[r] there, both
+# atomically and both leave the old value in rf[w]. FENCE orders memory accesses. On a single core
+# they are plain memory operations; in the multicore model (multicore.py) other cores share the
+# memory and the atomics and fences go through the core's port to it (cpu.shared).
+
+import contextlib
+
+from state import ListState
+
+# (opcode, handler, operand kinds, memory access, execution unit), in binary opcode number order
+SPEC = [
+    ('LOAD', 'load', 'aw', 'read', 'load'),
+    ('VLOAD', 'load_value', 'mw', 'read', 'load'),
+    ('STORE', 'store', 'ar', 'write', 'store'),
+    ('VSTORE', 'store_value', 'mr', 'write', 'store'),
+    ('ADD', 'add', 'rrw', None, 'alu'),
+    ('SUB', 'sub', 'rrw', None, 'alu'),
+    ('MUL', 'mul', 'rrw', None, 'mul'),
+    ('AND', '_and', 'rrw', None, 'alu'),
+    ('OR', '_or', 'rrw', None, 'alu'),
+    ('JUMP', 'jump', 't', None, 'jump'),
+    ('BRANCH_LT', 'branch_lt', 'rrt', None, 'branch'),
+    ('BRANCH_ZERO', 'branch_zero', 'rt', None, 'branch'),
+    ('STOP', 'stop', '', None, 'stop'),
+    ('MOV', 'mov', 'wr', None, 'alu'),
+    ('CMP_LT', 'cmp_lt', 'rrw', None, 'alu'),
+    ('CMP_EQ', 'cmp_eq', 'rrw', None, 'alu'),
+    ('NOP', 'nop', '', None, 'nop'),
+    ('AMOADD', 'amoadd', 'arw', 'atomic', 'atomic'),
+    ('AMOSWAP', 'amoswap', 'arw', 'atomic', 'atomic'),
+    ('FENCE', 'fence', '', None, 'fence'),
+]
+
+
+class Opcode:
+    __slots__ = ('name', 'number', 'handler', 'operands', 'arity', 'memory', 'unit',
+                 'reads', 'write', 'address', 'target', 'control')
+
+    def __init__(self, name, number, handler, operands, memory, unit):
+        self.name = name
+        self.number = number
+        self.handler = handler
+        self.operands = operands
+        self.arity = len(operands)
+        self.memory = memory
+        self.unit = unit
+        # operand positions in the instruction tuple, 1 is the first operand
+        self.reads = tuple(i for i, kind in enumerate(operands, 1) if kind in 'ra')
+        self.write = self.position('w')
+        self.address = self.position('a') or self.position('m')
+        self.target = self.position('t')
+        self.control = self.target is not None
+
+    def position(self, kind):
+        if kind in self.operands:
+            return self.operands.index(kind) + 1
+        return None
+
+
+OPCODES = {name: Opcode(name, number, *rest) for number, (name, *rest) in enumerate(SPEC)}
+CONTROL = tuple(name for name, opcode in OPCODES.items() if opcode.control)
+
+
+class CycleLimitExceeded(RuntimeError):
+    pass
+
+
+class CPUBase:
+    def __init__(self, mem_size=1024, reg_size=32, state=None, hierarchy=None):
+        self.mem_size = mem_size
+        self.reg_size = reg_size
+        # imem is the same list as mem unless the state backend keeps instructions separately
+        if state is None:
+            state = ListState()
+        self.imem, self.mem, self.rf = state.allocate(mem_size, reg_size)
+        # entered around every run of instructions, sets up the backend's arithmetic (numpy overflow)
+        self.arithmetic = getattr(state, 'arithmetic', contextlib.nullcontext)
+        self.pc = 0
+        self.finished = False
+        # predecoded operations of the loaded program, indexed by pc
+        self.decoded = []
+        # optional MemoryHierarchy that adds cache stall cycles to loads and stores
+        self.hierarchy = hierarchy
+        # set by Profiler.attach
+        self.profiler = None
+        # set by the multicore model, the core's port to the memory it shares with the other cores
+        self.shared = None
+# ----METRICS----
+        self.cycle_cntr = 0
+        self.instr_cntr = 0
+
+# -----------------------------------------------------------------------------------
+# ----INSTRUCTION FUNCTIONS----
+
+    def load(self, s1, r):
+        addr = self.rf[s1]
+        self.rf[r] = self.mem[addr]
+        if self.hierarchy is not None:
+            self.cycle_cntr += self.hierarchy.access(addr % self.mem_size, False)
+
+    def load_value(self, s1, r):
+        self.rf[r] = self.mem[s1]
+        if self.hierarchy is not None:
+            self.cycle_cntr += self.hierarchy.access(s1 % self.mem_size, False)
+
+    def store(self, s1, r):
+        addr = self.rf[s1]
+        self.mem[addr] = self.rf[r]
+        if self.hierarchy is not None:
+            self.cycle_cntr += self.hierarchy.access(addr % self.mem_size, True)
+        if addr < len(self.decoded):
+            self.invalidate(addr)
+
+    def store_value(self, s1, r):
+        self.mem[s1] = self.rf[r]
+        if self.hierarchy is not None:
+            self.cycle_cntr += self.hierarchy.access(s1 % self.mem_size, True)
+        if s1 < len(self.decoded):
+            self.invalidate(s1)
+
+    def add(self, s1, s2, r):
+        self.rf[r] = self.rf[s1] + self.rf[s2]
+
+    def sub(self, s1, s2, r):
+        self.rf[r] = self.rf[s1] - self.rf[s2]
+
+    def mul(self, s1, s2, r):
+        self.rf[r] = self.rf[s1] * self.rf[s2]
+
+    def _and(self, s1, s2, r):
+        self.rf[r] = self.rf[s1] and self.rf[s2]
+
+    def _or(self, s1, s2, r):
+        self.rf[r] = self.rf[s1] or self.rf[s2]
+
+    def jump(self, target_addr):
+        self.pc = target_addr
+
+    def branch_lt(self, s1, s2, target_addr):
+        if self.rf[s1] < self.rf[s2]:
+            self.pc = target_addr
+
+    def branch_zero(self, s1, target_addr):
+        if self.rf[s1] == 0:
+            self.pc = target_addr
+
+    def stop(self):
+        self.finished = True
+
+    def mov(self, s1, s2):
+        self.rf[s1] = self.rf[s2]
+
+    def cmp_lt(self, s1, s2, r):
+        if self.rf[s1] < self.rf[s2]:
+            self.rf[r] = True
+        else:
+            self.rf[r] = False
+
+    def cmp_eq(self, s1, s2, r):
+        if self.rf[s1] == self.rf[s2]:
+            self.rf[r] = True
+        else:
+            self.rf[r] = False
+
+    def nop(self):
+        pass
+
+    def amoadd(self, s1, s2, r):
+        value = self.rf[s2]
+        self.rf[r] = self.atomic(self.rf[s1], lambda old: old + value)
+
+    def amoswap(self, s1, s2, r):
+        value = self.rf[s2]
+        self.rf[r] = self.atomic(self.rf[s1], lambda old: value)
+
+    def fence(self):
+        if self.shared is not None:
+            self.shared.fence()
+
+# read-modify-write of the word at addr that no other core can come between, returns the old value
+    def atomic(self, addr, update):
+        if self.shared is not None:
+            old = self.shared.atomic(addr, update)
+        else:
+            old = self.mem[addr]
+            self.mem[addr] = update(old)
+        if self.hierarchy is not None:
+            self.cycle_cntr += self.hierarchy.access(addr % self.mem_size, True)
+        if addr < len(self.decoded):
+            self.invalidate(addr)
+        return old
+
+# -----------------------------------------------------------------------------------
+# ----PROCESSOR FUNCTIONS----
+
+    def load_program(self, program):
+        if self.imem is self.mem:
+            self.mem[0:len(program)] = program
+        else:
+            self.imem[:] = list(program) + [None]
+        self.decoded = [self.predecode(instr) for instr in program]
+        n = self.mem_size
+        self.mem[900] = n-1
+        self.mem[901] = n
+        self.pc = 0
+        self.finished = False
+
+    def fetch(self):
+        instr = self.imem[self.pc]
+        self.pc += 1
+        return instr
+
+# (bound handler, operands...), None for an unknown opcode
+    def predecode(self, instr):
+        opcode = OPCODES.get(instr[0])
+        if opcode is None:
+            return None
+        return (getattr(self, opcode.handler),) + instr[1:opcode.arity + 1]
+
+# look the operation up in the predecode cache, entries invalidated by a store are decoded again
+    def decode(self, instr, pc=None):
+        if pc is None or pc >= len(self.decoded):
+            return self.predecode(instr)
+        operation = self.decoded[pc]
+        if operation is None:
+            operation = self.decoded[pc] = self.predecode(instr)
+        return operation
+
+# drop the predecoded state of a rewritten address, negative addresses index memory from the end like list indices
+    def invalidate(self, addr):
+        if addr < 0:
+            addr += self.mem_size
+        if 0 <= addr < len(self.decoded):
+            self.decoded[addr] = None
+
+    def execute(self, *operation):
+        function = operation[0]
+        if len(operation) > 1:
+            args = operation[1:]
+            function(*args)
+        else:
+            function()
+        self.instr_cntr += 1
+
+# Canonical description of everything that decides the timing of the model besides the program and the
+# state, the result cache keys runs by it. Models with more parameters extend it.
+    def config(self):
+        return {
+            'class': type(self).__qualname__,
+            'mem_size': self.mem_size,
+            'reg_size': self.reg_size,
+            'hierarchy': None if self.hierarchy is None else self.hierarchy.config(),
+        }
+
+# -----------------------------------------------------------------------------------
+# ----RUN CONTROL----
+# advance() is one clock of the model (one whole instruction for CPUSimple); step, run_until and run
+# are built on it and only ever stop between two clocks, so a run can be paused and continued at will.
+
+    def advance(self):
+        raise NotImplementedError(type(self).__name__ + ' has no advance()')
+
+# runs at least n_cycles more cycles or until the program stops, returns whether it has
+    def step(self, n_cycles=1):
+        advance = self.advance
+        target = self.cycle_cntr + n_cycles
+        with self.arithmetic():
+            while not self.finished and self.cycle_cntr < target:
+                advance()
+        return self.finished
+
+# Generator that runs until predicate(cpu) is true after a clock or the program stops, yielding
+# cycle_cntr every "interval" cycles (never if interval is None) so the caller can inspect the state,
+# do something else and resume. Raises CycleLimitExceeded after max_cycles more cycles.
+# The arithmetic context is left at every yield, the caller doesn't run in it.
+    def run_until(self, predicate=None, max_cycles=None, interval=10000):
+        advance = self.advance
+        limit = None if max_cycles is None else self.cycle_cntr + max_cycles
+        pause = None if interval is None else self.cycle_cntr + interval
+        while not self.finished:
+            with self.arithmetic():
+                while not self.finished:
+                    advance()
+                    if predicate is not None and predicate(self):
+                        return
+                    if limit is not None and self.cycle_cntr >= limit and not self.finished:
+                        raise CycleLimitExceeded('no STOP within ' + str(max_cycles) + ' cycles, pc ' + str(self.pc))
+                    if pause is not None and self.cycle_cntr >= pause:
+                        break
+            if pause is not None and self.cycle_cntr >= pause:
+                yield self.cycle_cntr
+                pause = self.cycle_cntr + interval
+
+    def run(self, verbose=True):
+        advance = self.advance
+        with self.arithmetic():
+            while not self.finished:
+                advance()
+        if verbose:
+            self.print_results()
+        return self.results()
+
+    def results(self):
+        instr = float(self.instr_cntr)
+        cycl = float(self.cycle_cntr)
+        ipc = float(self.instr_cntr/self.cycle_cntr)
+        return instr, cycl, ipc
+
+    def print_results(self):
+        print('instructions: ' + str(self.instr_cntr))
+        print('cycles: ' + str(self.cycle_cntr))
+        print('instructions per cycle: ' + str(self.instr_cntr/self.cycle_cntr))
@@ -0,0 +1,208 @@
+# Basic-block translation engine for the functional side of the CPU models.
+# The program is split into basic blocks (straight-line code ending at a JUMP/BRANCH_LT/BRANCH_ZERO).
+# Blocks are interpreted with the CPU's predecoded operations and their entries are counted. Once a
+# block has been entered hot_threshold times it is translated into the source of one Python function
+# that keeps the registers it touches in local variables and writes them back to rf at the block exit.
+# The function is compiled with compile() and used from then on. A STORE into the program region
+# drops every block covering the written address.
+
+from isa import OPCODES, CONTROL
+
+CONTROL_OPS = CONTROL
+# everything but STOP, NOP, the atomics and FENCE is translated, those end the block and are interpreted
+BLOCK_OPS = tuple(name for name, opcode in OPCODES.items() if opcode.unit not in ('stop', 'nop', 'atomic', 'fence'))
+
+ARITHMETIC = {'ADD': '+', 'SUB': '-', 'MUL': '*', 'AND': 'and', 'OR': 'or', 'CMP_LT': '<', 'CMP_EQ': '=='}
+
+
+class BlockJIT:
+    def __init__(self, cpu, hot_threshold=16):
+        self.cpu = cpu
+        self.hot_threshold = hot_threshold
+        self.code_size = len(cpu.decoded)
+        self.leaders = set()
+        # leader pc -> pc of the last instruction in the block
+        self.blocks = {}
+        self.counts = {}
+        self.compiled = {}
+        self.find_blocks()
+
+# -----------------------------------------------------------------------------------
+# ----BLOCK DISCOVERY----
+
+    def instruction(self, pc):
+        instr = self.cpu.imem[pc]
+        if isinstance(instr, tuple):
+            return instr
+        return None
+
+    def add_leaders(self, pc):
+        instr = self.instruction(pc)
+        if instr is None:
+            return
+        if instr[0] in CONTROL_OPS:
+            self.leaders.add(instr[-1])
+            self.leaders.add(pc + 1)
+        elif instr[0] not in BLOCK_OPS:
+            self.leaders.add(pc + 1)
+
+    def find_blocks(self):
+        self.leaders.add(0)
+        for pc in range(self.code_size):
+            self.add_leaders(pc)
+        for leader in self.leaders:
+            if 0 <= leader < self.code_size:
+                self.blocks[leader] = self.block_end(leader)
+
+    def block_end(self, start):
+        pc = start
+        while pc < self.code_size - 1:
+            instr = self.instruction(pc)
+            if instr is None or instr[0] not in BLOCK_OPS or instr[0] in CONTROL_OPS:
+                break
+            if pc + 1 in self.leaders:
+                break
+            pc += 1
+        return pc
+
+# drop all blocks covering a rewritten address, they are rebuilt when their leader is reached again
+    def invalidate(self, addr):
+        if addr < 0:
+            addr += self.cpu.mem_size
+        if not 0 <= addr < self.code_size:
+            return
+        self.cpu.decoded[addr] = None
+        for start, end in list(self.blocks.items()):
+            if start <= addr <= end:
+                del self.blocks[start]
+                self.counts.pop(start, None)
+                self.compiled.pop(start, None)
+        self.leaders.add(addr)
+        self.add_leaders(addr)
+
+# -----------------------------------------------------------------------------------
+# ----TRANSLATION----
+
+    def translate(self, start):
+        end = self.blocks[start]
+        instrs = []
+        for pc in range(start, end + 1):
+            instr = self.instruction(pc)
+            if instr is None or instr[0] not in BLOCK_OPS:
+                break
+            instrs.append(instr)
+        if not instrs:
+            return None
+
+        used = set()
+        written = set()
+        for instr in instrs:
+            opcode = OPCODES[instr[0]]
+            used.update(instr[i] for i in opcode.reads)
+            if opcode.write is not None:
+                used.add(instr[opcode.write])
+                written.add(instr[opcode.write])
+
+        writeback = ['rf[%d] = r%d' % (reg, reg) for reg in sorted(written)]
+
+        def exit_block(indent, next_pc, executed, extra=()):
+            pad = ' ' * indent
+            return [pad + line for line in writeback] + [pad + line for line in extra] + [pad + 'return %d, %d' % (next_pc, executed)]
+
+        lines = ['def block_%d(rf, mem, invalidate):' % start]
+        lines += ['    r%d = rf[%d]' % (reg, reg) for reg in sorted(used)]
+        exited = False
+        for k, instr in enumerate(instrs):
+            pc = start + k
+            executed = k + 1
+            op = instr[0]
+            if op == 'LOAD':
+                lines.append('    r%d = mem[r%d]' % (instr[2], instr[1]))
+            elif op == 'VLOAD':
+                lines.append('    r%d = mem[%d]' % (instr[2], instr[1]))
+            elif op == 'STORE':
+                lines.append('    a = r%d' % instr[1])
+                lines.append('    mem[a] = r%d' % instr[2])
+                lines.append('    if a < %d:' % self.code_size)
+                lines += exit_block(8, pc + 1, executed, ['invalidate(a)'])
+            elif op == 'VSTORE':
+                lines.append('    mem[%d] = r%d' % (instr[1], instr[2]))
+                if instr[1] < self.code_size:
+                    lines += exit_block(4, pc + 1, executed, ['invalidate(%d)' % instr[1]])
+                    exited = True
+                    break
+            elif op == 'MOV':
+                lines.append('    r%d = r%d' % (instr[1], instr[2]))
+            elif op in ARITHMETIC:
+                lines.append('    r%d = r%d %s r%d' % (instr[3], instr[1], ARITHMETIC[op], instr[2]))
+            elif op == 'JUMP':
+                lines += exit_block(4, instr[1], executed)
+                exited = True
+            elif op == 'BRANCH_LT':
+                lines.append('    if r%d < r%d:' % (instr[1], instr[2]))
+                lines += exit_block(8, instr[3], executed)
+                lines += exit_block(4, pc + 1, executed)
+                exited = True
+            elif op == 'BRANCH_ZERO':
+                lines.append('    if r%d == 0:' % instr[1])
+                lines += exit_block(8, instr[2], executed)
+                lines += exit_block(4, pc + 1, executed)
+                exited = True
+        if not exited:
+            lines += exit_block(4, start + len(instrs), len(instrs))
+
+        namespace = {}
+        exec(compile('\n'.join(lines) + '\n', '<block %d>' % start, 'exec'), namespace)
+        return namespace['block_%d' % start]
+
+# -----------------------------------------------------------------------------------
+# ----EXECUTION----
+
+# interpret the instruction at pc with the CPU's own handlers, returns the next pc
+    def step(self, pc):
+        cpu = self.cpu
+        instr = cpu.imem[pc]
+        operation = cpu.predecode(instr) if pc >= self.code_size else cpu.decoded[pc]
+        if operation is None:
+            operation = cpu.decoded[pc] = cpu.predecode(instr)
+        addr = None
+        opcode = OPCODES.get(instr[0])
+        if opcode is not None and opcode.memory in ('write', 'atomic'):
+            addr = instr[opcode.address]
+            if opcode.operands[opcode.address - 1] == 'a':
+                addr = cpu.rf[addr]
+        cpu.pc = pc + 1
+        operation[0](*operation[1:])
+        if addr is not None and addr < self.code_size:
+            self.invalidate(addr)
+        return cpu.pc
+
+# run the cpu until STOP, returns the number of executed instructions
+    def run(self):
+        cpu = self.cpu
+        rf = cpu.rf
+        mem = cpu.mem
+        compiled = self.compiled
+        invalidate = self.invalidate
+        pc = cpu.pc
+        n = 0
+        while not cpu.finished:
+            block = compiled.get(pc)
+            if block is not None:
+                pc, executed = block(rf, mem, invalidate)
+                n += executed
+                continue
+            if pc in self.leaders and 0 <= pc < self.code_size:
+                if pc not in self.blocks:
+                    self.blocks[pc] = self.block_end(pc)
+                count = self.counts.get(pc, 0) + 1
+                self.counts[pc] = count
+                if count == self.hot_threshold:
+                    block = self.translate(pc)
+                    if block is not None:
+                        compiled[pc] = block
+                        continue
+            pc = self.step(pc)
+            n += 1
+        cpu.pc = pc
+        return n
@@ -0,0 +1,7 @@
+# Reads a program (assembly text or the assembler's binary format) into the list of instruction
+# tuples taken by load_program.
+
+from assembler import load_file
+
+def read_program(filename, cache=True):
+    return load_file(filename, cache)
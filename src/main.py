@@ -4,67 +4,62 @@ import time
 from simple import CPUSimple
 from pipelined import CPUPipelined
 from superscalar import CPUSuperscalar
+from fast import CPUFast
+from tomasulo import CPUTomasulo
+from loader import read_program
+from branch import make_branch_unit, PREDICTORS
+from meminit import find_spec, mem_size, apply, outputs
 
-if len(sys.argv) != 3:
-    print("The correct command format is: python3 main.py program.txt mode")
+if len(sys.argv) not in (3, 4):
+    print("The correct command format is: python3 main.py program.txt mode [predictor]")
 else:
     filename =  sys.argv[1] 
-
-    with open(filename, 'r') as f:
-        lines = [line.strip() for line in f.readlines()]
-
-    program = []
-    for line in lines:
-        elements = line.split(', ')
-        instruction = elements[0]
-        args = []
-        for arg in elements[1:]:
-            try:
-                args.append(int(arg))
-            except ValueError:
-                args.append(arg)
-        program.append((instruction, *args))
+    program = read_program(filename)
+    # the input of the program comes from the memory spec next to it (program.init.json), if it has one
+    spec = find_spec(filename)
+    size = mem_size(spec)
 
 
     mode = sys.argv[2]
+    # optional branch predictor for the pipelined and superscalar modes
+    branch_unit = None
+    if len(sys.argv) == 4:
+        if sys.argv[3] not in PREDICTORS:
+            print('predictor argument must be one of: ' + ', '.join(PREDICTORS))
+            sys.exit(1)
+        branch_unit = make_branch_unit(sys.argv[3])
     if mode == 'simple':
-        cpu = CPUSimple()
+        cpu = CPUSimple(size)
     elif mode == 'pipelined':
-        cpu = CPUPipelined()
+        cpu = CPUPipelined(size, branch_unit=branch_unit)
     elif mode == 'superscalar':
-        cpu = CPUSuperscalar()
+        cpu = CPUSuperscalar(size, branch_unit=branch_unit)
+    elif mode == 'fast':
+        cpu = CPUFast(size)
+    elif mode == 'jit':
+        cpu = CPUSimple(size)
+    elif mode == 'tomasulo':
+        cpu = CPUTomasulo(size)
     else:
-        print('mode argument must be one of: simple, pipelined or superscalar')
-    #what about values in memory to work on?    
+        print('mode argument must be one of: simple, pipelined, superscalar, fast, jit or tomasulo')
+        sys.exit(1)
     cpu.load_program(program)
+    before = apply(cpu, spec) if spec is not None else []
 
-    if sys.argv[1] == 'bubblesort.txt':
-        unsorted_array = [3, 2, 8, 1, 9]
-        cpu.mem[cpu.mem_size-1] = len(unsorted_array)
-        cpu.mem[cpu.mem_size-2] = len(unsorted_array) - 1
-
-        for i, val in enumerate(unsorted_array):
-            cpu.mem[cpu.mem_size-3 - i] = val
-
-    elif sys.argv[1] == 'fibonacci.txt':
-        number = 10
-        cpu.mem[cpu.mem_size-1] = number
-    
-    elif sys.argv[1] == 'raw.txt' or sys.argv[1] == 'independent_arithmetic.txt':
-        cpu.mem[cpu.mem_size-10:cpu.mem_size] = [1]*10
-
-    start_time = time.time()
-    cpu.run()
-    end_time = time.time()
-
-    if sys.argv[1] == 'bubblesort.txt':
-        sorted_array = [cpu.mem[cpu.mem_size-3 - i] for i in range(len(unsorted_array))]
-        print('Unsorted: ' + str(unsorted_array))
-        print('Sorted: ' + str(sorted_array))
-        
+    # only the simulation is timed, the results are printed afterwards (bench.py measures the models properly)
+    start_time = time.perf_counter()
+    if mode == 'jit':
+        cpu.run_jit(verbose=False)
+    else:
+        cpu.run(verbose=False)
+    end_time = time.perf_counter()
+    cpu.print_results()
 
-    elif sys.argv[1] == 'fibonacci.txt':
-        print('Fibonacci sequence for n = ' + str(number) + ': ' + str(cpu.mem[cpu.mem_size-1-number:cpu.mem_size-1]))
+    if spec is not None:
+        for name, values in before + outputs(cpu, spec):
+            print(name + ': ' + str(values))
 
+    if branch_unit is not None and mode in ('pipelined', 'superscalar'):
+        print(branch_unit.report())
 
     print(f"Execution time: {end_time - start_time:.6f} seconds")
\ No newline at end of file
@@ -0,0 +1,110 @@
+# Declarative memory initialization: the input of a program described as data instead of code.
+#
+# A spec is a JSON object:
+#     {"mem_size": 1024,           optional, the memory the program needs (at least the default 1024 words)
+#      "memory": [entry, ...],     written into mem in order
+#      "registers": [entry, ...],  optional, written into rf in order
+#      "outputs": [entry, ...]}    optional, memory ranges shown after the run
+# and an entry one of
+#     {"address": a, "value": v}                                  one word
+#     {"address": a, "values": [v, ...]}                          consecutive words
+#     {"address": a, "fill": v, "count": n}                       n copies of v
+#     {"address": a, "random": [low, high], "count": n, "seed": s}   n random ints from low to high
+# with an optional "step" (default 1, -1 writes downwards from the address). Negative addresses count
+# from the end of memory like list indices, so -1 is mem_size-1. Register entries use "register"
+# instead of "address". An output entry names the range: {"name": "Sorted", "address": -3, "count": 5,
+# "step": -1}, and with "before": "Unsorted" the range is also shown as it was before the run.
+#
+# The spec of a program file sits next to it with the extension .init.json (bubblesort.txt ->
+# bubblesort.init.json), main.py applies it before running the program.
+
+import json
+import os
+import random
+
+
+class SpecError(ValueError):
+    pass
+
+
+def spec_path(program_path):
+    return os.path.splitext(program_path)[0] + '.init.json'
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    if not isinstance(spec, dict):
+        raise SpecError(path + ': a memory spec is a JSON object')
+    return spec
+
+def save_spec(path, spec):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(spec, f, indent=1)
+    os.replace(tmp, path)
+
+# the spec next to a program, None if it has none
+def find_spec(program_path):
+    path = spec_path(program_path)
+    if not os.path.exists(path):
+        return None
+    return load_spec(path)
+
+def mem_size(spec, default=1024):
+    if spec is None:
+        return default
+    return max(default, spec.get('mem_size', default))
+
+# -----------------------------------------------------------------------------------
+# ----ENTRIES----
+
+def entry_values(entry):
+    if 'value' in entry:
+        return [entry['value']]
+    if 'values' in entry:
+        return list(entry['values'])
+    if 'fill' in entry:
+        return [entry['fill']] * entry['count']
+    if 'random' in entry:
+        low, high = entry['random']
+        rng = random.Random(entry.get('seed', 0))
+        return [rng.randint(low, high) for _ in range(entry['count'])]
+    raise SpecError('entry ' + repr(entry) + ' has no value, values, fill or random')
+
+# the indices an entry covers in a memory or register file of "size" words
+def entry_indices(entry, size, count, key='address'):
+    if key not in entry:
+        raise SpecError('entry ' + repr(entry) + ' has no ' + key)
+    start = entry[key]
+    if start < 0:
+        start += size
+    step = entry.get('step', 1)
+    last = start + step * (count - 1)
+    if count and not (0 <= start < size and 0 <= last < size):
+        raise SpecError('entry ' + repr(entry) + ' does not fit into ' + str(size) + ' words')
+    return range(start, start + step * count, step) if step else [start] * count
+
+def write_entries(target, size, entries, key):
+    for entry in entries:
+        values = entry_values(entry)
+        for i, value in zip(entry_indices(entry, size, len(values), key), values):
+            target[i] = value
+
+def read_entry(cpu, entry):
+    return [cpu.mem[i] for i in entry_indices(entry, cpu.mem_size, entry.get('count', 1))]
+
+# -----------------------------------------------------------------------------------
+# ----APPLYING----
+
+# writes the input of the spec into a cpu that has its program loaded, returns the "before" outputs
+def apply(cpu, spec):
+    if cpu.mem_size < spec.get('mem_size', 0):
+        raise SpecError('the program needs a memory of ' + str(spec['mem_size']) + ' words, the cpu has '
+                        + str(cpu.mem_size))
+    write_entries(cpu.mem, cpu.mem_size, spec.get('memory', []), 'address')
+    write_entries(cpu.rf, cpu.reg_size, spec.get('registers', []), 'register')
+    return [(entry['before'], read_entry(cpu, entry)) for entry in spec.get('outputs', []) if 'before' in entry]
+
+# (name, values) of the output ranges after a run
+def outputs(cpu, spec):
+    return [(entry['name'], read_entry(cpu, entry)) for entry in spec.get('outputs', [])]
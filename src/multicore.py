@@ -0,0 +1,398 @@
+# Multicore model: several cores run the same program on one shared data memory.
+# Every core is an ordinary CPU model (simple, pipelined, superscalar or tomasulo) with its own registers
+# and instruction store; register id_register holds the core's number and count_register the number of
+# cores, so the program can split its work. Superscalar cores need a branch predictor to resolve
+# branches and get the static not-taken one unless another is given. The data memory is a
+# multiprocessing.shared_memory block of 64-bit words (values that don't fit raise ValueError) that the
+# cores reach through a CoreMemory port.
+#
+# The cores advance in quanta of "quantum" cycles and wait for each other at the end of every quantum.
+# Within a quantum a core's stores go into its private store buffer and only the core itself sees them;
+# a FENCE or an atomic (AMOADD, AMOSWAP) drains the buffer into the shared memory and the atomics do their
+# read-modify-write on the shared memory under a lock, so locks and counters built on them are correct.
+# At the barrier the remaining buffers are drained in core order. Every core also keeps MSI states of
+# the lines it touched: a load of a line it doesn't have costs miss_cycles, a store to a line it only
+# shares costs upgrade_cycles (miss_cycles if it doesn't have it). At the barrier the lines another core
+# wrote in the quantum are invalidated and lines it read are downgraded from M to S, so sharing data
+# between cores costs cycles the way it does with a real coherence protocol.
+#
+# With workers=0 all cores run in this process one after another and a run is deterministic. With
+# workers=P the cores are spread round robin over P processes that run their quanta in parallel; fences
+# and atomics then interleave as the host schedules them, a correctly synchronized program gets the
+# same results but the cycle counts may vary from run to run.
+#
+# usage:
+#     with Multicore(read_program('parallel_sum.txt'), cores=4, mode='pipelined', spec=spec) as machine:
+#         machine.run(max_cycles=10**7); machine.print_results()
+#
+# or: python3 multicore.py parallel_sum.txt [--cores 4] [--mode simple] [--predictor gshare]
+#                          [--workers 2] [--quantum 1000] [--max-cycles N]
+
+import argparse
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+from branch import make_branch_unit, PREDICTORS
+from isa import CycleLimitExceeded
+from loader import read_program
+from meminit import find_spec, mem_size, outputs, write_entries
+from pipelined import CPUPipelined
+from simple import CPUSimple
+from superscalar import CPUSuperscalar
+from tomasulo import CPUTomasulo
+
+# mode -> core with the given state backend and optional branch predictor, superscalar always has one
+MODES = {
+    'simple': lambda size, state, predictor: CPUSimple(size, state=state),
+    'pipelined': lambda size, state, predictor: CPUPipelined(
+        size, state=state, branch_unit=predictor and make_branch_unit(predictor)),
+    'superscalar': lambda size, state, predictor: CPUSuperscalar(
+        size, state=state, branch_unit=make_branch_unit(predictor or 'static')),
+    'tomasulo': lambda size, state, predictor: CPUTomasulo(size, state=state),
+}
+
+WORD_BYTES = 8
+
+# -----------------------------------------------------------------------------------
+# ----CORE MEMORY----
+
+class PortState:
+    # state backend of a core: a private instruction store and the data memory behind its port
+    def __init__(self, port):
+        self.port = port
+
+    def allocate(self, mem_size, reg_size):
+        return [None], self.port, [0] * reg_size
+
+
+class CoreMemory:
+    __slots__ = ('words', 'size', 'lock', 'line_words', 'miss_cycles', 'upgrade_cycles', 'cpu',
+                 'buffer', 'lines', 'reads', 'writes', 'misses', 'upgrades', 'invalidations')
+
+    def __init__(self, words, size, lock, line_words=8, miss_cycles=20, upgrade_cycles=10):
+        self.words = words
+        # the shared block can be bigger than asked for, it is rounded up to whole pages on some hosts
+        self.size = size
+        self.lock = lock
+        self.line_words = line_words
+        self.miss_cycles = miss_cycles
+        self.upgrade_cycles = upgrade_cycles
+        # the core whose cycle count pays for the misses, None while the program is loaded
+        self.cpu = None
+        self.reset()
+
+    def reset(self):
+        # address -> value of the stores the other cores don't see yet
+        self.buffer = {}
+        # line -> 'M' or 'S', lines that aren't there are invalid
+        self.lines = {}
+        # lines read and written in this quantum
+        self.reads = set()
+        self.writes = set()
+# ----METRICS----
+        self.misses = 0
+        self.upgrades = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return self.size
+
+    def normalize(self, addr):
+        if not -self.size <= addr < self.size:
+            raise IndexError('memory address out of range: ' + str(addr))
+        if addr < 0:
+            return addr + self.size
+        return addr
+
+    def access(self, addr, write):
+        line = addr // self.line_words
+        state = self.lines.get(line)
+        cycles = 0
+        if write:
+            if state != 'M':
+                if state is None:
+                    self.misses += 1
+                    cycles = self.miss_cycles
+                else:
+                    self.upgrades += 1
+                    cycles = self.upgrade_cycles
+                self.lines[line] = 'M'
+            self.writes.add(line)
+        else:
+            if state is None:
+                self.misses += 1
+                cycles = self.miss_cycles
+                self.lines[line] = 'S'
+            self.reads.add(line)
+        if cycles and self.cpu is not None:
+            self.cpu.cycle_cntr += cycles
+
+    def __getitem__(self, addr):
+        addr = self.normalize(addr)
+        self.access(addr, False)
+        if addr in self.buffer:
+            return self.buffer[addr]
+        return self.words[addr]
+
+    def __setitem__(self, addr, value):
+        addr = self.normalize(addr)
+        self.access(addr, True)
+        self.buffer[addr] = value
+
+    def drain(self):
+        words = self.words
+        for addr, value in self.buffer.items():
+            words[addr] = value
+        self.buffer.clear()
+
+    def fence(self):
+        with self.lock:
+            self.drain()
+
+    def atomic(self, addr, update):
+        addr = self.normalize(addr)
+        self.access(addr, True)
+        with self.lock:
+            self.drain()
+            old = self.words[addr]
+            self.words[addr] = update(old)
+        return old
+
+# the stores and lines of the quantum that just ended, they start over for the next one
+    def end_quantum(self):
+        quantum = (list(self.buffer.items()), self.reads, self.writes)
+        self.buffer = {}
+        self.reads = set()
+        self.writes = set()
+        return quantum
+
+# coherence with what the other cores did in the quantum
+    def sync(self, written, read):
+        for line in written:
+            if self.lines.pop(line, None) is not None:
+                self.invalidations += 1
+        for line in read:
+            if self.lines.get(line) == 'M':
+                self.lines[line] = 'S'
+
+# -----------------------------------------------------------------------------------
+# ----CORES----
+# the same functions run the cores in this process and in the workers, so all they get and return is picklable
+
+def make_cores(config, ids, words, lock):
+    cores = []
+    for core in ids:
+        port = CoreMemory(words, config['mem_size'], lock, config['line_words'], config['miss_cycles'], config['upgrade_cycles'])
+        cpu = MODES[config['mode']](config['mem_size'], PortState(port), config['predictor'])
+        cpu.load_program(config['program'])
+        # load_program wrote its constants through the port, the machine has them in memory already
+        port.reset()
+        port.cpu = cpu
+        cpu.shared = port
+        write_entries(cpu.rf, cpu.reg_size, config['registers'], 'register')
+        cpu.rf[config['id_register']] = core
+        cpu.rf[config['count_register']] = config['cores']
+        cores.append((core, cpu, port))
+    return cores
+
+def run_quantum(cpu, port, end):
+    if not cpu.finished and cpu.cycle_cntr < end:
+        cpu.step(end - cpu.cycle_cntr)
+    return (cpu.finished,) + port.end_quantum()
+
+def core_result(core, cpu, port):
+    return {
+        'core': core,
+        'instr': cpu.instr_cntr,
+        'cycles': cpu.cycle_cntr,
+        'ipc': cpu.instr_cntr / cpu.cycle_cntr if cpu.cycle_cntr else 0.0,
+        'misses': port.misses,
+        'upgrades': port.upgrades,
+        'invalidations': port.invalidations,
+        'registers': [int(value) for value in cpu.rf],
+    }
+
+def worker(conn, name, config, ids, lock):
+    memory = shared_memory.SharedMemory(name=name)
+    words = memory.buf.cast('q')
+    try:
+        cores = make_cores(config, ids, words, lock)
+        while True:
+            command, argument = conn.recv()
+            if command == 'run':
+                try:
+                    conn.send(('ok', [run_quantum(cpu, port, argument) for _, cpu, port in cores]))
+                except Exception as e:
+                    conn.send(('error', e))
+            elif command == 'sync':
+                for (_, _, port), (written, read) in zip(cores, argument):
+                    port.sync(written, read)
+            elif command == 'results':
+                conn.send([core_result(*core) for core in cores])
+            else:
+                return
+    finally:
+        words.release()
+        memory.close()
+
+# -----------------------------------------------------------------------------------
+# ----MACHINE----
+
+class Multicore:
+    def __init__(self, program, cores=2, mode='simple', predictor=None, mem_size=1024, spec=None, workers=0,
+                 quantum=1000, line_words=8, miss_cycles=20, upgrade_cycles=10, id_register=31,
+                 count_register=30):
+        if mode not in MODES:
+            raise ValueError('mode must be one of: ' + ', '.join(MODES))
+        if cores < 1 or workers < 0 or quantum < 1:
+            raise ValueError('cores and quantum must be at least 1 and workers at least 0')
+        self.cores = cores
+        self.mem_size = mem_size
+        self.quantum = quantum
+        self.cycle = 0
+        self.finished = False
+        self.memory = shared_memory.SharedMemory(create=True, size=mem_size * WORD_BYTES)
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.mem = self.memory.buf.cast('q')
+        spec = spec or {}
+        # what load_program writes into the memory of a single CPU, the program itself is in the cores
+        self.mem[900] = mem_size - 1
+        self.mem[901] = mem_size
+        write_entries(self.mem, mem_size, spec.get('memory', []), 'address')
+        self.lock = multiprocessing.Lock()
+        config = {
+            'program': list(program), 'mode': mode, 'predictor': predictor, 'mem_size': mem_size,
+            'cores': cores, 'registers': spec.get('registers', []), 'id_register': id_register,
+            'count_register': count_register, 'line_words': line_words, 'miss_cycles': miss_cycles,
+            'upgrade_cycles': upgrade_cycles,
+        }
+        self.local = []
+        self.workers = []
+        if workers == 0:
+            self.local = make_cores(config, range(cores), self.mem, self.lock)
+        else:
+            for w in range(min(workers, cores)):
+                conn, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=worker, daemon=True,
+                                                  args=(child, self.memory.name, config, list(range(w, cores, workers)), self.lock))
+                process.start()
+                self.workers.append((process, conn, list(range(w, cores, workers))))
+        self.done = [False] * cores
+        self.per_core = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for process, conn, _ in self.workers:
+            try:
+                conn.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+            process.join()
+            conn.close()
+        self.workers = []
+        self.local = []
+        if self.mem is not None:
+            self.mem.release()
+            self.mem = None
+            self.memory.close()
+            self.memory.unlink()
+
+# runs one quantum on every core, returns (finished, stores, lines read, lines written) per core
+    def run_quantum(self, end):
+        quanta = [None] * self.cores
+        for core, cpu, port in self.local:
+            quanta[core] = run_quantum(cpu, port, end)
+        for _, conn, _ in self.workers:
+            conn.send(('run', end))
+        for _, conn, ids in self.workers:
+            status, reply = conn.recv()
+            if status == 'error':
+                raise reply
+            for core, quantum in zip(ids, reply):
+                quanta[core] = quantum
+        return quanta
+
+    def barrier(self, quanta):
+        mem = self.mem
+        for _, stores, _, _ in quanta:
+            for addr, value in stores:
+                mem[addr] = value
+        reads = [quantum[2] for quantum in quanta]
+        writes = [quantum[3] for quantum in quanta]
+        syncs = []
+        for core in range(self.cores):
+            written = set().union(*(lines for other, lines in enumerate(writes) if other != core))
+            read = set().union(*(lines for other, lines in enumerate(reads) if other != core))
+            syncs.append((written, read))
+        for core, cpu, port in self.local:
+            port.sync(*syncs[core])
+        for _, conn, ids in self.workers:
+            conn.send(('sync', [syncs[core] for core in ids]))
+
+    def run(self, max_cycles=None):
+        while not self.finished:
+            end = self.cycle + self.quantum
+            quanta = self.run_quantum(end)
+            self.barrier(quanta)
+            self.cycle = end
+            self.done = [quantum[0] for quantum in quanta]
+            self.finished = all(self.done)
+            if max_cycles is not None and self.cycle >= max_cycles and not self.finished:
+                raise CycleLimitExceeded('not every core stopped within ' + str(max_cycles) + ' cycles, running: '
+                                         + ', '.join(str(core) for core, done in enumerate(self.done) if not done))
+        return self.collect()
+
+    def collect(self):
+        results = [core_result(*core) for core in self.local]
+        for _, conn, _ in self.workers:
+            conn.send(('results', None))
+            results += conn.recv()
+        self.per_core = sorted(results, key=lambda result: result['core'])
+        return self.per_core
+
+    def report(self):
+        lines = []
+        for result in self.per_core:
+            lines.append('core %d: %d instructions, %d cycles, IPC %.3f, %d misses, %d upgrades, %d invalidations' % (
+                result['core'], result['instr'], result['cycles'], result['ipc'], result['misses'],
+                result['upgrades'], result['invalidations']))
+        return '\n'.join(lines)
+
+    def print_results(self):
+        instr = sum(result['instr'] for result in self.per_core)
+        # the cores run in parallel, the machine takes as long as its slowest core
+        cycles = max(result['cycles'] for result in self.per_core)
+        print(self.report())
+        print('instructions: ' + str(instr))
+        print('cycles: ' + str(cycles))
+        print('instructions per cycle: ' + str(instr / cycles))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a program on several cores sharing one memory.')
+    parser.add_argument('program')
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--mode', choices=list(MODES), default='simple')
+    parser.add_argument('--predictor', choices=list(PREDICTORS), default=None,
+                        help='branch predictor of pipelined and superscalar cores (superscalar default: static)')
+    parser.add_argument('--workers', type=int, default=0, help='processes to run the cores in, 0 runs them here')
+    parser.add_argument('--quantum', type=int, default=1000, help='cycles between two barriers')
+    parser.add_argument('--max-cycles', type=int, default=None)
+    args = parser.parse_args()
+
+    spec = find_spec(args.program)
+    with Multicore(read_program(args.program), args.cores, args.mode, args.predictor, mem_size(spec), spec,
+                   args.workers, args.quantum) as machine:
+        start_time = time.perf_counter()
+        machine.run(args.max_cycles)
+        end_time = time.perf_counter()
+        machine.print_results()
+        for name, values in outputs(machine, spec or {}):
+            print(name + ': ' + str(values))
+    print(f"Execution time: {end_time - start_time:.6f} seconds")
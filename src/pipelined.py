@@ -1,165 +1,90 @@
-class CPUPipelined:
-    def __init__(self, mem_size=1024, reg_size=32):
-        self.pipeline_registers = [None] * 5
-        self.mem_size = mem_size
-        self.mem = [0] * mem_size
-        self.reg_size = reg_size
-        self.rf = [0] * reg_size
-        self.pc = 0
-        self.finished = False
-# ----METRICS----
-        self.cycle_cntr = 0
-        self.instr_cntr = 0
-
-#-----------------------------------------------------------------------------------
-
-    def load(self, s1, r):
-        self.rf[r] = self.mem[self.rf[s1]]
-
-    def load_value(self, s1, r):
-        self.rf[r] = self.mem[s1]
-    
-    def store(self, s1, r):
-        self.mem[ self.rf[s1]] = self.rf[r]
-
-    def store_value(self, s1, r):
-        self.mem[s1] = self.rf[r]
-    
-    def add(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] + self.rf[s2]
+from branch import is_control
+from isa import CPUBase
+from jit import BlockJIT
 
-    def sub(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] - self.rf[s2]
-    
-    def mul(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] * self.rf[s2]
-    
-    def _and(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] and self.rf[s2]
-    
-    def _or(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] or self.rf[s2]
-    
-    def jump(self, target_addr):
-        self.pc = target_addr
-    
-    def branch_lt(self, s1, s2, target_addr):
-        if self.rf[s1] < self.rf[s2]:
-            self.pc = target_addr
-    
-    def branch_zero(self, s1, target_addr):
-        if self.rf[s1] == 0:
-            self.pc = target_addr
-    
-    def stop(self):
-        self.finished = True
-    
-    def mov(self, s1, s2):
-        self.rf[s1] = self.rf[s2]
-    
-    def cmp_lt(self, s1, s2, r):
-        if self.rf[s1] < self.rf[s2]:
-            self.rf[r] = True
-        else:
-            self.rf[r] = False
-    
-    def cmp_eq(self, s1, s2, r):
-        if self.rf[s1] == self.rf[s2]:
-            self.rf[r] = True
-        else:
-            self.rf[r] = False
-
-#-----------------------------------------------------------------------------------
+class CPUPipelined(CPUBase):
+    def __init__(self, mem_size=1024, reg_size=32, state=None, branch_unit=None, hazard_model=None, hierarchy=None):
+        super().__init__(mem_size, reg_size, state, hierarchy)
+        self.pipeline_registers = [None] * 5
+        self.fetched_pc = None
+        # optional BranchUnit, without one control flow costs nothing
+        self.branch_unit = branch_unit
+        self.predicted_pc = None
+        # optional HazardModel, without one every instruction takes a single cycle
+        self.hazard_model = hazard_model
+        if hazard_model is not None:
+            hazard_model.reset(reg_size)
 
     def load_program(self, program):
-        self.mem[0:len(program)] = program
-        n = self.mem_size
-        self.mem[900] = n-1
-        self.mem[901] = n
-        self.pc = 0
+        super().load_program(program)
+        if self.hazard_model is not None:
+            self.hazard_model.reset()
 
-    def fetch(self):
-        instr = self.mem[self.pc]
-        self.pc += 1
-        return instr
-
-    def decode(self, instr):
-        op = instr[0]
-        if op == 'LOAD':
-            return self.load, instr[1], instr[2]
-        elif op == 'VLOAD':
-            return self.load_value, instr[1], instr[2]
-        elif op == 'STORE':
-            return self.store, instr[1], instr[2]
-        elif op == 'VSTORE':
-            return self.store_value, instr[1], instr[2]
-        elif op == 'ADD':
-            return self.add, instr[1], instr[2], instr[3]
-        elif op == 'SUB':
-            return self.sub, instr[1], instr[2], instr[3]
-        elif op == 'MUL':
-            return self.mul, instr[1], instr[2], instr[3]
-        elif op == 'AND':
-            return self._and, instr[1], instr[2], instr[3]
-        elif op == 'OR':
-            return self._or, instr[1], instr[2], instr[3]
-        elif op == 'JUMP':
-            return self.jump, instr[1]
-        elif op == 'BRANCH_LT':
-            return self.branch_lt, instr[1], instr[2], instr[3]
-        elif op == 'BRANCH_ZERO':
-            return self.branch_zero, instr[1], instr[2]
-        elif op == 'STOP':
-            return self.stop,
-        elif op == 'MOV':
-            return self.mov, instr[1], instr[2]
-        elif op == 'CMP_LT':
-            return self.cmp_lt, instr[1], instr[2], instr[3]
-        elif op == 'CMP_EQ':
-            return self.cmp_eq, instr[1], instr[2], instr[3]
-
-    def execute(self, *operation):
-        function = operation[0]
-        if len(operation) > 1:
-            args = operation[1:]
-            function(*args)
-        else:
-            function()
-        self.instr_cntr += 1
+    def config(self):
+        config = super().config()
+        config['branch_unit'] = None if self.branch_unit is None else self.branch_unit.config()
+        config['hazard_model'] = None if self.hazard_model is None else self.hazard_model.config()
+        return config
 
 #-----------------------------------------------------------------------------------
 
     def fetch_stage(self):
+        self.fetched_pc = self.pc
         self.pipeline_registers[0] = self.fetch()
+        if self.branch_unit is not None and is_control(self.pipeline_registers[0]):
+            self.predicted_pc = self.branch_unit.predict(self.fetched_pc, self.pipeline_registers[0])
 
     def decode_stage(self):
         instruction = self.pipeline_registers[0]
         if instruction is None:
             self.finished = True
             return
-        operation = self.decode(instruction)
+        operation = self.decode(instruction, self.fetched_pc)
         self.pipeline_registers[1] = operation
 
     def execute_stage(self):
         operation = self.pipeline_registers[1]
         self.execute(*operation)
+        if self.hazard_model is not None:
+            stalls = self.hazard_model.issue(self.pipeline_registers[0])
+            self.cycle_cntr += stalls
+            if stalls and self.profiler is not None:
+                for _ in range(stalls):
+                    self.profiler.stall(self.fetched_pc)
+        if self.predicted_pc is not None:
+            # a mispredicted branch squashes the instructions fetched and decoded behind it
+            penalty = self.branch_unit.resolve(self.fetched_pc, self.pipeline_registers[0], self.predicted_pc, self.pc)
+            self.cycle_cntr += penalty
+            self.predicted_pc = None
+            if penalty and self.profiler is not None:
+                self.profiler.flush(self.fetched_pc, penalty)
         self.pipeline_registers[2] = self.pipeline_registers[3]
         self.pipeline_registers[3] = None
 
 
-    def run(self):
-        while not self.finished:
-            self.fetch_stage()
-            self.decode_stage()
-            self.execute_stage()
-            self.cycle_cntr += 1
-        print('instructions: ' + str(self.instr_cntr))   
-        print('cycles: ' + str(self.cycle_cntr))   
-        print('instructions per cycle: ' + str(self.instr_cntr/self.cycle_cntr)) 
-        instr =  float(self.instr_cntr)
-        cycl = float(self.cycle_cntr)
-        ipc = float(self.instr_cntr/self.cycle_cntr)
-        return  instr, cycl, ipc
+    def advance(self):
+        self.fetch_stage()
+        self.decode_stage()
+        self.execute_stage()
+        self.cycle_cntr += 1
+
+# The basic-block JIT runs the program functionally from self.pc, the pipeline retires one instruction
+# per cycle. Compiled blocks skip the handlers and stages, so with a cache hierarchy, hazard model,
+# branch unit or profiler attached the program is run by run() instead to count what those add.
+    def run_jit(self, hot_threshold=16, verbose=True):
+        if (self.hierarchy is not None or self.hazard_model is not None or self.branch_unit is not None
+                or self.profiler is not None):
+            return self.run(verbose)
+        if self.finished:
+            return self.results()
+        with self.arithmetic():
+            n = BlockJIT(self, hot_threshold).run()
+        self.instr_cntr += n
+        self.cycle_cntr += n
+        if verbose:
+            self.print_results()
+        return self.results()
+
   #-----------------------------------------------------------------------------------          
             
 
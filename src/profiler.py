@@ -0,0 +1,128 @@
+# Opt-in per-pc and per-opcode profiler for the CPU models.
+# Profiler.attach(cpu) replaces decode on that one cpu object with a version that hands out
+# operations whose handler counts its executions before running the real one, so the CPU classes
+# themselves have no profiling code on their per-instruction path. CPUs that never get a profiler
+# attached run exactly as before. Stall NOPs and flushes of the superscalar model are reported
+# through cpu.profiler, which is only looked at when one happens, and are attributed to the
+# instruction that was stalled or to the jump/branch that caused the flush.
+#
+# usage:
+#     profiler = Profiler()
+#     profiler.attach(cpu)
+#     cpu.run()
+#     print(profiler.report())
+#     profiler.write_folded('profile.folded')   # input for flamegraph.pl
+
+from collections import Counter
+
+
+class Profiler:
+    def __init__(self):
+        self.cpu = None
+        self.pc_counts = Counter()
+        self.opcode_counts = Counter()
+        self.instructions = {}
+        # pc of the stalled instruction / of the control instruction -> NOP slots
+        self.stall_nops = Counter()
+        self.flush_nops = Counter()
+        self.flushes = Counter()
+        self.traced = {}
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        cpu.profiler = self
+        decode = cpu.decode
+        traced = self.traced
+
+        def profiled_decode(instr, pc=None):
+            operation = decode(instr, pc)
+            if operation is None:
+                return operation
+            key = (pc, operation[0])
+            entry = traced.get(key)
+            if entry is None or entry[0] != operation:
+                entry = traced[key] = (operation, (self.counting(operation[0], pc, instr[0]),) + tuple(operation[1:]))
+            return entry[1]
+
+        cpu.decode = profiled_decode
+        return self
+
+    def detach(self):
+        del self.cpu.decode
+        self.cpu.profiler = None
+        self.cpu = None
+
+# operations decoded without a pc (the NOPs a superscalar flush inserts) aren't program instructions
+    def counting(self, handler, pc, opcode):
+        if pc is None:
+            return handler
+        pc_counts = self.pc_counts
+        opcode_counts = self.opcode_counts
+        self.instructions[pc] = self.cpu.imem[pc]
+
+        def counted(*args):
+            pc_counts[pc] += 1
+            opcode_counts[opcode] += 1
+            return handler(*args)
+        return counted
+
+# -----------------------------------------------------------------------------------
+# ----EVENTS----
+
+    def stall(self, pc):
+        self.stall_nops[pc] += 1
+
+    def flush(self, pc, nops):
+        self.flushes[pc] += 1
+        self.flush_nops[pc] += nops
+
+# -----------------------------------------------------------------------------------
+# ----REPORTS----
+
+    def describe(self, pc):
+        if pc is None:
+            return 'NOP'
+        instr = self.instructions.get(pc)
+        if instr is None and self.cpu is not None:
+            instr = self.cpu.imem[pc]
+        return str(pc) + ': ' + ', '.join(str(x) for x in instr)
+
+    def report(self, top=10, width=40):
+        lines = []
+        total = sum(self.pc_counts.values())
+        lines.append('executed instructions: ' + str(total))
+        lines.append('')
+        lines.append('hottest instructions:')
+        for pc, count in self.pc_counts.most_common(top):
+            lines.append('  %10d  %6.2f%%  %s' % (count, 100.0 * count / max(total, 1), self.describe(pc)))
+        lines.append('')
+        lines.append('opcodes:')
+        most = max(self.opcode_counts.values(), default=1)
+        for opcode, count in self.opcode_counts.most_common():
+            bar = '#' * max(1, round(width * count / most))
+            lines.append('  %-12s %10d  %s' % (opcode, count, bar))
+        if self.stall_nops or self.flush_nops:
+            lines.append('')
+            lines.append('stall NOPs (by stalled instruction):')
+            for pc, count in self.stall_nops.most_common(top):
+                lines.append('  %10d  %s' % (count, self.describe(pc)))
+            lines.append('flush NOPs (by control instruction):')
+            for pc, count in self.flush_nops.most_common(top):
+                lines.append('  %10d  %s  (%d flushes)' % (count, self.describe(pc), self.flushes[pc]))
+        return '\n'.join(lines)
+
+# one "frame;frame;... count" line per pc, the format read by flamegraph.pl
+    def folded(self, root='program'):
+        lines = []
+        for pc, count in sorted(self.pc_counts.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+            opcode = 'NOP' if pc is None else self.instructions[pc][0]
+            lines.append('%s;%s;pc %s %d' % (root, opcode, pc, count))
+        for pc, count in sorted(self.stall_nops.items(), key=lambda item: item[0] or 0):
+            lines.append('%s;stall;pc %s %d' % (root, pc, count))
+        for pc, count in sorted(self.flush_nops.items(), key=lambda item: item[0] or 0):
+            lines.append('%s;flush;pc %s %d' % (root, pc, count))
+        return '\n'.join(lines) + '\n'
+
+    def write_folded(self, path, root='program'):
+        with open(path, 'w') as f:
+            f.write(self.folded(root))
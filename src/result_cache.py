@@ -0,0 +1,146 @@
+# Persistent on-disk cache of run() results.
+# An entry is keyed by a content hash of the program, the CPU class, the source of every simulator
+# module (so editing the simulator doesn't serve stale results), the model's config() (sizes, branch
+# predictor, hazard model, cache hierarchy, out-of-order parameters), the trained tables of the
+# predictor and the caches, the pc, counters and finished flag, and the initial memory and register
+# file. It stores the result and a checkpoint of the finished cpu, so a hit restores the memory,
+# registers, counters and the statistics of the branch unit, hazard model, caches and model as well.
+# Runs with a profiler or tracer attached aren't cached, a hit couldn't replay their events.
+# Entries are pickle files in one directory. A hit refreshes the file's modification time and the
+# least recently used entries are deleted when the directory grows beyond max_bytes.
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+from checkpoint import snapshot, restore
+from state import PagedMemory
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cpusim')
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# modules that drive runs, every other module in SOURCE_DIR is part of the simulator a run depends on
+FRONT_ENDS = ('bench.py', 'main.py', 'result_cache.py', 'sampling.py', 'server.py', 'sweep.py',
+              'workload.py')
+# objects with statistics of their own, a hit updates them in place for the caller holding on to them
+STATISTICS = ('branch_unit', 'hazard_model', 'hierarchy')
+
+
+def state_bytes(values):
+    # numpy arrays are hashed by their raw words, lists by their pickled contents and paged memory by
+    # its touched pages
+    if isinstance(values, PagedMemory):
+        return pickle.dumps(values.contents(), protocol=4)
+    if hasattr(values, 'tobytes'):
+        return str(values.dtype).encode() + values.tobytes()
+    return pickle.dumps(list(values), protocol=4)
+
+
+class ResultCache:
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sources = None
+        os.makedirs(directory, exist_ok=True)
+
+    def source_hash(self):
+        if self.sources is None:
+            h = hashlib.sha256()
+            for name in sorted(os.listdir(SOURCE_DIR)):
+                if name.endswith('.py') and name not in FRONT_ENDS:
+                    h.update(name.encode())
+                    with open(os.path.join(SOURCE_DIR, name), 'rb') as f:
+                        h.update(f.read())
+            self.sources = h.hexdigest()
+        return self.sources
+
+# the key has to be taken after load_program and the input set up, right before run()
+    def key(self, cpu, program):
+        h = hashlib.sha256()
+        h.update(pickle.dumps([tuple(instr) for instr in program], protocol=4))
+        h.update(type(cpu).__qualname__.encode())
+        h.update(self.source_hash().encode())
+        h.update(repr(cpu.config()).encode())
+        h.update(repr((cpu.pc, cpu.instr_cntr, cpu.cycle_cntr, cpu.finished)).encode())
+        # a predictor or cache warmed up by an earlier run times the same program differently
+        for name in STATISTICS:
+            h.update(pickle.dumps(getattr(cpu, name, None), protocol=4))
+        if cpu.imem is not cpu.mem:
+            h.update(pickle.dumps(list(cpu.imem), protocol=4))
+        h.update(state_bytes(cpu.mem))
+        h.update(state_bytes(cpu.rf))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        # written to a temporary file first so a concurrent reader never sees half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path(key))
+        self.evict()
+
+    def evict(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.directory, name))
+
+
+# Runs the cpu like cpu.run() unless the same run is already cached, in which case the final state is
+# restored into the cpu. bypass=True always simulates and overwrites the cached entry.
+def cached_run(cpu, program, cache=None, bypass=False, verbose=True):
+    if cpu.profiler is not None:
+        return cpu.run(verbose)
+    if cache is None:
+        cache = ResultCache()
+    key = cache.key(cpu, program)
+    entry = None if bypass else cache.get(key)
+    if entry is None:
+        result = cpu.run(verbose)
+        cache.put(key, {'result': result, 'checkpoint': snapshot(cpu)})
+        return result
+
+    attached = {name: getattr(cpu, name, None) for name in STATISTICS}
+    restore(cpu, entry['checkpoint'])
+    for name, target in attached.items():
+        if target is not None:
+            vars(target).update(vars(getattr(cpu, name)))
+            setattr(cpu, name, target)
+    if verbose:
+        cpu.print_results()
+    return entry['result']
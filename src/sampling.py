@@ -0,0 +1,351 @@
+# SimPoint-style sampled simulation for long runs.
+# The functional core of CPUFast runs the whole program once and records a basic-block vector (BBV) per
+# interval of "interval" instructions: how many instructions of every basic block the interval executed.
+# The normalized vectors are clustered with k-means (k picked by the BIC score like SimPoint does),
+# so every cluster is one phase of the program. A second functional pass takes a checkpoint at the start
+# of the interval closest to each cluster centre and of "samples"-1 more intervals picked at random from
+# the cluster. Only those intervals are simulated with the detailed model, each after "warmup" detailed
+# instructions that warm the pipeline, branch predictor and caches up and aren't counted. The CPI of the
+# samples of a cluster stands for all of its intervals, which gives the cycle estimate. The 95% error
+# bound comes from the spread of the CPI within the clusters (stratified sampling); a cluster with a
+# single sample uses the average relative spread of the others, without any the bound is unknown.
+#
+# usage:
+#     def make_cpu():
+#         cpu = CPUSuperscalar(branch_unit=make_branch_unit('gshare'))
+#         cpu.load_program(program)
+#         bubblesort_input(cpu, 119, 0)
+#         return cpu
+#     estimate = sampled_run(make_cpu, interval=2000)
+#     print(estimate.report())
+#
+# or: python3 sampling.py bubblesort.txt superscalar gshare --size 119 --interval 2000 [--full]
+
+import math
+import random
+
+from simple import CPUSimple
+from pipelined import CPUPipelined
+from superscalar import CPUSuperscalar
+from tomasulo import CPUTomasulo
+from isa import OPCODES
+from checkpoint import snapshot, restore, fast_forward, functional_core
+
+# a 95% confidence interval is +- Z standard errors
+Z = 1.96
+
+
+class Profile:
+    def __init__(self, interval, vectors, starts, lengths):
+        self.interval = interval
+        # one basic-block vector per interval, and the instruction the interval starts at
+        self.vectors = vectors
+        self.starts = starts
+        self.lengths = lengths
+        self.instructions = sum(lengths)
+
+
+class Estimate:
+    def __init__(self, instructions, cycles, error, phases, intervals, simulated, detail_instructions):
+        self.instructions = instructions
+        self.cycles = cycles
+        # half width of the 95% confidence interval of cycles, None if it can't be estimated
+        self.error = error
+        self.phases = phases
+        self.intervals = intervals
+        self.simulated = simulated
+        self.detail_instructions = detail_instructions
+
+    def ipc(self):
+        return self.instructions / self.cycles
+
+    def ipc_bounds(self):
+        if self.error is None:
+            return None
+        low = self.instructions / (self.cycles + self.error)
+        high = self.instructions / max(self.cycles - self.error, 1)
+        return low, high
+
+    def report(self):
+        lines = []
+        lines.append('intervals: ' + str(self.intervals) + ', phases: ' + str(self.phases))
+        lines.append('simulated in detail: ' + str(self.simulated) + ' intervals, ' + str(self.detail_instructions)
+                     + ' instructions with warm-up (%.2f%% of %d)' % (
+                         100.0 * self.detail_instructions / self.instructions, self.instructions))
+        if self.error is None:
+            lines.append('estimated cycles: %d (error bound unknown)' % round(self.cycles))
+            lines.append('estimated instructions per cycle: ' + str(self.ipc()))
+        else:
+            low, high = self.ipc_bounds()
+            lines.append('estimated cycles: %d +- %d (%.2f%%, 95%%)' % (
+                round(self.cycles), round(self.error), 100.0 * self.error / self.cycles))
+            lines.append('estimated instructions per cycle: %s (%.4f - %.4f)' % (self.ipc(), low, high))
+        return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------------
+# ----PROFILING----
+
+# pc -> basic block number, blocks start at jump/branch targets and behind control instructions
+def basic_blocks(program):
+    size = len(program)
+    leaders = [False] * size
+    if size:
+        leaders[0] = True
+    for pc, instr in enumerate(program):
+        opcode = OPCODES.get(instr[0]) if isinstance(instr, tuple) else None
+        if opcode is not None and (opcode.control or opcode.unit == 'stop'):
+            if pc + 1 < size:
+                leaders[pc + 1] = True
+            if opcode.control and 0 <= instr[opcode.target] < size:
+                leaders[instr[opcode.target]] = True
+    block_of = []
+    block = -1
+    for leader in leaders:
+        if leader:
+            block += 1
+        block_of.append(block)
+    return block_of, block + 1
+
+# runs cpu's program to the end with the functional core, cpu's state is used up by it
+def profile(cpu, interval=10000):
+    fast = functional_core(cpu)
+    code = fast.code
+    size = len(code)
+    block_of, blocks = basic_blocks(cpu.imem[:size])
+    vectors = []
+    starts = []
+    lengths = []
+    executed = 0
+    pc = cpu.pc
+    while 0 <= pc < size:
+        counts = [0] * size
+        n = 0
+        while n < interval and 0 <= pc < size:
+            counts[pc] += 1
+            pc = code[pc]()
+            n += 1
+        vector = [0] * blocks
+        for p, count in enumerate(counts):
+            if count:
+                vector[block_of[p]] += count
+        vectors.append(vector)
+        starts.append(executed)
+        lengths.append(n)
+        executed += n
+    return Profile(interval, vectors, starts, lengths)
+
+# -----------------------------------------------------------------------------------
+# ----CLUSTERING----
+
+def normalize(vectors, dimensions, seed):
+    points = []
+    for vector in vectors:
+        total = sum(vector) or 1
+        points.append([count / total for count in vector])
+    if not points or len(points[0]) <= dimensions:
+        return points
+    # random linear projection down to "dimensions", like SimPoint's 15
+    rng = random.Random(seed)
+    matrix = [[rng.uniform(-1, 1) for _ in range(dimensions)] for _ in range(len(points[0]))]
+    projected = []
+    for point in points:
+        row = [0.0] * dimensions
+        for x, weights in zip(point, matrix):
+            if x:
+                for d in range(dimensions):
+                    row[d] += x * weights[d]
+        projected.append(row)
+    return projected
+
+def distance(a, b):
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
+
+def kmeans(points, k, rng, iterations=100):
+    # k-means++ seeding
+    centres = [points[rng.randrange(len(points))]]
+    while len(centres) < k:
+        weights = [min(distance(p, c) for c in centres) for p in points]
+        total = sum(weights)
+        if total == 0:
+            break
+        r = rng.uniform(0, total)
+        for p, w in zip(points, weights):
+            r -= w
+            if r <= 0:
+                break
+        centres.append(p)
+    labels = None
+    for _ in range(iterations):
+        new_labels = [min(range(len(centres)), key=lambda c: distance(p, centres[c])) for p in points]
+        if new_labels == labels:
+            break
+        labels = new_labels
+        sums = [[0.0] * len(points[0]) for _ in centres]
+        sizes = [0] * len(centres)
+        for p, label in zip(points, labels):
+            sizes[label] += 1
+            row = sums[label]
+            for d, x in enumerate(p):
+                row[d] += x
+        centres = [[x / sizes[c] for x in sums[c]] if sizes[c] else centres[c] for c in range(len(centres))]
+    return centres, labels
+
+# Bayesian information criterion of a clustering under the spherical Gaussian model of x-means
+def bic(points, centres, labels):
+    r = len(points)
+    k = len(centres)
+    m = len(points[0])
+    sse = sum(distance(p, centres[label]) for p, label in zip(points, labels))
+    variance = max(sse / max(r - k, 1), 1e-12)
+    sizes = [labels.count(c) for c in range(k)]
+    likelihood = (sum(n * math.log(n) for n in sizes if n) - r * math.log(r)
+                  - r * math.log(2 * math.pi) / 2 - r * m * math.log(variance) / 2 - (r - k) / 2)
+    parameters = (k - 1) + m * k + 1
+    return likelihood - parameters * math.log(r) / 2
+
+# picks the smallest k whose BIC reaches "threshold" of the range of scores seen, returns the labels
+def cluster(vectors, max_k=10, threshold=0.9, dimensions=15, seed=0):
+    points = normalize(vectors, dimensions, seed)
+    rng = random.Random(seed)
+    results = []
+    for k in range(1, min(max_k, len(points)) + 1):
+        centres, labels = kmeans(points, k, rng)
+        results.append((bic(points, centres, labels), centres, labels))
+    scores = [score for score, _, _ in results]
+    limit = min(scores) + threshold * (max(scores) - min(scores))
+    for score, centres, labels in results:
+        if score >= limit:
+            return points, centres, labels
+
+# -----------------------------------------------------------------------------------
+# ----DETAILED SIMULATION----
+
+# runs warmup and then length instructions in detail, returns (instructions, cycles) of the measured part
+def simulate(cpu, warmup, length):
+    start = cpu.instr_cntr
+    if warmup:
+        for _ in cpu.run_until(lambda cpu: cpu.instr_cntr - start >= warmup, interval=None):
+            pass
+    instr, cycles = cpu.instr_cntr, cpu.cycle_cntr
+    for _ in cpu.run_until(lambda cpu: cpu.instr_cntr - start >= warmup + length, interval=None):
+        pass
+    return cpu.instr_cntr - instr, cpu.cycle_cntr - cycles
+
+# -----------------------------------------------------------------------------------
+# ----ESTIMATE----
+
+def choose_samples(points, centres, labels, samples, rng):
+    chosen = {}
+    for c, centre in enumerate(centres):
+        members = [i for i, label in enumerate(labels) if label == c]
+        if not members:
+            continue
+        members.sort(key=lambda i: distance(points[i], centre))
+        rest = members[1:]
+        rng.shuffle(rest)
+        chosen[c] = sorted([members[0]] + rest[:samples - 1])
+    return chosen
+
+# make_cpu() has to return a new cpu of the detailed model with the program and its input loaded
+def sampled_run(make_cpu, interval=10000, max_k=10, samples=2, warmup=1000, seed=0):
+    prof = profile(make_cpu(), interval)
+    points, centres, labels = cluster(prof.vectors, max_k, seed=seed)
+    chosen = choose_samples(points, centres, labels, samples, random.Random(seed))
+
+    # checkpoints in program order from a second functional pass
+    starts = sorted(i for members in chosen.values() for i in members)
+    checkpoints = {}
+    cpu = make_cpu()
+    position = 0
+    for i in starts:
+        begin = max(prof.starts[i] - warmup, 0)
+        position += fast_forward(cpu, instructions=begin - position)
+        checkpoints[i] = snapshot(cpu, None)
+
+    cpis = {}
+    detail_instructions = 0
+    for i in starts:
+        restore(cpu, checkpoints[i])
+        cpu.instr_cntr = cpu.cycle_cntr = 0
+        cpu.finished = False
+        skipped = prof.starts[i] - max(prof.starts[i] - warmup, 0)
+        instr, cycles = simulate(cpu, skipped, prof.lengths[i])
+        detail_instructions += cpu.instr_cntr
+        cpis[i] = cycles / max(instr, 1)
+
+    cycles = 0.0
+    variance = 0.0
+    spreads = []
+    unknown = []
+    for c, members in chosen.items():
+        size = labels.count(c)
+        weight = sum(length for length, label in zip(prof.lengths, labels) if label == c)
+        values = [cpis[i] for i in members]
+        mean = sum(values) / len(values)
+        cycles += mean * weight
+        if len(values) == size:
+            continue
+        if len(values) == 1:
+            unknown.append((mean, weight, size))
+            continue
+        s2 = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+        spreads.append(s2 / (mean * mean) if mean else 0.0)
+        variance += weight * weight * s2 / len(values) * (1 - len(values) / size)
+    error = None
+    if not unknown or spreads:
+        relative = sum(spreads) / len(spreads) if spreads else 0.0
+        for mean, weight, size in unknown:
+            variance += weight * weight * relative * mean * mean * (1 - 1 / size)
+        error = Z * math.sqrt(variance)
+    return Estimate(prof.instructions, cycles, error, len(chosen), len(prof.vectors), len(starts), detail_instructions)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import time
+
+    from branch import make_branch_unit, PREDICTORS
+    from sweep import INPUTS, cached_program, memory_size
+
+    parser = argparse.ArgumentParser(description='Estimate the cycles of a long run from sampled intervals.')
+    parser.add_argument('program')
+    parser.add_argument('mode', choices=['simple', 'pipelined', 'superscalar', 'tomasulo'])
+    parser.add_argument('predictor', nargs='?', choices=list(PREDICTORS))
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mem-size', type=int, default=None, help='default: the smallest memory the input fits into')
+    parser.add_argument('--interval', type=int, default=10000)
+    parser.add_argument('--max-k', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=2)
+    parser.add_argument('--warmup', type=int, default=1000)
+    parser.add_argument('--full', action='store_true', help='also run the whole program in detail to compare')
+    args = parser.parse_args()
+
+    program = cached_program(args.program)
+    if args.mem_size is None:
+        args.mem_size = memory_size(args.program, args.size)
+
+    def make_cpu():
+        if args.mode == 'pipelined':
+            cpu = CPUPipelined(args.mem_size, branch_unit=args.predictor and make_branch_unit(args.predictor))
+        elif args.mode == 'superscalar':
+            cpu = CPUSuperscalar(args.mem_size, branch_unit=args.predictor and make_branch_unit(args.predictor))
+        elif args.mode == 'tomasulo':
+            cpu = CPUTomasulo(args.mem_size)
+        else:
+            cpu = CPUSimple(args.mem_size)
+        cpu.load_program(program)
+        INPUTS[os.path.basename(args.program)](cpu, args.size, args.seed)
+        return cpu
+
+    start_time = time.time()
+    estimate = sampled_run(make_cpu, args.interval, args.max_k, args.samples, args.warmup, args.seed)
+    print(estimate.report())
+    print(f"Execution time: {time.time() - start_time:.6f} seconds")
+    if args.full:
+        start_time = time.time()
+        instr, cycles, ipc = make_cpu().run(verbose=False)
+        print('detailed cycles: %d, instructions per cycle: %s, error: %.2f%%' % (
+            cycles, ipc, 100.0 * (estimate.cycles - cycles) / cycles))
+        print(f"Execution time: {time.time() - start_time:.6f} seconds")
@@ -0,0 +1,453 @@
+# Local simulation service for interactive use.
+# An asyncio server on localhost takes simulation jobs (program, mode, initial memory and registers) from
+# any number of clients and runs them on a pool of worker processes, so notebooks and dashboards don't
+# block on cpu.run(). The workers run at a lower priority (nice) and there is one fewer than there are
+# cores by default, so heavy runs don't starve the machine. A worker runs its CPU with run_until and
+# reports the cycles and instructions so far every progress_interval seconds; the server passes them on
+# to every client watching the job, with the IPC so far. A queued job is cancelled right away, a running
+# one stops at its next progress report.
+#
+# Protocol: one JSON object per line in both directions.
+#   {"op": "submit", "mode": "superscalar", "predictor": "gshare", "program": "bubblesort.txt",
+#    "input": {"size": 100, "seed": 1}, "watch": true}
+#   {"op": "submit", "mode": "simple", "source": "VLOAD 1023 1\nSTOP", "memory": {"1023": 7},
+#    "registers": {"2": 1}, "read_memory": [1000, 1024], "max_cycles": 1000000}
+#   {"op": "watch", "job": 3}    {"op": "cancel", "job": 3}    {"op": "status", "job": 3}    {"op": "list"}
+# "program" is a file (or one of the benchmarks), "source" assembly text and "instructions" a list of
+# instruction lists. "input" runs the program's input generator from sweep.py, "init" applies a memory
+# spec (see meminit.py, e.g. one written by workload.py) and "memory" values are written from the given
+# address on (a list is written to consecutive addresses).
+# Replies carry "event": accepted, status, jobs, cancelling or error; the events of a job are started,
+# progress, done (with the result), failed (with the error) and cancelled.
+#
+# usage:
+#     python3 server.py [--host 127.0.0.1] [--port 8765] [--workers 3] [--nice 10]
+#
+#     client = await Client.connect(port=8765)
+#     job = await client.submit(mode='superscalar', program='bubblesort.txt', input={'size': 100})
+#     async for event in client.watch(job):
+#         print(event)
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
+from assembler import assemble
+from branch import make_branch_unit
+from meminit import apply, mem_size
+from sweep import MODES, INPUTS, cached_program, memory_size
+
+PORT = 8765
+
+# events after which a job doesn't change any more
+FINAL = ('done', 'failed', 'cancelled')
+JOB_EVENTS = ('started', 'progress') + FINAL
+
+# -----------------------------------------------------------------------------------
+# ----WORKER----
+# runs in the worker processes, everything it gets and returns has to be picklable
+
+def lower_priority(nice):
+    if nice:
+        os.nice(nice)
+
+def json_value(value):
+    if isinstance(value, (bool, int)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return repr(value)
+
+def build_cpu(spec):
+    mode = spec.get('mode', 'simple')
+    if mode not in MODES:
+        raise ValueError('mode must be one of: ' + ', '.join(MODES))
+    kwargs = {}
+    if spec.get('mem_size') is not None:
+        kwargs['mem_size'] = spec['mem_size']
+    elif spec.get('init') is not None:
+        kwargs['mem_size'] = mem_size(spec['init'])
+    elif 'input' in spec:
+        kwargs['mem_size'] = memory_size(spec.get('program', ''), spec['input'].get('size', 5))
+    if spec.get('reg_size') is not None:
+        kwargs['reg_size'] = spec['reg_size']
+    if spec.get('predictor') is not None and mode in ('pipelined', 'superscalar'):
+        kwargs['branch_unit'] = make_branch_unit(spec['predictor'])
+    cpu = MODES[mode](**kwargs)
+
+    if 'source' in spec:
+        program = assemble(spec['source'], '<job>')
+    elif 'instructions' in spec:
+        program = [tuple(instr) for instr in spec['instructions']]
+    elif 'program' in spec:
+        program = cached_program(spec['program'])
+    else:
+        raise ValueError('a job needs a "program", "source" or "instructions"')
+    cpu.load_program(program)
+
+    if 'input' in spec:
+        name = os.path.basename(spec.get('program', ''))
+        if name not in INPUTS:
+            raise ValueError('no input generator for program ' + repr(spec.get('program')))
+        INPUTS[name](cpu, spec['input'].get('size', 5), spec['input'].get('seed', 0))
+    if spec.get('init') is not None:
+        apply(cpu, spec['init'])
+    for addr, value in spec.get('memory', {}).items():
+        addr = int(addr)
+        if isinstance(value, list):
+            cpu.mem[addr:addr + len(value)] = value
+        else:
+            cpu.mem[addr] = value
+    for reg, value in spec.get('registers', {}).items():
+        cpu.rf[int(reg)] = value
+    return cpu
+
+def run_job(job, spec, progress, cancel, interval):
+    cpu = build_cpu(spec)
+    progress.put((job, 'started', 0, 0))
+    max_cycles = spec.get('max_cycles')
+    report = time.monotonic() + interval
+    # the compiled core of the fast mode runs chunks of 100000 instructions between two checks
+    for _ in cpu.run_until(max_cycles=max_cycles, interval=300000 if spec.get('mode') == 'fast' else 1000):
+        now = time.monotonic()
+        if now >= report:
+            if cancel.is_set():
+                return {'cancelled': True}
+            progress.put((job, 'progress', cpu.cycle_cntr, cpu.instr_cntr))
+            report = now + interval
+    result = {
+        'instructions': cpu.instr_cntr,
+        'cycles': cpu.cycle_cntr,
+        'ipc': cpu.instr_cntr / cpu.cycle_cntr if cpu.cycle_cntr else 0.0,
+        'pc': cpu.pc,
+        'registers': [json_value(value) for value in cpu.rf],
+    }
+    if 'read_memory' in spec:
+        start, end = spec['read_memory']
+        result['memory'] = [json_value(value) for value in cpu.mem[start:end]]
+    if getattr(cpu, 'branch_unit', None) is not None:
+        result['branch_accuracy'] = cpu.branch_unit.accuracy()
+    return result
+
+# -----------------------------------------------------------------------------------
+# ----SERVER----
+
+class Job:
+    def __init__(self, number, spec):
+        self.number = number
+        self.spec = spec
+        self.state = 'queued'
+        self.cycles = 0
+        self.instructions = 0
+        self.result = None
+        self.error = None
+        self.future = None
+        self.cancel = None
+        # one asyncio queue per watching client
+        self.watchers = []
+
+    def status(self):
+        message = {'event': 'status', 'job': self.number, 'state': self.state, 'mode': self.spec.get('mode'),
+                   'cycles': self.cycles, 'instructions': self.instructions}
+        if self.result is not None:
+            message['result'] = self.result
+        if self.error is not None:
+            message['error'] = self.error
+        return message
+
+    def publish(self, message):
+        for queue in self.watchers:
+            queue.put_nowait(message)
+
+
+class SimulationServer:
+    def __init__(self, workers=None, nice=10, progress_interval=0.25):
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) - 1)
+        self.workers = workers
+        self.nice = nice
+        self.progress_interval = progress_interval
+        self.jobs = {}
+        self.next_job = 1
+        self.server = None
+        # connection handler task -> its writer
+        self.connections = {}
+
+    async def start(self, host='127.0.0.1', port=PORT):
+        self.loop = asyncio.get_running_loop()
+        self.manager = multiprocessing.Manager()
+        self.progress = self.manager.Queue()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=lower_priority, initargs=(self.nice,))
+        self.pump = asyncio.create_task(self.pump_progress())
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for job in self.jobs.values():
+            if job.state in ('queued', 'running'):
+                self.cancel(job)
+        self.server.close()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+        self.progress.put(None)
+        await self.pump
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+
+# -----------------------------------------------------------------------------------
+# ----JOBS----
+
+    def submit(self, spec):
+        job = Job(self.next_job, spec)
+        self.next_job += 1
+        self.jobs[job.number] = job
+        job.cancel = self.manager.Event()
+        job.future = self.pool.submit(run_job, job.number, spec, self.progress, job.cancel, self.progress_interval)
+        asyncio.create_task(self.finish(job))
+        return job
+
+    async def finish(self, job):
+        try:
+            result = await asyncio.wrap_future(job.future)
+        except (CancelledError, asyncio.CancelledError):
+            self.set_state(job, 'cancelled', {})
+        except Exception as e:
+            job.error = type(e).__name__ + ': ' + str(e)
+            self.set_state(job, 'failed', {'error': job.error})
+        else:
+            if result.get('cancelled'):
+                self.set_state(job, 'cancelled', {'cycles': job.cycles, 'instructions': job.instructions})
+            else:
+                job.result = result
+                job.cycles = result['cycles']
+                job.instructions = result['instructions']
+                self.set_state(job, 'done', {'result': result})
+
+    def set_state(self, job, state, fields):
+        if job.state in FINAL:
+            return
+        job.state = state
+        message = {'event': state, 'job': job.number}
+        message.update(fields)
+        job.publish(message)
+
+    def cancel(self, job):
+        if job.state in FINAL:
+            return False
+        if not job.future.cancel():
+            # already running, the worker stops at its next progress report
+            job.cancel.set()
+        return True
+
+# progress messages of all workers come through one manager queue, read from a thread
+    async def pump_progress(self):
+        while True:
+            message = await self.loop.run_in_executor(None, self.progress.get)
+            if message is None:
+                return
+            number, kind, cycles, instructions = message
+            job = self.jobs.get(number)
+            if job is None or job.state in FINAL:
+                continue
+            job.cycles = cycles
+            job.instructions = instructions
+            if kind == 'started':
+                job.state = 'running'
+                job.publish({'event': 'started', 'job': number})
+            else:
+                job.publish({'event': 'progress', 'job': number, 'cycles': cycles, 'instructions': instructions,
+                             'ipc': instructions / cycles if cycles else 0.0})
+
+# -----------------------------------------------------------------------------------
+# ----CONNECTIONS----
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        streams = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    reply = self.request(request, writer, streams)
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {'event': 'error', 'error': str(e)}
+                if reply is not None:
+                    self.send(writer, reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for stream in streams:
+                stream.cancel()
+            writer.close()
+            del self.connections[task]
+
+    def request(self, request, writer, streams):
+        op = request.get('op')
+        if op == 'submit':
+            spec = {key: value for key, value in request.items() if key not in ('op', 'watch')}
+            if spec.get('mode', 'simple') not in MODES:
+                raise ValueError('mode must be one of: ' + ', '.join(MODES))
+            job = self.submit(spec)
+            self.send(writer, {'event': 'accepted', 'job': job.number})
+            if request.get('watch'):
+                streams.append(asyncio.create_task(self.watch(job, writer)))
+            return None
+        if op == 'list':
+            return {'event': 'jobs', 'jobs': [job.status() for job in self.jobs.values()]}
+        if op not in ('watch', 'cancel', 'status'):
+            raise ValueError('unknown op ' + repr(op))
+        job = self.jobs.get(request['job'])
+        if job is None:
+            raise ValueError('no job ' + repr(request['job']))
+        if op == 'watch':
+            streams.append(asyncio.create_task(self.watch(job, writer)))
+            return None
+        if op == 'cancel':
+            return {'event': 'cancelling', 'job': job.number, 'cancelled': self.cancel(job)}
+        return job.status()
+
+    async def watch(self, job, writer):
+        if job.state in FINAL:
+            self.send(writer, self.final_message(job))
+            return
+        queue = asyncio.Queue()
+        job.watchers.append(queue)
+        try:
+            while True:
+                message = await queue.get()
+                self.send(writer, message)
+                await writer.drain()
+                if message['event'] in FINAL:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            job.watchers.remove(queue)
+
+    def final_message(self, job):
+        message = {'event': job.state, 'job': job.number}
+        if job.state == 'done':
+            message['result'] = job.result
+        elif job.state == 'failed':
+            message['error'] = job.error
+        return message
+
+    def send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b'\n')
+
+# -----------------------------------------------------------------------------------
+# ----CLIENT----
+
+class JobFailed(Exception):
+    pass
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.replies = asyncio.Queue()
+        # job -> queue of its events
+        self.events = {}
+        self.reading = asyncio.create_task(self.read())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=PORT):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if message['event'] in JOB_EVENTS:
+                self.job_events(message['job']).put_nowait(message)
+            else:
+                self.replies.put_nowait(message)
+
+    def job_events(self, job):
+        if job not in self.events:
+            self.events[job] = asyncio.Queue()
+        return self.events[job]
+
+    async def request(self, **message):
+        self.writer.write(json.dumps(message).encode() + b'\n')
+        await self.writer.drain()
+        reply = await self.replies.get()
+        if reply['event'] == 'error':
+            raise ValueError(reply['error'])
+        return reply
+
+    async def submit(self, watch=True, **spec):
+        reply = await self.request(op='submit', watch=watch, **spec)
+        return reply['job']
+
+# yields the events of a job until it is done, failed or cancelled (submit watches by default)
+    async def watch(self, job, subscribe=False):
+        if subscribe:
+            self.writer.write(json.dumps({'op': 'watch', 'job': job}).encode() + b'\n')
+            await self.writer.drain()
+        queue = self.job_events(job)
+        while True:
+            event = await queue.get()
+            yield event
+            if event['event'] in FINAL:
+                return
+
+    async def result(self, job, subscribe=False):
+        async for event in self.watch(job, subscribe):
+            if event['event'] == 'done':
+                return event['result']
+            if event['event'] in FINAL:
+                raise JobFailed('job ' + str(job) + ' ' + event['event'] + ': ' + event.get('error', ''))
+
+    async def cancel(self, job):
+        return (await self.request(op='cancel', job=job))['cancelled']
+
+    async def status(self, job):
+        return await self.request(op='status', job=job)
+
+    async def jobs(self):
+        return (await self.request(op='list'))['jobs']
+
+    async def close(self):
+        self.reading.cancel()
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(host, port, workers, nice):
+    server = SimulationServer(workers, nice)
+    port = await server.start(host, port)
+    print('serving on ' + host + ':' + str(port) + ' with ' + str(server.workers) + ' workers')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run simulation jobs for local clients.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--nice', type=int, default=10)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.nice))
+    except KeyboardInterrupt:
+        pass
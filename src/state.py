@@ -0,0 +1,202 @@
+# Storage backends for the machine state (instruction store, data memory and register file).
+# ListState is the original layout, where a single Python list holds the program and the data,
+# so programs can read and rewrite their own instructions.
+# NumpyState keeps the instructions in a separate store and the data memory and register file in
+# int32/int64 numpy arrays, which costs 4 or 8 bytes per word instead of a pointer to a boxed int
+# and gives the arithmetic real word widths.
+# PagedState allocates the data memory a page at a time when it is first touched, so an address space
+# of gigabytes only costs the pages the program uses. Without a file the pages are Python lists and the
+# program lives in the memory like with ListState; with a file the memory is the file mapped with mmap
+# as 64-bit words, pages the OS only reads in when they are touched, so a dataset written with
+# write_words is loaded without copying, and the instructions are kept separately like with NumpyState.
+#
+# usage:
+#     cpu = CPUSimple(1 << 30, state=PagedState())                      # 8 GB address space
+#     write_words('input.words', 1 << 29, values)                       # the dataset at word 2^29
+#     cpu = CPUPipelined(1 << 30, state=PagedState(path='input.words'))
+
+import array
+import mmap
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WORD_TYPES = {32: 'int32', 64: 'int64'}
+
+
+class ListState:
+    def allocate(self, mem_size, reg_size):
+        mem = [0] * mem_size
+        return mem, mem, [0] * reg_size
+
+
+class NumpyState:
+    def __init__(self, word_bits=32, wrap=True):
+        if np is None:
+            raise ImportError('NumpyState needs numpy, install it with "pip install numpy"')
+        if word_bits not in WORD_TYPES:
+            raise ValueError('word_bits must be one of: ' + ', '.join(str(bits) for bits in WORD_TYPES))
+        self.word_bits = word_bits
+        self.dtype = np.dtype(WORD_TYPES[word_bits])
+        # wrap=True wraps results around silently like a real ALU, wrap=False raises FloatingPointError
+        # on overflow. It only holds while the CPU runs, see arithmetic().
+        self.wrap = wrap
+
+# the context the CPU executes instructions in, so the overflow setting stays with this CPU and doesn't
+# change numpy's for the rest of the process (backends without one run in a nullcontext)
+    def arithmetic(self):
+        return np.errstate(over='ignore' if self.wrap else 'raise')
+
+    def allocate(self, mem_size, reg_size):
+        # the instruction store is filled by load_program and ends with a None, which stops the CPU
+        imem = [None]
+        return imem, np.zeros(mem_size, dtype=self.dtype), np.zeros(reg_size, dtype=self.dtype)
+
+
+class PagedState:
+    def __init__(self, page_words=4096, path=None, writeback=False):
+        if page_words < 1 or page_words & (page_words - 1):
+            raise ValueError('page_words must be a power of two')
+        self.page_words = page_words
+        self.path = path
+        # writeback=False maps the file copy-on-write, the run doesn't change it
+        self.writeback = writeback
+
+    def allocate(self, mem_size, reg_size):
+        mem = PagedMemory(mem_size, self.page_words, self.path, self.writeback)
+        if self.path is None:
+            return mem, mem, [0] * reg_size
+        # the mapped words only hold ints, the instruction store ends with a None like NumpyState's
+        return [None], mem, [0] * reg_size
+
+
+class PagedMemory:
+    __slots__ = ('size', 'page_words', 'shift', 'mask', 'pages', 'path', 'writeback', 'map', 'words')
+
+    def __init__(self, size, page_words=4096, path=None, writeback=False):
+        self.size = size
+        self.page_words = page_words
+        self.shift = page_words.bit_length() - 1
+        self.mask = page_words - 1
+        # page number -> its words, a list or a view of the mapped file; missing pages are all 0
+        self.pages = {}
+        self.path = path
+        self.writeback = writeback
+        self.map = None
+        self.words = None
+        if path is not None:
+            self.open()
+
+# maps the file, which is made as long as the memory first (sparsely, the zeros take no disk space)
+    def open(self):
+        nbytes = self.size * 8
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            if os.fstat(fd).st_size < nbytes:
+                os.ftruncate(fd, nbytes)
+            self.map = mmap.mmap(fd, nbytes, access=mmap.ACCESS_WRITE if self.writeback else mmap.ACCESS_COPY)
+        finally:
+            os.close(fd)
+        self.words = memoryview(self.map).cast('q')
+
+    def close(self):
+        self.pages = {}
+        if self.map is not None:
+            self.words.release()
+            self.map.close()
+            self.map = None
+            self.words = None
+
+    def __len__(self):
+        return self.size
+
+    def index(self, addr):
+        if not -self.size <= addr < self.size:
+            raise IndexError('memory address out of range: ' + str(addr))
+        if addr < 0:
+            return addr + self.size
+        return addr
+
+# the common case, a word of a page that is there, takes one dict lookup; the last page is cut off at
+# the end of memory, so an address past it raises IndexError like one past a missing page
+    def __getitem__(self, addr):
+        try:
+            if addr >= 0:
+                return self.pages[addr >> self.shift][addr & self.mask]
+        except (KeyError, TypeError):
+            pass
+        if isinstance(addr, slice):
+            return [self[i] for i in range(*addr.indices(self.size))]
+        addr = self.index(addr)
+        page = self.pages.get(addr >> self.shift)
+        if page is None:
+            if self.map is None:
+                return 0
+            page = self.touch(addr >> self.shift)
+        return page[addr & self.mask]
+
+    def __setitem__(self, addr, value):
+        try:
+            if addr >= 0:
+                self.pages[addr >> self.shift][addr & self.mask] = value
+                return
+        except (KeyError, TypeError):
+            pass
+        if isinstance(addr, slice):
+            for i, v in zip(range(*addr.indices(self.size)), value):
+                self[i] = v
+            return
+        addr = self.index(addr)
+        page = self.pages.get(addr >> self.shift)
+        if page is None:
+            page = self.touch(addr >> self.shift)
+        page[addr & self.mask] = value
+
+# the page is allocated (or its part of the file viewed) on the first access that needs it
+    def touch(self, n):
+        start = n * self.page_words
+        if self.map is None:
+            page = [0] * min(self.page_words, self.size - start)
+        else:
+            page = self.words[start:start + self.page_words]
+        self.pages[n] = page
+        return page
+
+    def resident_pages(self):
+        return len(self.pages)
+
+# (page_words, [(page number, words), ...]) of the touched pages, what checkpoints and the result cache keep
+    def contents(self):
+        return self.page_words, [(n, list(self.pages[n])) for n in sorted(self.pages)]
+
+# Back to the state contents() returned: pages that weren't touched then are zero again, or hold the
+# file's words with a copy-on-write mapping. A writeback mapping has overwritten the file, so its pages
+# touched since are zeroed.
+    def restore(self, contents):
+        page_words, pages = contents
+        if page_words != self.page_words:
+            raise ValueError('contents of ' + str(page_words) + ' word pages, the memory has ' + str(self.page_words))
+        if self.map is None:
+            self.pages = {}
+        elif not self.writeback:
+            self.close()
+            self.open()
+        else:
+            for page in self.pages.values():
+                page[:] = array.array('q', bytes(8 * len(page)))
+            self.pages = {}
+        for n, words in pages:
+            page = self.touch(n)
+            for i, value in enumerate(words):
+                page[i] = value
+
+# writes values as 64-bit words into a file, from word "address" on, for PagedState(path=...) to map
+def write_words(path, address, values):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        os.pwrite(fd, array.array('q', values).tobytes(), address * 8)
+    finally:
+        os.close(fd)
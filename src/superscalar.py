@@ -1,209 +1,146 @@
-import queue
-
-class CPUSuperscalar:
-    def __init__(self, mem_size=1024, reg_size=32):
-        self.pipeline_registers = [None] * 10 
-        self.mem_size = mem_size
-        self.mem = [0] * mem_size
-        self.reg_size = reg_size
-        self.rf = [0] * reg_size
-        self.pc = 0
-        self.finished = False
-
-# ----METRICS----
-        self.cycle_cntr = 0
-        self.instr_cntr = 0
+from branch import is_control
+from isa import CPUBase, OPCODES
+
+
+# Fixed size FIFO over a preallocated list. The model is single threaded, so it needs none of the
+# locking of queue.Queue, and reusing one buffer means a cycle doesn't allocate a new queue.
+class RingBuffer:
+    __slots__ = ('items', 'head', 'size')
+
+    def __init__(self, capacity):
+        self.items = [None] * capacity
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def empty(self):
+        return self.size == 0
+
+    def put(self, item):
+        items = self.items
+        if self.size == len(items):
+            raise IndexError('ring buffer is full')
+        items[(self.head + self.size) % len(items)] = item
+        self.size += 1
+
+    def get(self):
+        if self.size == 0:
+            raise IndexError('ring buffer is empty')
+        items = self.items
+        item = items[self.head]
+        items[self.head] = None
+        self.head = (self.head + 1) % len(items)
+        self.size -= 1
+        return item
+
+    def clear(self):
+        while self.size:
+            self.get()
+
+# the queued items, oldest first
+    def contents(self):
+        items = self.items
+        return [items[(self.head + k) % len(items)] for k in range(self.size)]
+
+
+class CPUSuperscalar(CPUBase):
+    def __init__(self, mem_size=1024, reg_size=32, state=None, branch_unit=None, hierarchy=None):
+        super().__init__(mem_size, reg_size, state, hierarchy)
+        # 0-2 fetch buffer, 3-5 decoded operations, 6-9 retired operations; the list never changes size
+        self.pipeline_registers = [None] * 10
+        # the decoded NOP that stalls and flushes put into the pipeline, decoded once
+        self.nop_operation = self.decode(('NOP',))
 # ----CONTROL DEPENDENCIES----
         self.control_dependency = False
         self.control_index = None
-        self.pushed_op = queue.Queue()
+        # fetched instructions a stall kept from being decoded, fetched again in the next cycle
+        self.pushed_op = RingBuffer(3)
         self.nop_counter = 0
         self.triplet_index = None
-
-# -----------------------------------------------------------------------------------
-# ----INSTRUCTION FUNCTIONS----
-  
-    def load(self, s1, r):
-        self.rf[r] = self.mem[self.rf[s1]]
-
-    def load_value(self, s1, r):
-        self.rf[r] = self.mem[s1]
-    
-    def store(self, s1, r):
-        self.mem[self.rf[s1]] = self.rf[r]
-
-    def store_value(self, s1, r):
-        self.mem[s1] = self.rf[r]
-    
-    def add(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] + self.rf[s2]
-
-    def sub(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] - self.rf[s2]     
-
-    def mul(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] * self.rf[s2]
-    
-    def _and(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] and self.rf[s2]
-    
-    def _or(self, s1, s2, r):
-        self.rf[r] = self.rf[s1] or self.rf[s2]
-    
-    def jump(self, target_addr):
-        self.pc = target_addr
-    
-    def branch_lt(self, s1, s2, target_addr):
-        if self.rf[s1] < self.rf[s2]:
-            self.pc = target_addr
-    
-    def branch_zero(self, s1, target_addr):
-        if self.rf[s1] == 0:
-            self.pc = target_addr
-    
-    def stop(self):
-        self.finished = True
-    
-    def mov(self, s1, s2):
-        self.rf[s1] = self.rf[s2]
-
-    def cmp_lt(self, s1, s2, r):
-        if self.rf[s1] < self.rf[s2]:
-            self.rf[r] = True
-        else:
-            self.rf[r] = False
-    
-    def cmp_eq(self, s1, s2, r):
-        if self.rf[s1] == self.rf[s2]:
-            self.rf[r] = True
-        else:
-            self.rf[r] = False
-
-    def nop(self):
-        pass
-
-# -----------------------------------------------------------------------------------
-# ----PROCESSOR FUNCTIONS----
+        # pc of the instruction held in each of the fetch slots (None for NOPs)
+        self.slot_pcs = [None] * 3
+        self.has_dep = [False] * 3
+        # read/write bitmasks of the loaded program, indexed by pc
+        self.hazard_bits = {}
+        self.masks = []
+        self.control_pc = None
+# ----BRANCH PREDICTION----
+        # with a BranchUnit the model fetches speculatively instead of looking at rf in fetch_stage
+        self.branch_unit = branch_unit
+        # predicted next pc of the control instruction in each fetch slot, None for other instructions
+        self.slot_predictions = [None] * 3
+        # (pc, instruction, predicted next pc) of the operations in pipeline registers 3, 4, 5
+        self.exec_slots = [(None, None, None)] * 3
+        self.fetch_ended = False
+
+    def config(self):
+        config = super().config()
+        config['branch_unit'] = None if self.branch_unit is None else self.branch_unit.config()
+        return config
+
+# drop the predecoded state of a rewritten address, negative addresses index memory from the end like list indices
+    def invalidate(self, addr):
+        if addr < 0:
+            addr += self.mem_size
+        if 0 <= addr < len(self.decoded):
+            self.decoded[addr] = None
+            self.masks[addr] = None
 
     def load_program(self, program):
-        self.mem[0:len(program)] = program
-        n = self.mem_size
-        self.mem[900] = n-1
-        self.mem[901] = n
-        self.pc = 0
-
-    def fetch(self):
-        instr = self.mem[self.pc]
-        self.pc += 1
-        return instr
-
-    def decode(self, instr):
-        op = instr[0]
-        if op == 'NOP':
-            return self.nop,
-        if op == 'LOAD':
-            return self.load, instr[1], instr[2]
-        elif op == 'VLOAD':
-            return self.load_value, instr[1], instr[2]
-        elif op == 'STORE':
-            return self.store, instr[1], instr[2]
-        elif op == 'VSTORE':
-            return self.store_value, instr[1], instr[2]
-        elif op == 'ADD':
-            return self.add, instr[1], instr[2], instr[3]
-        elif op == 'SUB':
-            return self.sub, instr[1], instr[2], instr[3]
-        elif op == 'MUL':
-            return self.mul, instr[1], instr[2], instr[3]
-        elif op == 'AND':
-            return self._and, instr[1], instr[2], instr[3]
-        elif op == 'OR':
-            return self._or, instr[1], instr[2], instr[3]
-        elif op == 'JUMP':
-            return self.jump, instr[1]
-        elif op == 'BRANCH_LT':
-            return self.branch_lt, instr[1], instr[2], instr[3]
-        elif op == 'BRANCH_ZERO':
-            return self.branch_zero, instr[1], instr[2]
-        elif op == 'STOP':
-            return self.stop,
-        elif op == 'MOV':
-            return self.mov, instr[1], instr[2]
-        elif op == 'CMP_LT':
-            return self.cmp_lt, instr[1], instr[2], instr[3]
-        elif op == 'CMP_EQ':
-            return self.cmp_eq, instr[1], instr[2], instr[3]
-
-    def execute(self, *operation):
-        function = operation[0]
-        if len(operation) > 1:
-            args = operation[1:]
-            function(*args)
-        else:
-            function()
-        self.instr_cntr += 1 
+        super().load_program(program)
+        self.hazard_bits = {}
+        self.masks = [self.hazard_masks(instr) for instr in program]
 
 # ------------------------------------------------------------------------------------
 # ----DEPENDENCY HELPER FUNCTIONS----
 
-# Get the all registers/memory locations used in one instruction (read and write)
-
-    def get_used_registers(self, instruction):
-        op, *operands = instruction
-        used_registers = []
-
-        if (op == 'LOAD' or op == 'STORE' or op == 'VLOAD' or op == 'VSTORE') and isinstance(operands[-2], int):
-            used_registers.append(operands[-1])
-        else:
-            for operand in operands: 
-                if isinstance(operand, int):
-                    used_registers.append(operand)
-        return used_registers
-
-    def get_used_memories(self, instruction):
-        op, *operands = instruction
-        used_mem = []
-        if (op == 'LOAD' or op == 'STORE') and isinstance(operands[-2], int):
-            used_mem.append(operands[-2])
-        return used_mem
-    
-    def get_used_value_memories(self, instruction):
-        op, *operands = instruction
-        used_vmem = []
-        if (op == 'VLOAD' or op == 'VSTORE') and isinstance(operands[-2], int):
-            used_vmem.append(operands[-2])
-        return used_vmem
-
-# Get all the registers/memory locations modified in the instructions in the pipeline (fetch stage) before the instruction of interest (write only)
-
-    def get_modified_registers(self, j):
-        modified_registers = set()
-        modified_memory = set()
-        modified_value_memory = set()
-
-        # j here is provided by the caller and it's meant to be the index in the pipeline of the instruction of interest
-        for i in range(0, j):
-            prev_instruction = self.pipeline_registers[i]
-            if prev_instruction is not None:
-                op, *operands = prev_instruction 
-                if op != 'STORE' and op != 'VSTORE' and op!= 'NOP' and op != 'STOP' and op != 'JUMP' and op != 'BRANCH_LT' and op != 'BRANCH_ZERO':
-                    modified_registers.add(operands[-1])
-                if op == 'STORE':
-                    modified_memory.add(operands[-2])
-                if op == 'VSTORE':
-                    modified_value_memory.add(operands[-2])
-        return modified_registers, modified_memory, modified_value_memory
-
-# Check if any of the used registers/memory locations have been modified by the previus instructions in the pipeline 
-
-    def has_dependencies(self, i, k, used_reg, used_mem, used_vmem):
-        used_registers = used_reg[i]
-        used_memories = used_mem[i]
-        used_value_memories = used_vmem[i]
-        modified_registers = self.get_modified_registers(k)[0]
-        modified_memories = self.get_modified_registers(k)[1]
-        modified_value_memories = self.get_modified_registers(k)[2]
-        return any(reg in modified_registers for reg in used_registers) or any(mem in modified_memories for mem in used_memories) or any(vmem in modified_value_memories for vmem in used_value_memories)  
+# Read and write sets of an instruction as two integer bitmasks. Every distinct register, memory or
+# value memory location gets its own bit the first time it is seen, so an instruction depends on
+# earlier ones exactly when its read mask shares a bit with their write masks.
+# The read set is conservative: every operand that isn't a memory address counts as a register read,
+# the destination and jump targets included. Address operands stand for the memory they point to,
+# keyed by the address register (mem) or the immediate address (vmem).
+
+    def hazard_bit(self, kind, location):
+        bit = self.hazard_bits.get((kind, location))
+        if bit is None:
+            bit = self.hazard_bits[(kind, location)] = 1 << len(self.hazard_bits)
+        return bit
+
+    def hazard_masks(self, instruction):
+        opcode = OPCODES.get(instruction[0])
+        if opcode is None:
+            return 0, 0
+        reads = 0
+        writes = 0
+        for i, kind in enumerate(opcode.operands, 1):
+            if kind == 'a':
+                reads |= self.hazard_bit('mem', instruction[i])
+            elif kind == 'm':
+                reads |= self.hazard_bit('vmem', instruction[i])
+            else:
+                reads |= self.hazard_bit('reg', instruction[i])
+        if opcode.memory in ('write', 'atomic'):
+            kind = 'mem' if opcode.operands[opcode.address - 1] == 'a' else 'vmem'
+            writes |= self.hazard_bit(kind, instruction[opcode.address])
+        if opcode.write is not None:
+            writes |= self.hazard_bit('reg', instruction[opcode.write])
+        return reads, writes
+
+# masks of the instruction in fetch slot j, precomputed per pc at load time (NOPs read and write nothing)
+
+    def slot_masks(self, j):
+        pc = self.slot_pcs[j]
+        if pc is None:
+            return 0, 0
+        if pc >= len(self.masks):
+            return self.hazard_masks(self.pipeline_registers[j])
+        masks = self.masks[pc]
+        if masks is None:
+            masks = self.masks[pc] = self.hazard_masks(self.pipeline_registers[j])
+        return masks
 
 # -----------------------------------------------------------------------------------
 # ----PIPELINE STAGES----
@@ -212,11 +149,15 @@ class CPUSuperscalar:
     def fetch_stage(self):
         for j in range(0,3):
 
+            if self.branch_unit is not None:
+                self.speculative_fetch()
+                break
             if self.pipeline_registers[j] == ('NOP',) and self.nop_counter > 0:
                 self.nop_counter -= 1 
             elif not self.pushed_op.empty():
-                self.pipeline_registers[j] = self.pushed_op.get()
+                self.pipeline_registers[j], self.slot_pcs[j], self.slot_predictions[j] = self.pushed_op.get()
             else:
+                self.slot_pcs[j] = self.pc
                 self.pipeline_registers[j] = self.fetch()
 
             instr = self.pipeline_registers[j]
@@ -232,38 +173,31 @@ class CPUSuperscalar:
                 self.addr_index = instr[-1]
                 self.diff = abs(self.control_dependency_index - self.addr_index)
                 self.triplet_index = j
+                self.control_pc = self.slot_pcs[j]
             elif instr[0] == 'BRANCH_LT' and self.rf[instr[1]] < self.rf[instr[2]]:
                 self.control_dependency = True
                 self.control_dependency_index = self.pc
                 self.addr_index = instr[-1]
                 self.diff = abs(self.control_dependency_index - self.addr_index)
                 self.triplet_index = j
+                self.control_pc = self.slot_pcs[j]
             elif instr[0] == 'BRANCH_ZERO' and self.rf[instr[1]] == 0:
                 self.control_dependency = True
                 self.control_dependency_index = self.pc
                 self.addr_index = instr[-1]
                 self.diff = abs(self.control_dependency_index - self.addr_index)
                 self.triplet_index = j
+                self.control_pc = self.slot_pcs[j]
 
 
         # ---- DATA DEPENDENCIES----
-        self.used_reg = []
-        self.used_mem = []
-        self.used_vmem = []
-        self.has_dep = []
-        i = 0
-        # for each of the fetched instructions I get a bool: has dependency or doesn't 
-        for instr in self.pipeline_registers[0:3]:
-            
-            temp_reg = self.get_used_registers(instr)
-            temp_mem = self.get_used_memories(instr)
-            temp_vmem = self.get_used_value_memories(instr)
-            self.used_reg.append(temp_reg)
-            self.used_mem.append(temp_mem)
-            self.used_vmem.append(temp_vmem)
-            self.has_dep.append(self.has_dependencies(i, i, self.used_reg, self.used_mem, self.used_vmem))                               
-            
-            i += 1
+        # scoreboard of the writes still pending from the earlier slots of this fetch group,
+        # for each of the fetched instructions I get a bool: has dependency or doesn't
+        pending = 0
+        for j in range(0,3):
+            reads, writes = self.slot_masks(j)
+            self.has_dep[j] = (reads & pending) != 0
+            pending |= writes
 
 
 # pipeline registers 3, 4, 5 are holding decoded instructions
@@ -272,7 +206,7 @@ class CPUSuperscalar:
         # a flag indicating whether there was a stall at the previous loop iteration (is the last decoded instruction in the pipeline a NOP)
         nop = False
 
-        self.pushed_op = queue.Queue()
+        self.pushed_op.clear()
         j = 0
         for i in range(0,3):
 
@@ -290,28 +224,36 @@ class CPUSuperscalar:
                 dependency_detected = True
 
             # if there's a dependency in instruction j and flag indicating stall is false
-            # insert a NOP at the curr slot in the pipeline (i+3)
+            # put a NOP into the curr slot in the pipeline (i+3)
             # set the stalling flag to true
             if dependency_detected and not nop:
-                operation = self.decode(('NOP',))
-                self.pipeline_registers.insert(i+3, operation)
-                self.instr_cntr -= 1 
+                self.pipeline_registers[i+3] = self.nop_operation
+                self.exec_slots[i] = (None, None, None)
+                # speculative_execute skips NOPs instead of running and uncounting them
+                if self.branch_unit is None:
+                    self.instr_cntr -= 1 
                 nop = True      
+                if self.profiler is not None:
+                    self.profiler.stall(self.slot_pcs[j])
             # if there is no dependency set stalling flag to false, insert decoded instruction into the pipeline
             # indicate instruction decoding progress
             else:
                 nop = False
-                operation = self.decode(instruction)
+                operation = self.decode(instruction, self.slot_pcs[j])
                 self.pipeline_registers[i+3] = operation
+                self.exec_slots[i] = (self.slot_pcs[j], instruction, self.slot_predictions[j])
                 j += 1
         i+=1 
 
         for x in range(0,i-j):
-            self.pushed_op.put(self.pipeline_registers[2-x])
+            self.pushed_op.put((self.pipeline_registers[2-x], self.slot_pcs[2-x], self.slot_predictions[2-x]))
 
         
 #exectue executed the decoded instructions at registers 6, 7, 8
     def execute_stage(self):
+        if self.branch_unit is not None:
+            self.speculative_execute()
+            return
         j = 0
         for j in range(3):
             operation = self.pipeline_registers[j+3]
@@ -325,16 +267,17 @@ class CPUSuperscalar:
                 # for all already fetched and/or decoded instructions that are before it in the pipeline (ahead in the code) 
                 # decode the instructions as nop, when the loop is finished decode the jump into pipeline at i+3
                 diff_count = 0
-                for n, prev_instr in enumerate(self.pipeline_registers[:j+6]):
+                for n in range(j+6):
 
                     if diff_count < self.diff: 
                         if self.pipeline_registers[n] == ("NOP",):
                             self.instr_cntr += 1 
                             #diff_count -= 1
                         if n > 2:
-                            self.pipeline_registers[n] = self.decode(('NOP',))
+                            self.pipeline_registers[n] = self.nop_operation
                         else:
                             self.pipeline_registers[n] = ('NOP',)
+                            self.slot_pcs[n] = None
                         self.instr_cntr -= 1 
                         diff_count += 1
                         self.nop_counter += 1
@@ -343,6 +286,8 @@ class CPUSuperscalar:
 
 
                 self.control_dependency = False
+                if self.profiler is not None:
+                    self.profiler.flush(self.control_pc, diff_count)
                 break
 
 
@@ -356,20 +301,89 @@ class CPUSuperscalar:
                 self.pipeline_registers[j+7] = None
 
 
-    def run(self):
-        while not self.finished:
-            self.fetch_stage()
-            self.decode_stage()
-            self.execute_stage()
-            self.cycle_cntr += 1
-
-        print('instructions: ' + str(self.instr_cntr))   
-        print('cycles: ' + str(self.cycle_cntr))   
-        print('instructions per cycle: ' + str(self.instr_cntr/self.cycle_cntr)) 
-        instr =  float(self.instr_cntr)
-        cycl = float(self.cycle_cntr)
-        ipc = float(self.instr_cntr/self.cycle_cntr)
-        return  instr, cycl, ipc
+# -----------------------------------------------------------------------------------
+# ----SPECULATIVE EXECUTION----
+# With a branch unit the fetch stage follows the predicted path: a fetch group ends at a control
+# instruction predicted taken and fetching goes on at the predicted target in the next cycle, the
+# slots behind it hold NOPs. The branch is resolved when it executes; if the prediction was wrong the
+# younger slots of its group and the pushed instruction are squashed, fetching restarts at the right
+# pc and the misprediction penalty is added to the cycle count. Only real instructions are counted.
+
+    def speculative_fetch(self):
+        ended = False
+        for j in range(0,3):
+            if not self.pushed_op.empty():
+                self.pipeline_registers[j], self.slot_pcs[j], self.slot_predictions[j] = self.pushed_op.get()
+                continue
+            self.slot_predictions[j] = None
+            if ended or self.fetch_ended:
+                self.pipeline_registers[j] = ('NOP',)
+                self.slot_pcs[j] = None
+                continue
+            pc = self.pc
+            instr = self.fetch()
+            if not isinstance(instr, tuple):
+                # ran off the end of the program or into data, nothing more to fetch on this path
+                self.fetch_ended = True
+                self.pc = pc
+                self.pipeline_registers[j] = ('NOP',)
+                self.slot_pcs[j] = None
+                continue
+            self.pipeline_registers[j] = instr
+            self.slot_pcs[j] = pc
+            if is_control(instr):
+                predicted = self.slot_predictions[j] = self.branch_unit.predict(pc, instr)
+                if predicted != pc + 1:
+                    self.pc = predicted
+                    ended = True
+
+    def speculative_execute(self):
+        executed = False
+        for j in range(3):
+            pc, instr, predicted = self.exec_slots[j]
+            if pc is None:
+                continue
+            executed = True
+            operation = self.pipeline_registers[j+3]
+            if predicted is None:
+                self.execute(*operation)
+            else:
+                fetch_pc = self.pc
+                self.pc = pc + 1
+                self.execute(*operation)
+                actual = self.pc
+                penalty = self.branch_unit.resolve(pc, instr, predicted, actual)
+                if penalty:
+                    self.squash(j, actual)
+                    self.cycle_cntr += penalty
+                    return
+                self.pc = fetch_pc
+            if self.finished:
+                return
+        if not executed and self.fetch_ended and self.pushed_op.empty():
+            # the path really ends here; that is an error unless it ran off the end of the program
+            instr = self.imem[self.pc]
+            if instr is not None and instr != 0:
+                raise TypeError('no valid instruction at address ' + str(self.pc) + ': ' + repr(instr))
+            self.finished = True
+
+# drops everything younger than the mispredicted branch in execute slot j and refetches from pc
+    def squash(self, j, pc):
+        squashed = sum(1 for slot in self.exec_slots[j+1:] if slot[0] is not None)
+        while not self.pushed_op.empty():
+            if self.pushed_op.get()[1] is not None:
+                squashed += 1
+        self.branch_unit.squashed += squashed
+        self.pc = pc
+        self.fetch_ended = False
+        if self.profiler is not None:
+            self.profiler.flush(self.exec_slots[j][0], squashed)
+
+    def advance(self):
+        self.fetch_stage()
+        self.decode_stage()
+        self.execute_stage()
+        self.cycle_cntr += 1
   #-----------------------------------------------------------------------------------          
             
 
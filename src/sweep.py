@@ -0,0 +1,187 @@
+# Runs a grid of program x mode x input jobs on all cores and streams the results into one CSV file.
+# Jobs that are already in the output file are skipped, so an interrupted sweep can simply be
+# started again with the same arguments.
+#
+# usage: python3 sweep.py results.csv --programs bubblesort.txt fibonacci.txt --modes simple pipelined
+#                         --sizes 5 10 20 --seeds 0 1 2 [--workers 8] [--chunksize 4] [--cache DIR]
+
+import argparse
+import csv
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from simple import CPUSimple
+from pipelined import CPUPipelined
+from superscalar import CPUSuperscalar
+from fast import CPUFast
+from tomasulo import CPUTomasulo
+from loader import read_program
+from meminit import apply
+from result_cache import ResultCache, cached_run
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+
+MODES = {
+    'simple': CPUSimple,
+    'pipelined': CPUPipelined,
+    'superscalar': CPUSuperscalar,
+    'fast': CPUFast,
+    'tomasulo': CPUTomasulo,
+}
+
+FIELDS = ['program', 'mode', 'size', 'seed', 'instr', 'cycles', 'ipc', 'seconds']
+
+# -----------------------------------------------------------------------------------
+# ----INPUT GENERATORS----
+# each generator writes the input of size "size" for one program into the memory of a loaded cpu, as
+# a memory spec (see meminit.py) built by the program's *_spec function.
+# The programs read their input size from the fixed addresses 1023 and 1022 and keep their data at the
+# end of memory, so inputs that don't fit into 1024 words need the bigger memory given by memory_size.
+
+def bubblesort_spec(size, seed):
+    return {
+        'mem_size': memory_size('bubblesort.txt', size),
+        'memory': [
+            {'address': 1023, 'value': size},
+            {'address': 1022, 'value': size - 1},
+            {'address': -3, 'random': [0, 1000], 'count': size, 'seed': seed, 'step': -1},
+        ],
+    }
+
+def fibonacci_spec(size, seed):
+    return {'mem_size': memory_size('fibonacci.txt', size), 'memory': [{'address': 1023, 'value': size}]}
+
+def ones_spec(size, seed):
+    return {'memory': [{'address': -10, 'fill': 1, 'count': 10}]}
+
+def bubblesort_input(cpu, size, seed):
+    # the array grows down from mem_size-3 and must stay above the constants at 900 and 901, and above
+    # the size at 1023 and 1022 in a memory bigger than 1024 words
+    bottom = cpu.mem_size - 3 - size
+    if bottom < 902 or (cpu.mem_size > 1024 and bottom < 1024):
+        raise ValueError('bubblesort input of ' + str(size) + ' elements does not fit into memory, use mem_size '
+                         + str(memory_size('bubblesort.txt', size)))
+    apply(cpu, bubblesort_spec(size, seed))
+
+def fibonacci_input(cpu, size, seed):
+    # the sequence is written down from mem_size-1 and must stay above the program
+    if cpu.mem_size - 1 - size <= len(cpu.decoded):
+        raise ValueError('fibonacci of ' + str(size) + ' does not fit into memory, use mem_size '
+                         + str(memory_size('fibonacci.txt', size)))
+    apply(cpu, fibonacci_spec(size, seed))
+
+def ones_input(cpu, size, seed):
+    apply(cpu, ones_spec(size, seed))
+
+INPUTS = {
+    'bubblesort.txt': bubblesort_input,
+    'fibonacci.txt': fibonacci_input,
+    'raw.txt': ones_input,
+    'indepenent_arithmetic.txt': ones_input,
+}
+
+# the smallest memory (at least the default 1024 words) the input of size "size" of a program fits into
+def memory_size(program, size):
+    name = os.path.basename(program)
+    if name == 'bubblesort.txt' and size > 119:
+        return size + 1027
+    if name == 'fibonacci.txt':
+        return max(1024, size + 64)
+    return 1024
+
+# -----------------------------------------------------------------------------------
+# ----JOBS----
+
+def job_key(job):
+    return (job['program'], job['mode'], str(job['size']), str(job['seed']))
+
+def make_jobs(programs, modes, sizes, seeds):
+    jobs = []
+    for program in programs:
+        for mode in modes:
+            for size in sizes:
+                for seed in seeds:
+                    jobs.append({'program': program, 'mode': mode, 'size': size, 'seed': seed})
+    return jobs
+
+@functools.lru_cache(maxsize=None)
+def cached_program(program):
+    path = program if os.path.exists(program) else os.path.join(BENCHMARKS, program)
+    return read_program(path)
+
+def run_job(job, cache_dir=None):
+    name = os.path.basename(job['program'])
+    program = cached_program(job['program'])
+    cpu = MODES[job['mode']](memory_size(name, job['size']))
+    cpu.load_program(program)
+    INPUTS[name](cpu, job['size'], job['seed'])
+    start_time = time.time()
+    if cache_dir is None:
+        instr, cycles, ipc = cpu.run(verbose=False)
+    else:
+        instr, cycles, ipc = cached_run(cpu, program, ResultCache(cache_dir), verbose=False)
+    end_time = time.time()
+    return dict(job, instr=int(instr), cycles=int(cycles), ipc=ipc, seconds=end_time - start_time)
+
+def run_chunk(jobs, cache_dir=None):
+    return [run_job(job, cache_dir) for job in jobs]
+
+# -----------------------------------------------------------------------------------
+# ----SWEEP----
+
+def completed_jobs(output):
+    done = set()
+    if os.path.exists(output):
+        with open(output, newline='') as f:
+            for row in csv.DictReader(f):
+                done.add(job_key(row))
+    return done
+
+# runs all jobs that aren't in output yet and appends a row per job as soon as its chunk finishes
+def sweep(jobs, output, workers=None, chunksize=None, cache_dir=None):
+    for job in jobs:
+        if job['mode'] not in MODES:
+            raise ValueError('mode must be one of: ' + ', '.join(MODES))
+        if os.path.basename(job['program']) not in INPUTS:
+            raise ValueError('no input generator for program ' + job['program'])
+
+    done = completed_jobs(output)
+    todo = [job for job in jobs if job_key(job) not in done]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize is None:
+        # a few chunks per worker keeps every core busy without paying the pickling cost per job
+        chunksize = max(1, len(todo) // (workers * 4))
+    chunks = [todo[i:i + chunksize] for i in range(0, len(todo), chunksize)]
+
+    write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if write_header:
+            writer.writeheader()
+            f.flush()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_chunk, chunk, cache_dir) for chunk in chunks]
+            for future in as_completed(futures):
+                writer.writerows(future.result())
+                f.flush()
+    return len(todo), len(jobs) - len(todo)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a program x mode x input grid on all cores.')
+    parser.add_argument('output', help='CSV file the results are appended to')
+    parser.add_argument('--programs', nargs='+', default=list(INPUTS))
+    parser.add_argument('--modes', nargs='+', default=['simple', 'pipelined', 'superscalar'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[5])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=None)
+    parser.add_argument('--cache', default=None, help='directory of a result cache shared between sweeps')
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.programs, args.modes, args.sizes, args.seeds)
+    ran, skipped = sweep(jobs, args.output, args.workers, args.chunksize, args.cache)
+    print('ran ' + str(ran) + ' jobs, skipped ' + str(skipped) + ' already in ' + args.output)
@@ -0,0 +1,396 @@
+from collections import deque
+
+from isa import OPCODES
+from simple import CPUSimple
+
+# Out-of-order superscalar model with Tomasulo-style scheduling.
+# Every cycle up to "width" instructions are fetched, dispatched into the reorder buffer and the
+# reservation stations, issued to the execution units, written back on the common data bus and
+# committed in program order. Registers are renamed through the register alias table (rat), which
+# maps a register to the in-flight ROB entry that will produce it, so only true dependencies wait.
+# Conditional branches are predicted not taken and JUMPs are followed at fetch. A branch that turns
+# out to be taken squashes everything younger than itself when it writes back and fetch restarts at
+# its target. Stores write memory when they commit; a load waits until the addresses of all older
+# stores are known and takes its value from the youngest older store to the same address, if any.
+# AMOADD/AMOSWAP wait in a reservation station for their operands and do their read-modify-write when
+# they reach the head of the ROB, only then is their result broadcast. FENCE needs no unit and also
+# takes its effect at commit. Both sit in the store queue, and a load behind one of them waits.
+# Architectural state (rf, mem, pc) is only ever changed at commit, so the final state is the same as
+# CPUSimple's for every program.
+
+# cycles from issue to writeback per instruction kind, the units are pipelined
+LATENCIES = {
+    'alu': 1,
+    'mul': 3,
+    'load': 2,
+    'store': 1,
+    'branch': 1,
+}
+
+ALU = {
+    'ADD': lambda a, b: a + b,
+    'SUB': lambda a, b: a - b,
+    'MUL': lambda a, b: a * b,
+    'AND': lambda a, b: a and b,
+    'OR': lambda a, b: a or b,
+    'CMP_LT': lambda a, b: True if a < b else False,
+    'CMP_EQ': lambda a, b: True if a == b else False,
+}
+
+
+def move(a):
+    return a
+
+def less(a, b):
+    return a < b
+
+def zero(a):
+    return a == 0
+
+# the atomics: the new memory word from the old one and the register operand
+ATOMIC = {
+    'AMOADD': lambda old, value: old + value,
+    'AMOSWAP': lambda old, value: value,
+}
+
+FUNCTIONS = dict(ALU, MOV=move, BRANCH_LT=less, BRANCH_ZERO=zero, **ATOMIC)
+
+
+class Entry:
+    __slots__ = ('seq', 'pc', 'op', 'kind', 'dest', 'func', 'imm', 'vals', 'waiting', 'consumers',
+                 'issued', 'done', 'value', 'addr', 'next_pc', 'fault', 'delay')
+
+    def __init__(self, seq, pc, uop):
+        self.seq = seq
+        self.pc = pc
+        self.op, self.kind, _, self.dest, self.imm, self.func = uop
+        self.vals = []
+        self.waiting = 0
+        self.consumers = []
+        self.issued = False
+        self.done = False
+        self.value = None
+        self.addr = None
+        self.next_pc = pc + 1
+        self.fault = None
+        # cache stall cycles on top of the load latency
+        self.delay = 0
+
+
+class CPUTomasulo(CPUSimple):
+    def __init__(self, mem_size=1024, reg_size=32, state=None, width=4, rob_size=32, rs_size=16,
+                 units=None, latencies=None, hierarchy=None):
+        super().__init__(mem_size, reg_size, state, hierarchy)
+        self.width = width
+        self.rob_size = rob_size
+        self.rs_size = rs_size
+        # execution units per instruction kind, "width" for kinds that aren't listed
+        self.units = dict(units or {})
+        self.latencies = dict(LATENCIES, **(latencies or {}))
+        self.reset_pipeline()
+# ----METRICS----
+        self.mispredictions = 0
+        self.squashed = 0
+        self.rob_full_stalls = 0
+        self.rs_full_stalls = 0
+
+    def config(self):
+        config = super().config()
+        config.update(width=self.width, rob_size=self.rob_size, rs_size=self.rs_size,
+                      units=sorted(self.units.items()), latencies=sorted(self.latencies.items()))
+        return config
+
+    def reset_pipeline(self):
+        self.fetch_pc = self.pc
+        self.fetch_stopped = False
+        self.fetch_queue = deque()
+        self.rob = deque()
+        self.rs = []
+        self.executing = []
+        self.stores = deque()
+        self.rat = [None] * self.reg_size
+        self.seq = 0
+
+    def load_program(self, program):
+        super().load_program(program)
+        self.reset_pipeline()
+
+# -----------------------------------------------------------------------------------
+# ----PREDECODE----
+# (op, kind, source registers, destination register, immediate, function)
+
+    def predecode(self, instr):
+        if not isinstance(instr, tuple):
+            return None, 'invalid', (), None, None, None
+        op = instr[0]
+        opcode = OPCODES.get(op)
+        if opcode is None:
+            return op, 'invalid', (), None, None, None
+        srcs = tuple(instr[i] for i in opcode.reads)
+        dest = instr[opcode.write] if opcode.write is not None else None
+        # the immediate address of VLOAD/VSTORE or the jump target
+        imm = None
+        if opcode.target is not None:
+            imm = instr[opcode.target]
+        elif opcode.address is not None and opcode.operands[opcode.address - 1] == 'm':
+            imm = instr[opcode.address]
+        return op, opcode.unit, srcs, dest, imm, FUNCTIONS.get(op)
+
+    def uop(self, pc, instr):
+        if pc >= len(self.decoded):
+            return self.predecode(instr)
+        uop = self.decoded[pc]
+        if uop is None:
+            uop = self.decoded[pc] = self.predecode(instr)
+        return uop
+
+    def normalize(self, addr):
+        if addr < 0:
+            return addr + self.mem_size
+        return addr
+
+# -----------------------------------------------------------------------------------
+# ----STAGES----
+
+    def fetch_stage(self):
+        queue = self.fetch_queue
+        for _ in range(self.width):
+            if self.fetch_stopped or len(queue) >= 2 * self.width:
+                return
+            pc = self.fetch_pc
+            instr = self.imem[pc] if 0 <= pc < len(self.imem) else None
+            uop = self.uop(pc, instr) if instr is not None else None
+            queue.append((pc, uop))
+            if uop is None or uop[1] == 'stop' or uop[1] == 'invalid':
+                # nothing valid to fetch past the end of the program
+                self.fetch_stopped = True
+                return
+            if uop[1] == 'jump':
+                self.fetch_pc = uop[4]
+                return
+            self.fetch_pc = pc + 1
+
+    def dispatch_stage(self):
+        queue = self.fetch_queue
+        rat = self.rat
+        rf = self.rf
+        for _ in range(self.width):
+            if not queue:
+                return
+            if len(self.rob) >= self.rob_size:
+                self.rob_full_stalls += 1
+                return
+            pc, uop = queue[0]
+            if uop is None:
+                uop = (None, 'end', (), None, None, None)
+            needs_station = uop[1] not in ('jump', 'stop', 'nop', 'fence', 'end', 'invalid')
+            if needs_station and len(self.rs) >= self.rs_size:
+                self.rs_full_stalls += 1
+                return
+            queue.popleft()
+            entry = Entry(self.seq, pc, uop)
+            self.seq += 1
+            for i, r in enumerate(uop[2]):
+                producer = rat[r]
+                if producer is None:
+                    entry.vals.append(rf[r])
+                elif producer.done:
+                    entry.vals.append(producer.value)
+                else:
+                    entry.vals.append(None)
+                    entry.waiting += 1
+                    producer.consumers.append((entry, i))
+            if uop[3] is not None:
+                rat[uop[3]] = entry
+            if uop[1] == 'jump':
+                entry.next_pc = uop[4]
+            if needs_station:
+                self.rs.append(entry)
+                if uop[1] == 'store' or uop[1] == 'atomic':
+                    self.stores.append(entry)
+            else:
+                entry.done = True
+                if uop[1] == 'fence':
+                    self.stores.append(entry)
+            self.rob.append(entry)
+
+    def issue_stage(self):
+        issued = 0
+        used = {}
+        remaining = []
+        for entry in self.rs:
+            kind = entry.kind
+            if (issued >= self.width or entry.waiting or used.get(kind, 0) >= self.units.get(kind, self.width)
+                    or (kind == 'load' and not self.execute_load(entry))):
+                remaining.append(entry)
+                continue
+            if kind != 'load' and kind != 'atomic':
+                self.execute_entry(entry)
+            used[kind] = used.get(kind, 0) + 1
+            issued += 1
+            entry.issued = True
+            if kind == 'atomic':
+                # has its operands now, the rest happens at commit
+                continue
+            self.executing.append((self.cycle_cntr + self.latencies[kind] + entry.delay, entry))
+        self.rs = remaining
+
+    def execute_entry(self, entry):
+        kind = entry.kind
+        vals = entry.vals
+        # a squashed path can compute on anything, faults are only raised if the instruction commits
+        try:
+            if kind == 'alu' or kind == 'mul':
+                entry.value = entry.func(*vals)
+            elif kind == 'store':
+                if entry.imm is None:
+                    entry.addr, entry.value = vals
+                else:
+                    entry.addr, entry.value = entry.imm, vals[0]
+            elif kind == 'branch':
+                if entry.func(*vals):
+                    entry.next_pc = entry.imm
+        except Exception as e:
+            entry.fault = e
+
+# loads go only once every older store has its address, returns False if the load has to wait
+    def execute_load(self, entry):
+        addr = entry.vals[0] if entry.imm is None else entry.imm
+        try:
+            target = self.normalize(addr)
+            forwarded = None
+            for store in self.stores:
+                if store.seq > entry.seq:
+                    break
+                if store.kind != 'store' or not store.issued:
+                    return False
+                if store.fault is None and self.normalize(store.addr) == target:
+                    forwarded = store
+            entry.addr = addr
+            if forwarded is not None:
+                entry.value = forwarded.value
+            else:
+                entry.value = self.mem[addr]
+                if self.hierarchy is not None:
+                    entry.delay = self.hierarchy.access(target, False)
+        except Exception as e:
+            entry.fault = e
+        return True
+
+    def writeback_stage(self):
+        if not self.executing:
+            return
+        self.executing.sort(key=lambda item: item[1].seq)
+        broadcast = 0
+        remaining = []
+        for ready_at, entry in self.executing:
+            if ready_at > self.cycle_cntr or broadcast >= self.width:
+                remaining.append((ready_at, entry))
+                continue
+            broadcast += 1
+            entry.done = True
+            for consumer, i in entry.consumers:
+                consumer.vals[i] = entry.value
+                consumer.waiting -= 1
+            entry.consumers = []
+            if entry.kind == 'branch' and entry.fault is None and entry.next_pc != entry.pc + 1:
+                self.mispredictions += 1
+                self.squash(entry, entry.next_pc)
+                # everything after it in the sorted list is younger and gone
+                break
+        self.executing = remaining
+
+    def commit_stage(self):
+        rob = self.rob
+        for _ in range(self.width):
+            if not rob or not (rob[0].done or rob[0].kind == 'atomic' and rob[0].issued):
+                return
+            entry = rob.popleft()
+            kind = entry.kind
+            if entry.fault is not None:
+                raise entry.fault
+            if kind == 'end':
+                self.finished = True
+                return
+            if kind == 'invalid':
+                raise TypeError('no valid instruction at address ' + str(entry.pc) + ': ' + repr(self.imem[entry.pc]))
+            self.instr_cntr += 1
+            self.pc = entry.next_pc
+            if kind == 'atomic':
+                self.commit_atomic(entry)
+                if self.normalize(entry.addr) < len(self.decoded):
+                    # like a store, the program rewrote itself
+                    self.squash(entry, entry.pc + 1)
+                    self.executing = []
+                    return
+            elif kind == 'fence':
+                self.stores.popleft()
+                self.fence()
+            elif entry.dest is not None:
+                self.rf[entry.dest] = entry.value
+                if self.rat[entry.dest] is entry:
+                    self.rat[entry.dest] = None
+            elif kind == 'store':
+                self.stores.popleft()
+                self.mem[entry.addr] = entry.value
+                if self.hierarchy is not None:
+                    # stores retire into the cache from a store buffer without stalling
+                    self.hierarchy.access(self.normalize(entry.addr), True)
+                if self.normalize(entry.addr) < len(self.decoded):
+                    # the program rewrote itself, everything younger was fetched from stale code
+                    self.invalidate(entry.addr)
+                    self.squash(entry, entry.pc + 1)
+                    self.executing = []
+                    return
+            elif kind == 'stop':
+                self.finished = True
+                return
+
+# the read-modify-write of an atomic at the head of the ROB, its old value goes to the consumers
+    def commit_atomic(self, entry):
+        self.stores.popleft()
+        entry.addr, value = entry.vals
+        func = entry.func
+        entry.value = self.atomic(entry.addr, lambda old: func(old, value))
+        entry.done = True
+        for consumer, i in entry.consumers:
+            consumer.vals[i] = entry.value
+            consumer.waiting -= 1
+        entry.consumers = []
+        self.rf[entry.dest] = entry.value
+        if self.rat[entry.dest] is entry:
+            self.rat[entry.dest] = None
+
+# drops every instruction younger than entry and restarts fetch at pc
+    def squash(self, entry, pc):
+        rob = self.rob
+        while rob and rob[-1].seq > entry.seq:
+            rob.pop()
+            self.squashed += 1
+        self.squashed += len(self.fetch_queue)
+        self.fetch_queue.clear()
+        self.rs = [e for e in self.rs if e.seq <= entry.seq]
+        while self.stores and self.stores[-1].seq > entry.seq:
+            self.stores.pop()
+        self.rat = [None] * self.reg_size
+        for e in rob:
+            if e.dest is not None:
+                self.rat[e.dest] = e
+            # consumers younger than the squash point are gone
+            e.consumers = [c for c in e.consumers if c[0].seq <= entry.seq]
+        self.fetch_pc = pc
+        self.fetch_stopped = False
+
+#-----------------------------------------------------------------------------------
+
+    def advance(self):
+        self.cycle_cntr += 1
+        self.commit_stage()
+        if self.finished:
+            return
+        self.writeback_stage()
+        self.issue_stage()
+        self.dispatch_stage()
+        self.fetch_stage()
+
+#-----------------------------------------------------------------------------------
@@ -0,0 +1,282 @@
+# Streaming binary execution traces of CPUSimple, CPUPipelined and CPUSuperscalar.
+# Tracer.attach(cpu) hooks into the cpu object like Profiler.attach: fetch and decode are replaced on
+# that one cpu, and decode hands out operations whose handler records the execution and the register
+# or memory write it makes before and after running the real handler. Stalls and flushes arrive
+# through cpu.profiler, an attached Profiler still gets them passed on. Nothing changes for cpus that
+# aren't traced.
+#
+# Every event is one fixed 32 byte record (cycle, pc, event, slot, flags, a, b) packed into a
+# preallocated buffer that is written to the file whenever it fills up, so memory stays flat however
+# long the run is. pc is -1 for NOPs. "slot" is the position of the fetch, decode or execution within
+# its cycle. For writes a is the register or address and b the value; values that don't fit a 64 bit
+# word (the instruction tuples in mem) are recorded as 0 with flags set to NOT_A_WORD. For fetch,
+# decode and execute a is the opcode number from assembler.OPCODE_NUMBERS (-1 for anything else).
+#
+# usage:
+#     with Tracer('run.trace').attach(cpu):
+#         cpu.run()
+#     for event in TraceReader('run.trace').events(start_cycle=100, end_cycle=200, pc=17):
+#         print(event)
+
+import collections
+import mmap
+import os
+import struct
+
+from assembler import OPCODE_NUMBERS
+from isa import OPCODES
+
+MAGIC = b'CPUSIMT1'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<QiBBBxqq')
+VERSION = 1
+CHUNK_RECORDS = 32768
+
+FETCH = 0
+DECODE = 1
+EXECUTE = 2
+STALL = 3
+FLUSH = 4
+REG_WRITE = 5
+MEM_WRITE = 6
+EVENT_NAMES = ['fetch', 'decode', 'execute', 'stall', 'flush', 'reg_write', 'mem_write']
+
+NOT_A_WORD = 1
+
+WORD_MIN = -(1 << 63)
+WORD_MAX = (1 << 63) - 1
+
+# opcode name -> its writes, (kind of write, position of the register or address among the handler
+# arguments) each; an atomic writes the memory word and the register that gets the old value
+def write_kind(opcode):
+    writes = []
+    if opcode.memory in ('write', 'atomic'):
+        writes.append((('mem_reg' if opcode.operands[opcode.address - 1] == 'a' else 'mem'), opcode.address - 1))
+    if opcode.write is not None:
+        writes.append(('reg', opcode.write - 1))
+    return tuple(writes)
+
+WRITES = {name: write_kind(opcode) for name, opcode in OPCODES.items() if write_kind(opcode)}
+
+Event = collections.namedtuple('Event', ['cycle', 'pc', 'event', 'slot', 'flags', 'a', 'b'])
+
+
+def word(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return 0, NOT_A_WORD
+    if WORD_MIN <= value <= WORD_MAX:
+        return value, 0
+    return 0, NOT_A_WORD
+
+
+class Tracer:
+    def __init__(self, path, buffer_records=65536):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.buffer = bytearray(RECORD.size * buffer_records)
+        self.offset = 0
+        self.records = 0
+        self.cpu = None
+        self.previous_profiler = None
+        self.traced = {}
+        # slot numbers restart with every cycle
+        self.cycle = -1
+        self.slots = [0, 0, 0]
+
+# -----------------------------------------------------------------------------------
+# ----WRITER----
+
+    def emit(self, event, pc, slot, a=0, b=0, flags=0):
+        if self.offset == len(self.buffer):
+            self.flush_buffer()
+        RECORD.pack_into(self.buffer, self.offset, self.cpu.cycle_cntr, -1 if pc is None else pc,
+                         event, slot, flags, a, b)
+        self.offset += RECORD.size
+        self.records += 1
+
+    def flush_buffer(self):
+        self.file.write(memoryview(self.buffer)[:self.offset])
+        self.offset = 0
+
+    def next_slot(self, stage):
+        cycle = self.cpu.cycle_cntr
+        if cycle != self.cycle:
+            self.cycle = cycle
+            self.slots = [0, 0, 0]
+        slot = self.slots[stage]
+        self.slots[stage] = slot + 1
+        return slot
+
+    def close(self):
+        if self.cpu is not None:
+            self.detach()
+        if not self.file.closed:
+            self.flush_buffer()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# -----------------------------------------------------------------------------------
+# ----HOOKS----
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        self.previous_profiler = cpu.profiler
+        # a Profiler attached before keeps its own wrappers underneath
+        self.previous_hooks = {name: cpu.__dict__[name] for name in ('fetch', 'decode') if name in cpu.__dict__}
+        cpu.profiler = self
+        fetch = cpu.fetch
+        decode = cpu.decode
+        traced = self.traced
+
+        def traced_fetch():
+            pc = cpu.pc
+            instr = fetch()
+            if isinstance(instr, tuple):
+                self.emit(FETCH, pc, self.next_slot(FETCH), OPCODE_NUMBERS.get(instr[0], -1))
+            return instr
+
+        def traced_decode(instr, pc=None):
+            operation = decode(instr, pc)
+            if operation is None:
+                return operation
+            self.emit(DECODE, pc, self.next_slot(DECODE), OPCODE_NUMBERS.get(instr[0], -1))
+            key = (pc, operation[0])
+            entry = traced.get(key)
+            if entry is None or entry[0] != operation:
+                entry = traced[key] = (operation, (self.tracing(operation[0], pc, instr[0]),) + tuple(operation[1:]))
+            return entry[1]
+
+        cpu.fetch = traced_fetch
+        cpu.decode = traced_decode
+        return self
+
+    def detach(self):
+        for name in ('fetch', 'decode'):
+            if name in self.previous_hooks:
+                setattr(self.cpu, name, self.previous_hooks[name])
+            else:
+                delattr(self.cpu, name)
+        self.cpu.profiler = self.previous_profiler
+        self.cpu = None
+
+    def tracing(self, handler, pc, opcode):
+        cpu = self.cpu
+        emit = self.emit
+        number = OPCODE_NUMBERS.get(opcode, -1)
+        # by opcode, the handler may be a Profiler's wrapper
+        writes = WRITES.get(opcode)
+
+        def traced(*args):
+            emit(EXECUTE, pc, self.next_slot(EXECUTE), number)
+            if writes is None:
+                return handler(*args)
+            # addresses held in registers are read before the handler can overwrite the register
+            targets = [(kind, cpu.rf[args[i]] if kind == 'mem_reg' else args[i]) for kind, i in writes]
+            result = handler(*args)
+            for kind, addr in targets:
+                if kind == 'reg':
+                    value, flags = word(cpu.rf[addr])
+                    emit(REG_WRITE, pc, 0, addr, value, flags)
+                else:
+                    value, flags = word(cpu.mem[addr])
+                    addr, _ = word(addr)
+                    emit(MEM_WRITE, pc, 0, addr, value, flags)
+            return result
+        return traced
+
+# -----------------------------------------------------------------------------------
+# ----EVENTS----
+# called by the cpu in place of the profiler, which still gets them
+
+    def stall(self, pc):
+        self.emit(STALL, pc, 0)
+        if self.previous_profiler is not None:
+            self.previous_profiler.stall(pc)
+
+    def flush(self, pc, nops):
+        self.emit(FLUSH, pc, 0, nops)
+        if self.previous_profiler is not None:
+            self.previous_profiler.flush(pc, nops)
+
+
+# -----------------------------------------------------------------------------------
+# ----READER----
+
+class TraceReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(path + ' is not a trace')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(path + ' is not a version ' + str(VERSION) + ' trace')
+        # a trace cut off while it was written ends with a partial record, which is ignored
+        self.count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        return Event._make(RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size))
+
+    def cycle(self, i):
+        return struct.unpack_from('<Q', self.map, HEADER.size + i * RECORD.size)[0]
+
+# index of the first record at or after cycle, records are written in cycle order
+    def find(self, cycle):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.cycle(mid) < cycle:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+# events with start_cycle <= cycle < end_cycle, optionally only those of one pc and of some event types
+    def events(self, start_cycle=None, end_cycle=None, pc=None, kinds=None):
+        first = 0 if start_cycle is None else self.find(start_cycle)
+        last = self.count if end_cycle is None else self.find(end_cycle)
+        end = HEADER.size + last * RECORD.size
+        # read in chunks of CHUNK_RECORDS, so only one chunk is ever copied out of the mapping
+        for start in range(HEADER.size + first * RECORD.size, end, CHUNK_RECORDS * RECORD.size):
+            chunk = self.map[start:min(end, start + CHUNK_RECORDS * RECORD.size)]
+            for fields in RECORD.iter_unpack(chunk):
+                if pc is not None and fields[1] != pc:
+                    continue
+                if kinds is not None and fields[2] not in kinds:
+                    continue
+                yield Event._make(fields)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) not in (2, 4, 5):
+        print('The correct command format is: python3 tracing.py run.trace [start_cycle end_cycle [pc]]')
+    else:
+        with TraceReader(sys.argv[1]) as reader:
+            start = int(sys.argv[2]) if len(sys.argv) > 2 else None
+            end = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            pc = int(sys.argv[4]) if len(sys.argv) > 4 else None
+            for event in reader.events(start, end, pc):
+                print(event.cycle, event.pc, EVENT_NAMES[event.event], event.slot, event.a, event.b)
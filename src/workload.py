@@ -0,0 +1,183 @@
+# Synthetic workloads for scaling studies.
+# generate() emits a program in the simulator's assembly language with controllable properties and the
+# memory spec (see meminit.py) of its input:
+#   length      instructions of the loop body, the static program length (up to millions)
+#   iterations  how often the body runs, the dynamic length is about length * iterations
+#   mix         relative weights of the instruction classes alu, mul, load and store
+#   chain       dependency-chain length: each instruction of a chain reads the result of the one before
+#               it like in raw.txt, with chain=1 every instruction is independent
+#   width       independent chains interleaved round robin, the ILP of indepenent_arithmetic.txt
+#   branches    fraction of the body that are forward conditional branches over 1 to 4 instructions,
+#               taken or not depending on the data
+#   footprint   distinct data words the loads and stores touch, uniformly at random
+#
+# Registers r0 to r(width-1) hold the chains, r22 to r29 the inputs (-1, 0 or 1, so MUL chains don't
+# grow), r30 the constant 1 and r31 the loop counter. Everything the program reads is at the end of
+# memory: the iteration count at mem_size-1, the 1 at mem_size-2, the inputs below them and the data
+# words below those. Addresses 900 and 901 hold the constants load_program writes, so a body longer
+# than that jumps over them. The superscalar model without a branch predictor fetches past that JUMP
+# and can only run programs of up to 899 instructions.
+#
+# usage:
+#     program, spec = generate(length=10000, iterations=100, chain=4, width=3, branches=0.05)
+#     cpu = CPUSuperscalar(mem_size(spec)); cpu.load_program(program); apply(cpu, spec)
+#
+# or: python3 workload.py synthetic.txt --length 10000 --iterations 100 --chain 4 --width 3
+#                         --branches 0.05 --footprint 256 --mix alu=6,mul=1,load=2,store=1 [--seed 0]
+#     python3 main.py synthetic.txt superscalar gshare      (finds synthetic.init.json next to it)
+
+import argparse
+import random
+
+from assembler import write_text
+from isa import OPCODES
+from meminit import spec_path, save_spec
+
+MIX = {'alu': 6, 'mul': 1, 'load': 2, 'store': 1}
+ALU_OPS = ['ADD', 'SUB', 'AND', 'OR', 'CMP_LT', 'CMP_EQ']
+
+MAX_WIDTH = 22
+INPUTS = list(range(22, 30))
+ONE = 30
+COUNTER = 31
+# the iteration count, the 1 and the inputs
+PARAMETERS = 2 + len(INPUTS)
+# the constants load_program writes
+RESERVED = (900, 901)
+
+# -----------------------------------------------------------------------------------
+# ----LAYOUT----
+
+# instructions in front of and behind the body
+PROLOGUE = PARAMETERS
+EPILOGUE = 4
+
+# address of the instruction at index i of a program of n instructions, past the gap at 899-901
+def address(i, n):
+    if n < RESERVED[0] or i < RESERVED[0] - 1:
+        return i
+    return i + 3
+
+# lays the program out in memory with a JUMP over the reserved addresses, control targets are indices
+def place(instructions):
+    n = len(instructions)
+    program = []
+    for i, instr in enumerate(instructions):
+        if len(program) == RESERVED[0] - 1 and n >= RESERVED[0]:
+            program += [('JUMP', RESERVED[1] + 1), ('NOP',), ('NOP',)]
+        target = OPCODES[instr[0]].target
+        if target is not None:
+            instr = instr[:target] + (address(instr[target], n),) + instr[target + 1:]
+        program.append(instr)
+    return program
+
+def memory_size(length, footprint):
+    n = PROLOGUE + length + EPILOGUE
+    end = address(n - 1, n) + 1
+    return max(1024, max(end, RESERVED[1] + 1) + footprint + PARAMETERS)
+
+# -----------------------------------------------------------------------------------
+# ----GENERATOR----
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+def generate(length=1000, iterations=1, mix=None, chain=1, width=1, branches=0.0, footprint=64, seed=0):
+    mix = dict(MIX if mix is None else mix)
+    for kind in mix:
+        if kind not in MIX:
+            raise ValueError('instruction classes are ' + ', '.join(MIX) + ', not ' + repr(kind))
+    if sum(mix.values()) <= 0:
+        raise ValueError('the mix needs a positive weight')
+    if not 1 <= width <= MAX_WIDTH:
+        raise ValueError('width must be between 1 and ' + str(MAX_WIDTH))
+    if length < 1 or iterations < 1 or chain < 1 or footprint < 1:
+        raise ValueError('length, iterations, chain and footprint must be at least 1')
+    if not 0 <= branches < 1:
+        raise ValueError('branches is a fraction of the body, from 0 up to 1')
+
+    rng = random.Random(seed)
+    size = memory_size(length, footprint)
+    top = size - PARAMETERS
+    data = top - footprint
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    instructions = [('VLOAD', size - 1, COUNTER), ('VLOAD', size - 2, ONE)]
+    instructions += [('VLOAD', top + i, r) for i, r in enumerate(INPUTS)]
+    body = len(instructions)
+    end = body + length
+    links = [0] * width
+    c = 0
+    for _ in range(length):
+        pc = len(instructions)
+        if branches and rng.random() < branches:
+            target = min(pc + 1 + rng.randint(1, 4), end)
+            instructions.append(('BRANCH_LT', c, rng.choice(INPUTS), target))
+            continue
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'load':
+            # a load starts a new chain
+            instructions.append(('VLOAD', data + rng.randrange(footprint), c))
+            links[c] = 1
+        elif kind == 'store':
+            instructions.append(('VSTORE', data + rng.randrange(footprint), c))
+            links[c] += 1
+        else:
+            op = 'MUL' if kind == 'mul' else rng.choice(ALU_OPS)
+            if links[c] == 0:
+                instructions.append((op, rng.choice(INPUTS), rng.choice(INPUTS), c))
+            else:
+                instructions.append((op, c, rng.choice(INPUTS), c))
+            links[c] += 1
+        if links[c] >= chain:
+            links[c] = 0
+        c = (c + 1) % width
+    instructions += [
+        ('SUB', COUNTER, ONE, COUNTER),
+        ('BRANCH_ZERO', COUNTER, end + 3),
+        ('JUMP', body),
+        ('STOP',),
+    ]
+
+    spec = {
+        'mem_size': size,
+        'memory': [
+            {'address': size - 1, 'value': iterations},
+            {'address': size - 2, 'value': 1},
+            {'address': top, 'random': [-1, 1], 'count': len(INPUTS), 'seed': seed},
+            {'address': data, 'random': [-8, 8], 'count': footprint, 'seed': seed + 1},
+        ],
+        'workload': {'length': length, 'iterations': iterations, 'mix': mix, 'chain': chain, 'width': width,
+                     'branches': branches, 'footprint': footprint, 'seed': seed},
+    }
+    return place(instructions), spec
+
+# writes the program as assembly text and its memory spec next to it
+def save(path, program, spec):
+    write_text(path, program)
+    save_spec(spec_path(path), spec)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic program and its memory spec.')
+    parser.add_argument('output', help='assembly file to write, the spec goes next to it as .init.json')
+    parser.add_argument('--length', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=1)
+    parser.add_argument('--mix', type=parse_mix, default=None, help='e.g. alu=6,mul=1,load=2,store=1')
+    parser.add_argument('--chain', type=int, default=1)
+    parser.add_argument('--width', type=int, default=1)
+    parser.add_argument('--branches', type=float, default=0.0)
+    parser.add_argument('--footprint', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    program, spec = generate(args.length, args.iterations, args.mix, args.chain, args.width, args.branches,
+                             args.footprint, args.seed)
+    save(args.output, program, spec)
+    print('wrote ' + str(len(program)) + ' instructions to ' + args.output + ' and its memory spec to '
+          + spec_path(args.output))